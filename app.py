@@ -34,11 +34,12 @@ login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'info'
 
-# Create all database tables
+# Bring the database schema up to date
 with app.app_context():
-    # Import models here to avoid circular imports
-    from models import User, Product, Vendor, InventoryTransaction, Sale, Staff, Shift
-    db.create_all()
+    import low_stock  # noqa: F401 - keeps Product.low_stock_since up to date
+    from migrations import run_migrations, migrate_command
+    run_migrations()
+    app.cli.add_command(migrate_command)
 
 # Register blueprints
 with app.app_context():
@@ -54,6 +55,9 @@ with app.app_context():
     from sales import sales as sales_blueprint
     app.register_blueprint(sales_blueprint)
     
+    from purchasing import purchasing as purchasing_blueprint
+    app.register_blueprint(purchasing_blueprint)
+    
     from routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
     
@@ -61,7 +65,7 @@ with app.app_context():
     app.register_blueprint(staff_blueprint)
     
     # Add utility functions to template context
-    from utils import (get_low_stock_products, get_products_by_category, 
+    from utils import (get_low_stock_products, get_low_stock_count, get_products_by_category, 
                       get_inventory_value, get_transaction_history, 
                       format_currency, get_category_value_distribution,
                       get_transaction_summary)
@@ -70,6 +74,7 @@ with app.app_context():
     def utility_processor():
         return {
             'get_low_stock_products': get_low_stock_products,
+            'get_low_stock_count': get_low_stock_count,
             'get_products_by_category': get_products_by_category,
             'get_inventory_value': get_inventory_value,
             'get_transaction_history': get_transaction_history,
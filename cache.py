@@ -0,0 +1,136 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries expire after `ttl` seconds.
+    Entries can carry tags so everything derived from one table can be
+    dropped at once.
+    """
+
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires_at, _ = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, tags=(), ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (value, expires_at, frozenset(tags))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags):
+        """
+        Drop every entry carrying any of the given tags
+        """
+        tags = set(tags)
+        with self._lock:
+            stale = [key for key, (_, _, entry_tags) in self._entries.items() if entry_tags & tags]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Process-wide cache for derived dashboard and chart data. Writes in this
+# process invalidate entries on commit; the TTL bounds how stale other
+# worker processes can get.
+cache = TTLCache(
+    maxsize=int(os.environ.get('CACHE_MAX_ENTRIES', 256)),
+    ttl=int(os.environ.get('CACHE_TTL', 60))
+)
+
+_MISSING = object()
+
+
+def cached(*tags, ttl=None):
+    """
+    Cache a function's result per argument tuple. Tags are the names of the
+    tables the result is derived from; a committed write to any of them
+    drops the entry. Results must be plain data or Row tuples, not ORM
+    instances bound to a session.
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (func.__module__, func.__qualname__, args, tuple(sorted(kwargs.items())))
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = func(*args, **kwargs)
+                cache.set(key, value, tags=tags, ttl=ttl)
+            return value
+        return wrapper
+    return decorator
+
+
+# Track which tables a session writes to and invalidate their cache tags
+# once the transaction commits. Unit-of-work flushes are seen through
+# after_flush, bulk and Core-style DML through do_orm_execute.
+_TOUCHED = 'cache_touched_tables'
+
+
+def _touch(session, table_names):
+    session.info.setdefault(_TOUCHED, set()).update(table_names)
+
+
+def touched_tables(session):
+    """
+    Names of the tables written so far in the session's current transaction
+    """
+    return frozenset(session.info.get(_TOUCHED, ()))
+
+
+@event.listens_for(Session, 'after_flush')
+def _record_flushed_tables(session, flush_context):
+    _touch(session, {
+        obj.__table__.name
+        for obj in (*session.new, *session.dirty, *session.deleted)
+        if hasattr(obj, '__table__')
+    })
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _record_executed_tables(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        table = getattr(orm_execute_state.statement, 'table', None)
+        if table is not None:
+            _touch(orm_execute_state.session, {table.name})
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_committed_tables(session):
+    touched = session.info.pop(_TOUCHED, None)
+    if touched:
+        cache.invalidate(*touched)
+
+
+@event.listens_for(Session, 'after_soft_rollback')
+def _forget_rolled_back_tables(session, previous_transaction):
+    if not session.in_transaction():
+        session.info.pop(_TOUCHED, None)
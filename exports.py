@@ -0,0 +1,190 @@
+"""
+Streaming report exports.
+
+Rows are read from a server-side cursor in batches (yield_per) and written
+out as they arrive, so a download never holds the whole result in memory
+and the first bytes go out as soon as the first batch is fetched.
+
+CSV is always available. Parquet and Arrow IPC need the optional pyarrow
+package (`pip install .[columnar]`); each cursor batch becomes one Parquet
+row group or Arrow record batch, typed from the selected SQL columns.
+"""
+import csv
+import io
+from flask import Response, stream_with_context
+from sqlalchemy import Boolean, Date, DateTime, Float, Integer, Numeric
+from app import db
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Rows fetched from the cursor and written per chunk
+EXPORT_BATCH_SIZE = 1000
+
+# Rows per Parquet row group / Arrow record batch
+COLUMNAR_BATCH_SIZE = 64 * 1024
+
+# format name -> (file extension, mimetype)
+EXPORT_FORMATS = {
+    'csv': ('csv', 'text/csv'),
+    'parquet': ('parquet', 'application/vnd.apache.parquet'),
+    'arrow': ('arrow', 'application/vnd.apache.arrow.file'),
+}
+
+
+def iter_batches(statement, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Execute a select and yield its rows in lists of up to batch_size
+    """
+    result = db.session.execute(statement.execution_options(yield_per=batch_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+
+def csv_chunks(headers, batches, format_row=tuple):
+    """
+    Yield the CSV header line, then one chunk of CSV text per batch of rows
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+
+    def drain():
+        text = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return text
+
+    writer.writerow(headers)
+    yield drain()
+    for batch in batches:
+        writer.writerows(format_row(row) for row in batch)
+        yield drain()
+
+
+def attachment_response(chunks, filename, mimetype):
+    """
+    Stream chunks to the client as a file download
+    """
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+
+def columnar_available():
+    return pa is not None
+
+
+def arrow_type(sql_type):
+    """
+    Arrow type for a SQLAlchemy column type
+    """
+    if isinstance(sql_type, Boolean):
+        return pa.bool_()
+    if isinstance(sql_type, Integer):
+        return pa.int64()
+    if isinstance(sql_type, (Float, Numeric)):
+        return pa.float64()
+    if isinstance(sql_type, DateTime):
+        return pa.timestamp('us')
+    if isinstance(sql_type, Date):
+        return pa.date32()
+    return pa.string()
+
+
+def arrow_schema(headers, statement):
+    return pa.schema([
+        pa.field(name, arrow_type(column.type))
+        for name, column in zip(headers, statement.selected_columns)
+    ])
+
+
+def record_batches(schema, batches):
+    for batch in batches:
+        columns = list(zip(*batch))
+        yield pa.record_batch(
+            [pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+            schema=schema
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file object whose contents can be drained between writes.
+    tell() keeps counting across drains so writers can record offsets.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def columnar_chunks(export_format, headers, batches, statement):
+    """
+    Yield a Parquet or Arrow IPC file, one chunk per written batch
+    """
+    schema = arrow_schema(headers, statement)
+    sink = _ChunkSink()
+
+    if export_format == 'parquet':
+        writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    else:
+        writer = pa.ipc.new_file(sink, schema)
+
+    try:
+        for record_batch in record_batches(schema, batches):
+            writer.write_batch(record_batch)
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def split_batches(rows, batch_size):
+    """
+    Yield already-fetched rows in lists of up to batch_size
+    """
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+
+def export_response(export_format, basename, headers, statement, format_row=tuple, rows=None):
+    """
+    Stream the rows of a select as a download in the given format. CSV
+    rows go through format_row; columnar formats keep the raw typed values.
+    If the select's rows were already fetched, pass them as rows and the
+    statement is only used for its column types.
+    """
+    extension, mimetype = EXPORT_FORMATS[export_format]
+    batch_size = EXPORT_BATCH_SIZE if export_format == 'csv' else COLUMNAR_BATCH_SIZE
+    batches = iter_batches(statement, batch_size) if rows is None else split_batches(rows, batch_size)
+
+    if export_format == 'csv':
+        chunks = csv_chunks(headers, batches, format_row)
+    else:
+        chunks = columnar_chunks(export_format, headers, batches, statement)
+
+    return attachment_response(chunks, f'{basename}.{extension}', mimetype)
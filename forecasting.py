@@ -0,0 +1,210 @@
+"""
+Demand forecasting and reorder points.
+
+Daily demand for every product is loaded into one products x days NumPy
+matrix: quantities taken by usage transactions (leaving out reverted sales
+imports) plus units sold of products without a recipe, whose sales do not
+deplete any ingredient. Days before a product's first activity are masked
+out so new products are not averaged against empty history.
+
+Forecast demand is an exponentially weighted (ewma) or simple moving
+average (sma) of each row, taken for all products at once as a weighted
+sum over the day axis, together with the weighted standard deviation.
+From those, with a fixed lead time and service level:
+
+    safety stock  = z * std * sqrt(lead time)
+    reorder point = demand * lead time + safety stock
+
+Results are stored in ReorderSuggestion; apply_suggestions() copies the
+reorder points into Product.min_quantity.
+"""
+import logging
+import os
+from datetime import datetime, timedelta
+from statistics import NormalDist
+import numpy as np
+from sqlalchemy import String, cast, delete, func, insert, or_, select, update
+from app import db
+from low_stock import low_stock_since_value
+from models import Product, InventoryTransaction, ImportBatch, RecipeItem, ReorderSuggestion, SalesDailyRollup
+
+logger = logging.getLogger(__name__)
+
+# Days of history behind each forecast
+FORECAST_HISTORY_DAYS = int(os.environ.get('FORECAST_HISTORY_DAYS', 365))
+# Products with fewer days of activity get no suggestion
+FORECAST_MIN_HISTORY_DAYS = int(os.environ.get('FORECAST_MIN_HISTORY_DAYS', 14))
+# Days between reordering and the stock arriving
+FORECAST_LEAD_TIME_DAYS = float(os.environ.get('FORECAST_LEAD_TIME_DAYS', 3))
+# Chance of not running out during the lead time
+FORECAST_SERVICE_LEVEL = float(os.environ.get('FORECAST_SERVICE_LEVEL', 0.95))
+# Weight of the latest day in the exponentially weighted average
+FORECAST_SMOOTHING = float(os.environ.get('FORECAST_SMOOTHING', 0.1))
+# Days in the simple moving average
+FORECAST_WINDOW_DAYS = int(os.environ.get('FORECAST_WINDOW_DAYS', 28))
+
+FORECAST_METHODS = ('ewma', 'sma')
+
+
+def _day_numbers(values):
+    """Days since the epoch of a sequence of ISO date strings"""
+    return np.array(values, dtype='datetime64[D]').astype(np.int64)
+
+
+def demand_history(start, end):
+    """
+    Daily demand of every product on the days from start up to end.
+    Returns (product ids, first active day index per product, demand
+    matrix of shape (products, days)).
+    """
+    # Core rows with days as ISO strings, which NumPy parses in bulk
+    connection = db.session.connection()
+    origin = np.datetime64(start.date(), 'D').astype(np.int64)
+
+    products = connection.execute(
+        select(Product.id, cast(func.coalesce(func.date(Product.created_at), start.date().isoformat()), String))
+        .order_by(Product.id)
+    ).all()
+    product_ids = np.array([product_id for product_id, _ in products], dtype=np.int64)
+    first_day = _day_numbers([created for _, created in products]) - origin
+
+    n_days = (end - start).days
+    demand = np.zeros((len(product_ids), n_days))
+
+    def add(statement, exclude=()):
+        rows = connection.execute(statement).all()
+        if not rows:
+            return
+        ids, days, quantities = zip(*rows)
+        ids = np.array(ids, dtype=np.int64)
+        keep = ~np.isin(ids, np.array(list(exclude), dtype=np.int64))
+        rows_index = np.searchsorted(product_ids, ids[keep])
+        days_index = _day_numbers(days)[keep] - origin
+        np.add.at(demand, (rows_index, days_index), np.array(quantities, dtype=float)[keep])
+
+    usage_day = func.date(InventoryTransaction.transaction_date)
+    add(
+        select(InventoryTransaction.product_id, cast(usage_day, String), func.sum(InventoryTransaction.quantity))
+        .outerjoin(ImportBatch, InventoryTransaction.import_batch_id == ImportBatch.id)
+        .where(
+            InventoryTransaction.transaction_type == 'usage',
+            InventoryTransaction.transaction_date >= start,
+            InventoryTransaction.transaction_date < end,
+            or_(ImportBatch.id.is_(None), ImportBatch.status != 'reverted')
+        ).group_by(InventoryTransaction.product_id, usage_day)
+    )
+
+    # Sales of products with a recipe are already counted as their ingredients' usage
+    add(
+        select(SalesDailyRollup.product_id, cast(SalesDailyRollup.day, String), SalesDailyRollup.quantity)
+        .where(SalesDailyRollup.day >= start.date(), SalesDailyRollup.day < end.date()),
+        exclude=set(connection.execute(select(RecipeItem.product_id).distinct()).scalars())
+    )
+
+    # History imported from before a product was created still counts
+    active = demand > 0
+    first_demand = np.where(active.any(axis=1), active.argmax(axis=1), n_days)
+    first_day = np.clip(np.minimum(first_day, first_demand), 0, n_days)
+    return product_ids, first_day, demand
+
+
+def day_weights(n_days, method):
+    """
+    Weight of each day of history, oldest first, for a forecast method
+    """
+    if method == 'sma':
+        weights = np.zeros(n_days)
+        weights[-FORECAST_WINDOW_DAYS:] = 1.0
+        return weights
+    age = np.arange(n_days - 1, -1, -1)
+    return FORECAST_SMOOTHING * (1 - FORECAST_SMOOTHING) ** age
+
+
+def forecast(demand, first_day, method='ewma', lead_time=None, service_level=None):
+    """
+    Forecast every row of a demand matrix at once. Returns a dict of arrays:
+    daily_demand, demand_std, safety_stock, reorder_point, history_days and
+    weighted (False where no active day carries any weight).
+    """
+    lead_time = FORECAST_LEAD_TIME_DAYS if lead_time is None else lead_time
+    service_level = FORECAST_SERVICE_LEVEL if service_level is None else service_level
+
+    n_days = demand.shape[1]
+    active = np.arange(n_days)[np.newaxis, :] >= first_day[:, np.newaxis]
+    weights = active * day_weights(n_days, method)[np.newaxis, :]
+    total = weights.sum(axis=1)
+    safe_total = np.where(total > 0, total, 1.0)
+
+    daily_demand = (demand * weights).sum(axis=1) / safe_total
+    variance = ((demand - daily_demand[:, np.newaxis]) ** 2 * weights).sum(axis=1) / safe_total
+    demand_std = np.sqrt(variance)
+
+    z = NormalDist().inv_cdf(service_level)
+    safety_stock = z * demand_std * np.sqrt(lead_time)
+    return {
+        'daily_demand': daily_demand,
+        'demand_std': demand_std,
+        'safety_stock': safety_stock,
+        'reorder_point': daily_demand * lead_time + safety_stock,
+        'history_days': active.sum(axis=1),
+        'weighted': total > 0,
+    }
+
+
+def compute_reorder_suggestions(method='ewma', as_of=None):
+    """
+    Forecast demand for every product and replace the stored
+    ReorderSuggestion rows. Returns the number of suggestions stored.
+    """
+    if method not in FORECAST_METHODS:
+        raise ValueError(f'method must be one of {", ".join(FORECAST_METHODS)}')
+
+    end = datetime.combine((as_of or datetime.utcnow()).date(), datetime.min.time())
+    start = end - timedelta(days=FORECAST_HISTORY_DAYS)
+    product_ids, first_day, demand = demand_history(start, end)
+    results = forecast(demand, first_day, method)
+
+    keep = (results['weighted'] & (results['history_days'] >= FORECAST_MIN_HISTORY_DAYS)
+            & demand.any(axis=1))
+    now = datetime.utcnow()
+    rows = [{
+        'product_id': int(product_id),
+        'method': method,
+        'daily_demand': round(float(daily_demand), 4),
+        'demand_std': round(float(demand_std), 4),
+        'lead_time_days': FORECAST_LEAD_TIME_DAYS,
+        'safety_stock': round(float(safety_stock), 2),
+        'reorder_point': round(float(reorder_point), 2),
+        'history_days': int(history_days),
+        'computed_at': now,
+    } for product_id, daily_demand, demand_std, safety_stock, reorder_point, history_days in zip(
+        product_ids[keep], results['daily_demand'][keep], results['demand_std'][keep],
+        results['safety_stock'][keep], results['reorder_point'][keep], results['history_days'][keep]
+    )]
+
+    db.session.execute(delete(ReorderSuggestion))
+    if rows:
+        db.session.execute(insert(ReorderSuggestion), rows)
+    db.session.commit()
+    logger.info('Stored %s reorder suggestions (%s products, %s days)', len(rows), *demand.shape)
+    return len(rows)
+
+
+def apply_suggestions():
+    """
+    Set each product's min_quantity to its suggested reorder point in one
+    statement, updating its low-stock state to match. Returns the number
+    of products changed.
+    """
+    result = db.session.execute(
+        update(Product).where(
+            Product.id == ReorderSuggestion.product_id,
+            or_(Product.min_quantity.is_(None), Product.min_quantity != ReorderSuggestion.reorder_point)
+        ).values(
+            min_quantity=ReorderSuggestion.reorder_point,
+            low_stock_since=low_stock_since_value(Product.quantity, ReorderSuggestion.reorder_point),
+            updated_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
@@ -81,6 +81,15 @@ class CategoryForm(FlaskForm):
     description = TextAreaField('Description')
     submit = SubmitField('Save Category')
 
+class RecipeItemForm(FlaskForm):
+    ingredient_id = SelectField('Ingredient', coerce=int, validators=[DataRequired()])
+    quantity = FloatField('Quantity per Unit Sold', validators=[DataRequired(), NumberRange(min=0.0001)])
+    submit = SubmitField('Add Ingredient')
+
+class PurchaseOrderGenerateForm(FlaskForm):
+    target_days = FloatField('Days of Cover', validators=[DataRequired(), NumberRange(min=1, max=365)])
+    submit = SubmitField('Generate Draft Orders')
+
 class InventoryTransactionForm(FlaskForm):
     product_id = SelectField('Product', coerce=int, validators=[DataRequired()])
     transaction_type = SelectField('Transaction Type', 
@@ -102,7 +111,11 @@ class ReportForm(FlaskForm):
                             validators=[DataRequired()])
     start_date = DateField('Start Date', format='%Y-%m-%d', validators=[Optional()])
     end_date = DateField('End Date', format='%Y-%m-%d', validators=[Optional()])
+    export_format = SelectField('File Format',
+                                choices=[('csv', 'CSV'), ('parquet', 'Parquet'), ('arrow', 'Arrow IPC')],
+                                default='csv')
     submit = SubmitField('Generate Report')
+    generate_file = SubmitField('Generate File in Background')
     
 class SalesUploadForm(FlaskForm):
     csv_file = FileField('CSV File', validators=[
@@ -164,3 +177,7 @@ class ShiftForm(FlaskForm):
         if self.start_time.data and end_time.data:
             if end_time.data <= self.start_time.data:
                 raise ValidationError('End time must be after start time')
+    
+    def validate_end_date(self, end_date):
+        if self.start_date.data and end_date.data and end_date.data < self.start_date.data:
+            raise ValidationError('End date must be on or after the start date')
@@ -1,36 +1,86 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+import click
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
-from sqlalchemy import desc
+from sqlalchemy import desc, exists, select
+from sqlalchemy.orm import joinedload
 from app import db
-from models import Product, Category, Vendor, InventoryTransaction
-from forms import ProductForm, CategoryForm, VendorForm, InventoryTransactionForm
+from models import (Product, Category, Vendor, InventoryTransaction, RecipeItem, StockLedgerEntry, StockSnapshot,
+                    ReorderSuggestion, PurchaseOrder, PurchaseOrderLine, Sale, SalesDailyRollup)
+from forms import ProductForm, CategoryForm, VendorForm, InventoryTransactionForm, RecipeItemForm
+from search import product_search_filter
+from ledger import record_stock_change, take_snapshots, valuation_as_of
+from forecasting import FORECAST_METHODS, apply_suggestions, compute_reorder_suggestions
+from stock import InsufficientStockError, MAX_BATCH_LINES, parse_transaction_line, post_transaction, post_transactions
+from queries import categories_with_product_counts, vendors_with_product_counts, count_products
 from datetime import datetime
 
 inventory = Blueprint('inventory', __name__)
 
+@inventory.cli.command('snapshot')
+@click.option('--as-of', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%dT%H:%M']), default=None,
+              help='Snapshot time (default: start of today, UTC)')
+def snapshot_command(as_of):
+    """
+    Store each product's quantity on hand from the stock ledger
+    """
+    count = take_snapshots(as_of)
+    print(f'Stored {count} stock snapshots.')
+
+@inventory.cli.command('forecast')
+@click.option('--method', type=click.Choice(FORECAST_METHODS), default='ewma',
+              help='Exponentially weighted or simple moving average demand')
+@click.option('--apply', 'apply_thresholds', is_flag=True,
+              help='Also set each low stock threshold to its suggested reorder point')
+def forecast_command(method, apply_thresholds):
+    """
+    Forecast demand and store suggested low stock thresholds
+    """
+    count = compute_reorder_suggestions(method)
+    print(f'Stored {count} reorder suggestions.')
+    if apply_thresholds:
+        print(f'Updated the low stock threshold of {apply_suggestions()} products.')
+
+# Columns the inventory list may be sorted by
+PRODUCT_SORT_COLUMNS = {
+    'name': Product.name,
+    'sku': Product.sku,
+    'quantity': Product.quantity,
+    'unit': Product.unit,
+    'updated_at': Product.updated_at,
+}
+
+PRODUCTS_PER_PAGE = 50
+
 @inventory.route('/inventory')
 @login_required
 def inventory_list():
     search_query = request.args.get('search', '')
     sort_by = request.args.get('sort_by', 'name')
     sort_order = request.args.get('sort_order', 'asc')
+    page = request.args.get('page', 1, type=int)
+    
+    if sort_by not in PRODUCT_SORT_COLUMNS:
+        sort_by = 'name'
+    if sort_order not in ('asc', 'desc'):
+        sort_order = 'asc'
     
-    query = Product.query
+    query = Product.query.options(joinedload(Product.category), joinedload(Product.vendor))
     
     # Apply search filter if provided
     if search_query:
-        query = query.filter(Product.name.ilike(f'%{search_query}%') | 
-                             Product.sku.ilike(f'%{search_query}%'))
+        query = query.filter(*product_search_filter(search_query))
     
-    # Apply sorting
+    # Apply sorting, with the id as a tie-breaker so pages are stable
+    sort_column = PRODUCT_SORT_COLUMNS[sort_by]
     if sort_order == 'asc':
-        query = query.order_by(getattr(Product, sort_by))
+        query = query.order_by(sort_column, Product.id)
     else:
-        query = query.order_by(desc(getattr(Product, sort_by)))
+        query = query.order_by(desc(sort_column), desc(Product.id))
     
-    products = query.all()
+    pagination = query.paginate(page=page, per_page=PRODUCTS_PER_PAGE, error_out=False)
     return render_template('inventory_list.html', 
-                          products=products, 
+                          products=pagination.items,
+                          pagination=pagination,
                           search_query=search_query,
                           sort_by=sort_by,
                           sort_order=sort_order)
@@ -67,6 +117,9 @@ def create_product():
                 created_by=current_user.id
             )
             db.session.add(transaction)
+            db.session.flush()
+            record_stock_change(product.id, form.quantity.data, 'opening',
+                                transaction.transaction_date, transaction.id, current_user.id)
             db.session.commit()
             
         flash(f'Product "{product.name}" has been created successfully.', 'success')
@@ -94,21 +147,13 @@ def edit_product(id):
         product.category_id = form.category_id.data
         product.vendor_id = form.vendor_id.data
         
-        # Check if quantity changed
+        db.session.commit()
+        
+        # Check if quantity changed; the adjustment is applied atomically
         if old_quantity != form.quantity.data:
-            product.quantity = form.quantity.data
-            # Create adjustment transaction
-            adjustment = form.quantity.data - old_quantity
-            transaction = InventoryTransaction(
-                product_id=product.id,
-                transaction_type='adjustment',
-                quantity=adjustment,
-                notes=f'Manual adjustment: {old_quantity} -> {form.quantity.data}',
-                created_by=current_user.id
-            )
-            db.session.add(transaction)
+            post_transaction(product.id, 'adjustment', form.quantity.data,
+                             user_id=current_user.id, adjustment_label='Manual adjustment')
         
-        db.session.commit()
         flash(f'Product "{product.name}" has been updated successfully.', 'success')
         return redirect(url_for('inventory.inventory_list'))
     
@@ -120,7 +165,25 @@ def delete_product(id):
     product = Product.query.get_or_404(id)
     name = product.name
     
-    # Delete associated transactions first
+    # Sales and received orders are records that must keep their product
+    has_history = db.session.scalar(select(
+        exists().where(Sale.product_id == id) | exists().where(
+            PurchaseOrderLine.product_id == id,
+            PurchaseOrderLine.purchase_order_id == PurchaseOrder.id,
+            PurchaseOrder.status == 'received'
+        )
+    ))
+    if has_history:
+        flash(f'Cannot delete product "{name}" as it has sales or received purchase orders.', 'danger')
+        return redirect(url_for('inventory.inventory_list'))
+    
+    # Delete associated recipes, suggestions, open order lines and stock history first
+    RecipeItem.query.filter((RecipeItem.product_id == id) | (RecipeItem.ingredient_id == id)).delete()
+    ReorderSuggestion.query.filter_by(product_id=id).delete()
+    PurchaseOrderLine.query.filter_by(product_id=id).delete()
+    SalesDailyRollup.query.filter_by(product_id=id).delete()
+    StockSnapshot.query.filter_by(product_id=id).delete()
+    StockLedgerEntry.query.filter_by(product_id=id).delete()
     InventoryTransaction.query.filter_by(product_id=id).delete()
     
     db.session.delete(product)
@@ -128,6 +191,39 @@ def delete_product(id):
     flash(f'Product "{name}" has been deleted successfully.', 'success')
     return redirect(url_for('inventory.inventory_list'))
 
+@inventory.route('/inventory/<int:id>/recipe', methods=['GET', 'POST'])
+@login_required
+def product_recipe(id):
+    """
+    Ingredients used by one unit of a product, depleted when its sales are imported
+    """
+    product = Product.query.get_or_404(id)
+    form = RecipeItemForm()
+    form.ingredient_id.choices = [(p.id, f'{p.name} ({p.unit})') for p in
+                                  Product.query.filter(Product.id != id).order_by('name')]
+    
+    if form.validate_on_submit():
+        item = RecipeItem.query.filter_by(product_id=id, ingredient_id=form.ingredient_id.data).first()
+        if item is None:
+            item = RecipeItem(product_id=id, ingredient_id=form.ingredient_id.data)
+            db.session.add(item)
+        item.quantity = form.quantity.data
+        db.session.commit()
+        flash(f'Recipe for "{product.name}" has been updated.', 'success')
+        return redirect(url_for('inventory.product_recipe', id=id))
+    
+    items = RecipeItem.query.options(joinedload(RecipeItem.ingredient)).filter_by(product_id=id).all()
+    return render_template('recipe.html', form=form, product=product, items=items)
+
+@inventory.route('/inventory/<int:id>/recipe/<int:item_id>/delete', methods=['POST'])
+@login_required
+def delete_recipe_item(id, item_id):
+    item = RecipeItem.query.filter_by(id=item_id, product_id=id).first_or_404()
+    db.session.delete(item)
+    db.session.commit()
+    flash('Ingredient removed from the recipe.', 'success')
+    return redirect(url_for('inventory.product_recipe', id=id))
+
 @inventory.route('/inventory/transaction', methods=['GET', 'POST'])
 @login_required
 def add_transaction():
@@ -135,29 +231,21 @@ def add_transaction():
     form.product_id.choices = [(p.id, p.name) for p in Product.query.order_by('name')]
     
     if form.validate_on_submit():
-        product = Product.query.get(form.product_id.data)
-        transaction = InventoryTransaction(
-            product_id=form.product_id.data,
-            transaction_type=form.transaction_type.data,
-            quantity=form.quantity.data,
-            notes=form.notes.data,
-            transaction_date=form.transaction_date.data,
-            created_by=current_user.id
-        )
-        
-        # Update product quantity based on transaction type
-        if form.transaction_type.data == 'purchase':
-            product.quantity += form.quantity.data
-        elif form.transaction_type.data == 'usage':
-            if product.quantity < form.quantity.data:
-                flash(f'Not enough stock available for {product.name}. Current: {product.quantity} {product.unit}', 'danger')
-                return render_template('inventory_transaction.html', form=form, title='Add Transaction')
-            product.quantity -= form.quantity.data
-        elif form.transaction_type.data == 'adjustment':
-            product.quantity = form.quantity.data
-        
-        db.session.add(transaction)
-        db.session.commit()
+        # Applied with atomic updates so concurrent transactions cannot lose stock
+        try:
+            post_transaction(
+                form.product_id.data,
+                form.transaction_type.data,
+                form.quantity.data,
+                transaction_date=form.transaction_date.data,
+                notes=form.notes.data,
+                user_id=current_user.id
+            )
+        except InsufficientStockError:
+            db.session.rollback()
+            product = db.session.get(Product, form.product_id.data)
+            flash(f'Not enough stock available for {product.name}. Current: {product.quantity} {product.unit}', 'danger')
+            return render_template('inventory_transaction.html', form=form, title='Add Transaction')
         
         flash('Inventory transaction recorded successfully.', 'success')
         return redirect(url_for('inventory.inventory_list'))
@@ -168,7 +256,7 @@ def add_transaction():
 @inventory.route('/categories')
 @login_required
 def category_list():
-    categories = Category.query.order_by(Category.name).all()
+    categories = categories_with_product_counts()
     return render_template('categories.html', categories=categories)
 
 @inventory.route('/categories/create', methods=['GET', 'POST'])
@@ -209,7 +297,7 @@ def delete_category(id):
     category = Category.query.get_or_404(id)
     
     # Check if category is used by products
-    if len(category.products) > 0:
+    if count_products(Product.category_id == category.id) > 0:
         flash(f'Cannot delete category "{category.name}" as it is assigned to products.', 'danger')
         return redirect(url_for('inventory.category_list'))
     
@@ -223,7 +311,7 @@ def delete_category(id):
 @inventory.route('/vendors')
 @login_required
 def vendor_list():
-    vendors = Vendor.query.order_by(Vendor.name).all()
+    vendors = vendors_with_product_counts()
     return render_template('vendors.html', vendors=vendors)
 
 @inventory.route('/vendors/create', methods=['GET', 'POST'])
@@ -272,7 +360,7 @@ def delete_vendor(id):
     vendor = Vendor.query.get_or_404(id)
     
     # Check if vendor is used by products
-    if len(vendor.products) > 0:
+    if count_products(Product.vendor_id == vendor.id) > 0:
         flash(f'Cannot delete vendor "{vendor.name}" as it is assigned to products.', 'danger')
         return redirect(url_for('inventory.vendor_list'))
     
@@ -281,3 +369,47 @@ def delete_vendor(id):
     db.session.commit()
     flash(f'Vendor "{name}" has been deleted successfully.', 'success')
     return redirect(url_for('inventory.vendor_list'))
+
+@inventory.route('/api/inventory/as-of')
+@login_required
+def inventory_as_of():
+    """
+    API endpoint with every product's quantity and value at a point in time
+    (?at=YYYY-MM-DD or YYYY-MM-DDTHH:MM; a bare date means the start of that day)
+    """
+    try:
+        moment = datetime.fromisoformat(request.args.get('at', ''))
+    except ValueError:
+        return jsonify({'error': 'Pass the point in time as ?at=YYYY-MM-DD or YYYY-MM-DDTHH:MM'}), 400
+    
+    rows, total_value = valuation_as_of(moment)
+    return jsonify({'as_of': moment.isoformat(), 'total_value': total_value, 'products': rows})
+
+@inventory.route('/api/inventory/transactions', methods=['POST'])
+@login_required
+def post_inventory_transactions():
+    """
+    API endpoint that records a batch of purchase, usage and adjustment
+    transactions in one database transaction and reports a result per line.
+    Body: {"transactions": [{product_id, transaction_type, quantity,
+    transaction_date?, notes?}, ...], "all_or_nothing": false}
+    """
+    data = request.get_json(silent=True)
+    transactions = data.get('transactions') if isinstance(data, dict) else None
+    if not isinstance(transactions, list) or not transactions:
+        return jsonify({'error': 'Send a JSON object with a non-empty "transactions" list'}), 400
+    if len(transactions) > MAX_BATCH_LINES:
+        return jsonify({'error': f'A batch may hold at most {MAX_BATCH_LINES} transactions'}), 400
+    
+    lines = []
+    for line in transactions:
+        try:
+            lines.append(parse_transaction_line(line))
+        except ValueError as e:
+            lines.append(str(e))
+    
+    results = post_transactions(lines, user_id=current_user.id,
+                                all_or_nothing=bool(data.get('all_or_nothing')))
+    summary = {status: sum(1 for result in results if result['status'] == status)
+               for status in ('applied', 'rejected', 'skipped')}
+    return jsonify({**summary, 'results': results})
@@ -0,0 +1,30 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+# Background work runs on a small thread pool so request workers stay free.
+# Size it with BACKGROUND_WORKERS; imports are mostly I/O and database bound.
+executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get('BACKGROUND_WORKERS', 2)),
+    thread_name_prefix='background-job'
+)
+
+
+def submit_job(func, *args, **kwargs):
+    """
+    Run func(*args, **kwargs) on the background executor inside an app context
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                logger.exception('Background job %s failed', getattr(func, '__name__', func))
+                raise
+
+    return executor.submit(run)
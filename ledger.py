@@ -0,0 +1,152 @@
+"""
+Stock ledger and point-in-time inventory.
+
+Every change to a product's quantity on hand is appended to
+stock_ledger_entry as a signed delta, dated when it takes effect.
+StockSnapshot rows periodically fix the running total per product, so the
+quantity at any moment is the nearest earlier snapshot plus the entries
+between that snapshot and the moment, rather than a replay of the whole
+ledger. A snapshot stays valid until an entry is back-dated before it;
+recording such an entry discards the product's later snapshots.
+"""
+from datetime import datetime, time
+from sqlalchemy import and_, delete, func, insert, or_, select
+from app import db
+from models import Product, StockLedgerEntry, StockSnapshot
+from utils import dialect_insert
+
+
+def _as_datetime(value):
+    if value is None:
+        return datetime.utcnow()
+    if not isinstance(value, datetime):
+        return datetime.combine(value, time.min)
+    return value
+
+
+def record_stock_changes(changes):
+    """
+    Append signed quantity changes to the ledger in one statement. Each
+    change is a dict with product_id, entry_type and quantity_change, and
+    optionally entry_date, transaction_id and created_by.
+    """
+    if not changes:
+        return
+
+    now = datetime.utcnow()
+    rows = [{
+        'product_id': change['product_id'],
+        'entry_type': change['entry_type'],
+        'quantity_change': change['quantity_change'],
+        'entry_date': _as_datetime(change.get('entry_date')),
+        'transaction_id': change.get('transaction_id'),
+        'created_by': change.get('created_by'),
+        'created_at': now,
+    } for change in changes]
+    db.session.execute(insert(StockLedgerEntry), rows)
+
+    # Snapshots taken after a back-dated change no longer add up
+    earliest = {}
+    for row in rows:
+        product_id = row['product_id']
+        earliest[product_id] = min(earliest.get(product_id, row['entry_date']), row['entry_date'])
+    db.session.execute(delete(StockSnapshot).where(or_(*(
+        and_(StockSnapshot.product_id == product_id, StockSnapshot.as_of > entry_date)
+        for product_id, entry_date in earliest.items()
+    ))))
+
+
+def record_stock_change(product_id, change, entry_type, entry_date=None, transaction_id=None, user_id=None):
+    """
+    Append a signed quantity change for a product to the ledger
+    """
+    record_stock_changes([{
+        'product_id': product_id,
+        'entry_type': entry_type,
+        'quantity_change': change,
+        'entry_date': entry_date,
+        'transaction_id': transaction_id,
+        'created_by': user_id,
+    }])
+
+
+def quantities_as_of(moment, product_ids=None):
+    """
+    {product_id: quantity on hand} from every ledger entry dated before moment
+    """
+    latest = select(
+        StockSnapshot.product_id,
+        func.max(StockSnapshot.as_of).label('as_of')
+    ).where(StockSnapshot.as_of <= moment).group_by(StockSnapshot.product_id)
+    if product_ids is not None:
+        latest = latest.where(StockSnapshot.product_id.in_(product_ids))
+    latest = latest.subquery()
+
+    snapshots = db.session.execute(
+        select(StockSnapshot.product_id, StockSnapshot.quantity).join(latest, and_(
+            StockSnapshot.product_id == latest.c.product_id,
+            StockSnapshot.as_of == latest.c.as_of
+        ))
+    ).all()
+
+    deltas = select(
+        StockLedgerEntry.product_id,
+        func.sum(StockLedgerEntry.quantity_change)
+    ).outerjoin(latest, latest.c.product_id == StockLedgerEntry.product_id).where(
+        StockLedgerEntry.entry_date < moment,
+        or_(latest.c.as_of.is_(None), StockLedgerEntry.entry_date >= latest.c.as_of)
+    ).group_by(StockLedgerEntry.product_id)
+    if product_ids is not None:
+        deltas = deltas.where(StockLedgerEntry.product_id.in_(product_ids))
+
+    quantities = dict(snapshots)
+    for product_id, change in db.session.execute(deltas):
+        quantities[product_id] = quantities.get(product_id, 0.0) + change
+    return quantities
+
+
+def quantity_as_of(product_id, moment):
+    """
+    Quantity on hand of one product at moment
+    """
+    return quantities_as_of(moment, [product_id]).get(product_id, 0.0)
+
+
+def valuation_as_of(moment):
+    """
+    Quantity and value of every product at moment, valued at current prices.
+    Returns (rows of {'id', 'name', 'quantity', 'value'}, total value).
+    """
+    quantities = quantities_as_of(moment)
+    rows = []
+    for product_id, name, price in db.session.execute(
+            select(Product.id, Product.name, Product.price).order_by(Product.name)):
+        quantity = quantities.get(product_id, 0.0)
+        rows.append({'id': product_id, 'name': name, 'quantity': quantity, 'value': quantity * (price or 0.0)})
+    return rows, sum(row['value'] for row in rows)
+
+
+def take_snapshots(as_of=None):
+    """
+    Store every product's quantity from the ledger entries dated before
+    as_of (default: the start of today). Returns the number of snapshots.
+    """
+    if as_of is None:
+        as_of = datetime.combine(datetime.utcnow().date(), time.min)
+
+    quantities = quantities_as_of(as_of)
+    if not quantities:
+        return 0
+
+    table = StockSnapshot.__table__
+    stmt = dialect_insert(db.session.get_bind(), table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[table.c.product_id, table.c.as_of],
+        set_={'quantity': stmt.excluded.quantity}
+    )
+    db.session.execute(stmt, [
+        {'product_id': product_id, 'as_of': as_of, 'quantity': quantity}
+        for product_id, quantity in quantities.items()
+    ])
+    db.session.commit()
+    return len(quantities)
@@ -0,0 +1,46 @@
+"""
+Incrementally maintained low-stock state.
+
+Product.low_stock_since holds the time a product last fell to or below its
+minimum quantity, and is NULL while it is adequately stocked. It changes
+only when a write crosses the threshold: ORM flushes are checked by the
+before_flush listener below, and set-based UPDATEs of quantity or
+min_quantity take their new value from low_stock_since_value().
+Low-stock queries are then an indexed lookup on the column.
+"""
+from datetime import datetime
+from sqlalchemy import case, event, func
+from sqlalchemy.orm import Session
+from models import Product
+
+
+def sync_low_stock(product, now=None):
+    """
+    Set or clear a product's low_stock_since after a change to its stock
+    """
+    if product.quantity is None or product.min_quantity is None:
+        return
+    if product.quantity <= product.min_quantity:
+        if product.low_stock_since is None:
+            product.low_stock_since = now or datetime.utcnow()
+    else:
+        product.low_stock_since = None
+
+
+def low_stock_since_value(quantity, min_quantity=Product.min_quantity, now=None):
+    """
+    SQL value of low_stock_since for an UPDATE that sets the given quantity
+    and min_quantity expressions
+    """
+    return case(
+        ((quantity - min_quantity) <= 0, func.coalesce(Product.low_stock_since, now or datetime.utcnow())),
+        else_=None
+    )
+
+
+@event.listens_for(Session, 'before_flush')
+def _track_low_stock(session, flush_context, instances):
+    now = datetime.utcnow()
+    for obj in (*session.new, *session.dirty):
+        if isinstance(obj, Product):
+            sync_low_stock(obj, now)
@@ -0,0 +1,270 @@
+"""
+Versioned schema migrations.
+
+Each migration is a function registered with @migration(version) and runs
+once per database, in version order, inside its own transaction. Applied
+versions are recorded in the schema_migration table. Each transaction
+holds a database-wide lock (BEGIN IMMEDIATE on SQLite, an advisory lock
+on PostgreSQL) and checks the version again under it, so processes
+starting at once do not run a migration twice. Migrations must be
+idempotent: a fresh database gets every table from the baseline
+create_all(), so later steps should check before altering anything.
+
+Migrations run automatically when the app starts and can be run by hand
+with `flask migrate`.
+"""
+import logging
+from datetime import datetime
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn, CreateIndex
+from app import db
+
+logger = logging.getLogger(__name__)
+
+schema_migration = db.Table(
+    'schema_migration',
+    db.Column('version', db.String(100), primary_key=True),
+    db.Column('applied_at', db.DateTime, nullable=False),
+)
+
+MIGRATIONS = []
+
+# PostgreSQL advisory lock key held while a migration runs
+MIGRATION_LOCK_KEY = 7340218
+
+
+def migration(version):
+    """
+    Register a migration function under a sortable version string
+    """
+    def decorator(func):
+        MIGRATIONS.append((version, func))
+        return func
+    return decorator
+
+
+def add_column(connection, model, column_name):
+    """
+    Add a model column to an existing table if it is missing
+    """
+    table = model.__table__
+    existing = {c['name'] for c in inspect(connection).get_columns(table.name)}
+    if column_name in existing:
+        return
+
+    column = table.c[column_name]
+    spec = str(CreateColumn(column).compile(dialect=connection.dialect))
+    for foreign_key in column.foreign_keys:
+        spec += f' REFERENCES {foreign_key.column.table.name} ({foreign_key.column.name})'
+
+    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {spec}'))
+    logger.info('Added column %s.%s', table.name, column_name)
+
+
+def create_table(connection, model):
+    """
+    Create a model's table (with its indexes) if it does not exist
+    """
+    model.__table__.create(bind=connection, checkfirst=True)
+
+
+def create_indexes(connection, *models):
+    """
+    Create every index declared on the given models that does not exist yet
+    """
+    for model in models:
+        table = model.__table__
+        existing = {c['name'] for c in inspect(connection).get_columns(table.name)}
+        for index in table.indexes:
+            # Indexes on columns added by a later migration are created there
+            if any(column.name not in existing for column in index.columns):
+                continue
+            # IF NOT EXISTS also covers expression indexes, which are not reflected
+            connection.execute(CreateIndex(index, if_not_exists=True))
+
+
+@migration('0001_initial_schema')
+def initial_schema(connection):
+    # Creates any missing table with its current columns and indexes;
+    # importing models registers every table on the shared metadata
+    from models import Product
+    Product.metadata.create_all(bind=connection)
+
+
+@migration('0002_sale_import_tracking')
+def sale_import_tracking(connection):
+    from models import Sale, ImportJob
+    add_column(connection, Sale, 'batch_id')
+    add_column(connection, Sale, 'natural_key')
+    add_column(connection, ImportJob, 'rows_duplicate')
+    add_column(connection, ImportJob, 'batch_id')
+    create_indexes(connection, Sale)
+
+
+@migration('0003_backfill_sales_rollup')
+def backfill_sales_rollup(connection):
+    connection.execute(text(
+        'INSERT INTO sales_daily_rollup (product_id, day, quantity, revenue, sale_count) '
+        'SELECT product_id, DATE(sale_date), SUM(quantity), SUM(total), COUNT(id) '
+        'FROM sale '
+        'WHERE NOT EXISTS (SELECT 1 FROM sales_daily_rollup) '
+        'GROUP BY product_id, DATE(sale_date)'
+    ))
+
+
+@migration('0004_hot_path_indexes')
+def hot_path_indexes(connection):
+    from models import Product, InventoryTransaction, Sale, SalesDailyRollup, Shift
+    create_indexes(connection, Product, InventoryTransaction, Sale, SalesDailyRollup, Shift)
+
+
+@migration('0005_data_versions')
+def data_versions(connection):
+    from models import DataVersion
+    create_table(connection, DataVersion)
+
+
+@migration('0006_product_search_index')
+def product_search_index(connection):
+    from search import create_search_index
+    create_search_index(connection)
+
+
+@migration('0007_report_jobs')
+def report_jobs(connection):
+    from models import ReportJob
+    create_table(connection, ReportJob)
+
+
+@migration('0008_product_low_stock_since')
+def product_low_stock_since(connection):
+    from models import Product
+    add_column(connection, Product, 'low_stock_since')
+    create_indexes(connection, Product)
+    # The stock margin index served the old low-stock expression
+    connection.execute(text('DROP INDEX IF EXISTS ix_product_stock_margin'))
+    # When a product went low is not recorded; its last update is the best estimate
+    connection.execute(text(
+        'UPDATE product SET low_stock_since = COALESCE(updated_at, created_at, CURRENT_TIMESTAMP) '
+        'WHERE quantity <= min_quantity AND low_stock_since IS NULL'
+    ))
+
+
+@migration('0009_stock_ledger')
+def stock_ledger(connection):
+    from models import StockLedgerEntry, StockSnapshot
+    create_table(connection, StockLedgerEntry)
+    create_table(connection, StockSnapshot)
+    # Earlier history cannot be replayed reliably, so the ledger opens with
+    # each product's quantity at the time of the migration
+    connection.execute(text(
+        "INSERT INTO stock_ledger_entry (product_id, entry_type, quantity_change, entry_date, created_at) "
+        "SELECT id, 'opening', quantity, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP FROM product "
+        "WHERE quantity IS NOT NULL AND quantity != 0 "
+        "AND NOT EXISTS (SELECT 1 FROM stock_ledger_entry)"
+    ))
+
+
+@migration('0010_recipes')
+def recipes(connection):
+    from models import InventoryTransaction, RecipeItem
+    create_table(connection, RecipeItem)
+    add_column(connection, InventoryTransaction, 'import_batch_id')
+    create_indexes(connection, InventoryTransaction)
+
+
+@migration('0011_reorder_suggestions')
+def reorder_suggestions(connection):
+    from models import ReorderSuggestion
+    create_table(connection, ReorderSuggestion)
+
+
+@migration('0012_purchase_orders')
+def purchase_orders(connection):
+    from models import PurchaseOrder, PurchaseOrderLine
+    create_table(connection, PurchaseOrder)
+    create_table(connection, PurchaseOrderLine)
+
+
+@migration('0013_shift_recurrence')
+def shift_recurrence(connection):
+    from models import Shift, ShiftException
+    add_column(connection, Shift, 'recurrence_end_date')
+    create_table(connection, ShiftException)
+
+
+@migration('0014_import_job_heartbeat')
+def import_job_heartbeat(connection):
+    from models import ImportJob
+    add_column(connection, ImportJob, 'heartbeat_at')
+
+
+@migration('0015_partial_low_stock_index')
+def partial_low_stock_index(connection):
+    from models import Product
+    # 0008 created a plain index the planner skips for row queries; a
+    # database migrated since gets the partial one there already
+    connection.execute(text('DROP INDEX IF EXISTS ix_product_low_stock_since'))
+    create_indexes(connection, Product)
+
+
+def applied_versions(connection):
+    return {row[0] for row in connection.execute(schema_migration.select())}
+
+
+def lock_migrations(connection):
+    """
+    Hold the database-wide migration lock until the connection's
+    transaction ends, so app processes starting together apply each
+    migration once, one at a time
+    """
+    dialect = connection.dialect.name
+    if dialect == 'sqlite':
+        # Take the write lock up front instead of at the first write
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    elif dialect == 'postgresql':
+        connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': MIGRATION_LOCK_KEY})
+
+
+def run_migrations(engine=None):
+    """
+    Apply every pending migration in version order.
+    Returns the list of versions applied.
+    """
+    engine = engine or db.engine
+
+    with engine.connect() as connection:
+        done = applied_versions(connection) if inspect(connection).has_table(schema_migration.name) else set()
+    pending = [(version, func) for version, func in sorted(MIGRATIONS, key=lambda m: m[0]) if version not in done]
+
+    applied = []
+    for version, func in pending:
+        with engine.begin() as connection:
+            lock_migrations(connection)
+            schema_migration.create(bind=connection, checkfirst=True)
+            # Another process may have applied it while this one waited for the lock
+            if version in applied_versions(connection):
+                logger.info('Migration %s was applied by another process', version)
+                continue
+            func(connection)
+            connection.execute(schema_migration.insert().values(
+                version=version, applied_at=datetime.utcnow()))
+        logger.info('Applied migration %s', version)
+        applied.append(version)
+
+    return applied
+
+
+@click.command('migrate')
+@with_appcontext
+def migrate_command():
+    """
+    Apply pending database migrations
+    """
+    applied = run_migrations()
+    if applied:
+        click.echo(f'Applied {len(applied)} migration(s): {", ".join(applied)}')
+    else:
+        click.echo('Database schema is up to date.')
@@ -1,6 +1,7 @@
 from datetime import datetime
 from app import db, login_manager
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
 
 @login_manager.user_loader
@@ -58,29 +59,42 @@ class Product(db.Model):
     quantity = db.Column(db.Float, default=0.0)
     min_quantity = db.Column(db.Float, default=1.0)  # Low stock threshold
     price = db.Column(db.Float, default=0.0)  # Cost price
-    category_id = db.Column(db.Integer, db.ForeignKey('category.id'))
-    vendor_id = db.Column(db.Integer, db.ForeignKey('vendor.id'))
+    category_id = db.Column(db.Integer, db.ForeignKey('category.id'), index=True)
+    vendor_id = db.Column(db.Integer, db.ForeignKey('vendor.id'), index=True)
+    low_stock_since = db.Column(db.DateTime)  # Set while quantity <= min_quantity, see low_stock.py
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
     transactions = db.relationship('InventoryTransaction', backref='product', lazy=True)
     
-    @property
+    @hybrid_property
     def is_low_stock(self):
         return self.quantity <= self.min_quantity
     
+    @is_low_stock.expression
+    def is_low_stock(cls):
+        # Maintained on every threshold crossing, so this is an index lookup
+        return cls.low_stock_since.isnot(None)
+    
     def __repr__(self):
         return f'<Product {self.name}>'
 
+# Partial, so it holds only the few low products and the planner reads it
+# for the low-stock lists instead of scanning every product
+db.Index('ix_product_low_stock', Product.low_stock_since,
+         sqlite_where=Product.low_stock_since.isnot(None),
+         postgresql_where=Product.low_stock_since.isnot(None))
+
 class InventoryTransaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
     transaction_type = db.Column(db.String(20), nullable=False)  # 'purchase', 'usage', 'adjustment'
     quantity = db.Column(db.Float, nullable=False)
     notes = db.Column(db.Text)
-    transaction_date = db.Column(db.DateTime, default=datetime.utcnow)
+    transaction_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    import_batch_id = db.Column(db.Integer, db.ForeignKey('import_batch.id'), index=True)  # Sales import that caused a recipe usage
     
     # User relationship
     user = db.relationship('User', backref='transactions')
@@ -88,14 +102,113 @@ class InventoryTransaction(db.Model):
     def __repr__(self):
         return f'<Transaction {self.id} {self.transaction_type}>'
 
+class RecipeItem(db.Model):
+    """Quantity of an ingredient product used by one unit of a sold product"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)  # Product that is sold
+    ingredient_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Float, nullable=False)  # In the ingredient's unit, per unit sold
+    
+    # Relationships
+    product = db.relationship('Product', foreign_keys=[product_id], backref='recipe_items')
+    ingredient = db.relationship('Product', foreign_keys=[ingredient_id])
+    
+    __table_args__ = (db.UniqueConstraint('product_id', 'ingredient_id', name='uq_recipe_item_product_ingredient'),)
+    
+    def __repr__(self):
+        return f'<RecipeItem {self.product_id} uses {self.quantity} of {self.ingredient_id}>'
+
+class StockLedgerEntry(db.Model):
+    """Append-only record of every change to a product's quantity on hand"""
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
+    entry_type = db.Column(db.String(20), nullable=False)  # 'opening', 'purchase', 'usage', 'adjustment'
+    quantity_change = db.Column(db.Float, nullable=False)  # Signed change to quantity on hand
+    entry_date = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # When the change takes effect
+    transaction_id = db.Column(db.Integer, db.ForeignKey('inventory_transaction.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    def __repr__(self):
+        return f'<StockLedgerEntry {self.id} {self.product_id} {self.quantity_change:+}>'
+
+db.Index('ix_stock_ledger_entry_product_id_entry_date', StockLedgerEntry.product_id, StockLedgerEntry.entry_date)
+
+class StockSnapshot(db.Model):
+    """Quantity on hand of a product from all ledger entries dated before as_of"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    as_of = db.Column(db.DateTime, primary_key=True)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    
+    def __repr__(self):
+        return f'<StockSnapshot {self.product_id} {self.as_of}>'
+
+class ReorderSuggestion(db.Model):
+    """Forecast demand and suggested reorder point of a product, see forecasting.py"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    method = db.Column(db.String(10), nullable=False)  # 'ewma' or 'sma'
+    daily_demand = db.Column(db.Float, nullable=False)  # Forecast units per day
+    demand_std = db.Column(db.Float, nullable=False)  # Standard deviation of daily demand
+    lead_time_days = db.Column(db.Float, nullable=False)
+    safety_stock = db.Column(db.Float, nullable=False)
+    reorder_point = db.Column(db.Float, nullable=False)  # Suggested min_quantity
+    history_days = db.Column(db.Integer, nullable=False)  # Days of history behind the forecast
+    computed_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    
+    # Relationships
+    product = db.relationship('Product', backref=db.backref('reorder_suggestion', uselist=False))
+    
+    def __repr__(self):
+        return f'<ReorderSuggestion {self.product_id} {self.reorder_point}>'
+
+class PurchaseOrder(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    vendor_id = db.Column(db.Integer, db.ForeignKey('vendor.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='draft', index=True)  # 'draft', 'received', 'cancelled'
+    target_days = db.Column(db.Float)  # Days of cover the quantities were sized for
+    notes = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    received_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    received_at = db.Column(db.DateTime)
+    
+    # Relationships
+    vendor = db.relationship('Vendor', backref='purchase_orders')
+    lines = db.relationship('PurchaseOrderLine', backref='purchase_order', lazy=True,
+                            cascade='all, delete-orphan', order_by='PurchaseOrderLine.id')
+    
+    @property
+    def total_cost(self):
+        return sum(line.quantity * (line.unit_price or 0.0) for line in self.lines)
+    
+    def __repr__(self):
+        return f'<PurchaseOrder {self.id} {self.status}>'
+
+class PurchaseOrderLine(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    purchase_order_id = db.Column(db.Integer, db.ForeignKey('purchase_order.id'), nullable=False, index=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    quantity = db.Column(db.Float, nullable=False)
+    unit_price = db.Column(db.Float)  # Product cost price when the order was drafted
+    daily_demand = db.Column(db.Float)  # Usage rate the quantity was sized from
+    transaction_id = db.Column(db.Integer, db.ForeignKey('inventory_transaction.id'))  # Purchase posted on receipt
+    
+    # Relationships
+    product = db.relationship('Product')
+    
+    def __repr__(self):
+        return f'<PurchaseOrderLine {self.purchase_order_id} {self.product_id} {self.quantity}>'
+
 class Sale(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False)
     quantity = db.Column(db.Float, nullable=False)
     unit_price = db.Column(db.Float, nullable=False)
     total = db.Column(db.Float, nullable=False)
-    sale_date = db.Column(db.DateTime, nullable=False)
+    sale_date = db.Column(db.DateTime, nullable=False, index=True)
     imported_at = db.Column(db.DateTime, default=datetime.utcnow)
+    batch_id = db.Column(db.Integer, db.ForeignKey('import_batch.id'), index=True)
+    natural_key = db.Column(db.String(64), unique=True, index=True)  # Identifies the source row across re-uploads
     
     # Relationships
     product = db.relationship('Product', backref='sales')
@@ -103,6 +216,125 @@ class Sale(db.Model):
     def __repr__(self):
         return f'<Sale {self.id} {self.product.name if self.product else "Unknown"}>'
 
+db.Index('ix_sale_product_id_sale_date', Sale.product_id, Sale.sale_date)
+
+class SalesDailyRollup(db.Model):
+    """Pre-aggregated sales per product per day, maintained as sales are written"""
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True, index=True)
+    quantity = db.Column(db.Float, nullable=False, default=0.0)
+    revenue = db.Column(db.Float, nullable=False, default=0.0)
+    sale_count = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<SalesDailyRollup {self.product_id} {self.day}>'
+
+class DataVersion(db.Model):
+    """Per-table counter advanced by every committed write to that table"""
+    table_name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<DataVersion {self.table_name} {self.version}>'
+
+class ImportBatch(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255))
+    fingerprint = db.Column(db.String(64), nullable=False, index=True)  # SHA-256 of the uploaded file
+    status = db.Column(db.String(20), nullable=False, default='importing')  # 'importing', 'completed', 'failed', 'reverted'
+    rows_added = db.Column(db.Integer, default=0)
+    rows_duplicate = db.Column(db.Integer, default=0)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    reverted_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<ImportBatch {self.id} {self.status}>'
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255))
+    stored_path = db.Column(db.String(500), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'completed', 'failed'
+    rows_processed = db.Column(db.Integer, default=0)
+    rows_added = db.Column(db.Integer, default=0)
+    rows_skipped = db.Column(db.Integer, default=0)
+    rows_failed = db.Column(db.Integer, default=0)
+    rows_duplicate = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    batch_id = db.Column(db.Integer, db.ForeignKey('import_batch.id'))
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    heartbeat_at = db.Column(db.DateTime)  # Last progress of a running import
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'filename': self.filename,
+            'status': self.status,
+            'rows_processed': self.rows_processed or 0,
+            'rows_added': self.rows_added or 0,
+            'rows_skipped': self.rows_skipped or 0,
+            'rows_failed': self.rows_failed or 0,
+            'rows_duplicate': self.rows_duplicate or 0,
+            'batch_id': self.batch_id,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ImportJob {self.id} {self.status}>'
+
+class ReportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    report_type = db.Column(db.String(50), nullable=False)
+    start_date = db.Column(db.Date)
+    end_date = db.Column(db.Date)
+    export_format = db.Column(db.String(20), nullable=False, default='csv')
+    request_key = db.Column(db.String(64), nullable=False, index=True)  # Same report, range, format and data versions
+    status = db.Column(db.String(20), nullable=False, default='queued')  # 'queued', 'running', 'completed', 'failed', 'expired'
+    rows_written = db.Column(db.Integer, default=0)
+    filename = db.Column(db.String(255))
+    artifact_path = db.Column(db.String(500))
+    error = db.Column(db.Text)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    expires_at = db.Column(db.DateTime, index=True)
+
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed', 'expired')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'report_type': self.report_type,
+            'start_date': self.start_date.isoformat() if self.start_date else None,
+            'end_date': self.end_date.isoformat() if self.end_date else None,
+            'export_format': self.export_format,
+            'status': self.status,
+            'rows_written': self.rows_written or 0,
+            'filename': self.filename,
+            'error': self.error,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+            'expires_at': self.expires_at.isoformat() if self.expires_at else None,
+        }
+
+    def __repr__(self):
+        return f'<ReportJob {self.id} {self.report_type} {self.status}>'
+
 class Staff(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -143,17 +375,19 @@ class Staff(db.Model):
 
 class Shift(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    staff_id = db.Column(db.Integer, db.ForeignKey('staff.id'), nullable=False)
+    staff_id = db.Column(db.Integer, db.ForeignKey('staff.id'), nullable=False, index=True)
     title = db.Column(db.String(100))
-    start_time = db.Column(db.DateTime, nullable=False)
+    start_time = db.Column(db.DateTime, nullable=False, index=True)
     end_time = db.Column(db.DateTime, nullable=False)
     is_recurring = db.Column(db.Boolean, default=False)
     recurring_days = db.Column(db.String(100))
+    recurrence_end_date = db.Column(db.Date)  # Last day a recurring shift occurs on; open-ended if NULL
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationships
+    exceptions = db.relationship('ShiftException', backref='shift', lazy=True, cascade='all, delete-orphan')
     
     @property
     def duration(self):
@@ -167,3 +401,19 @@ class Shift(db.Model):
     
     def __repr__(self):
         return f'<Shift {self.id} {self.staff.name if self.staff else "Unknown"} {self.start_time}>'
+
+class ShiftException(db.Model):
+    """One occurrence of a recurring shift that is cancelled or moved"""
+    id = db.Column(db.Integer, primary_key=True)
+    shift_id = db.Column(db.Integer, db.ForeignKey('shift.id'), nullable=False)
+    occurrence_date = db.Column(db.Date, nullable=False)  # Date the occurrence would start on
+    is_cancelled = db.Column(db.Boolean, nullable=False, default=True)
+    start_time = db.Column(db.DateTime)  # Replacement times when not cancelled
+    end_time = db.Column(db.DateTime)
+    notes = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('shift_id', 'occurrence_date', name='uq_shift_exception_shift_date'),)
+    
+    def __repr__(self):
+        return f'<ShiftException {self.shift_id} {self.occurrence_date}>'
@@ -0,0 +1,188 @@
+"""
+Purchase order suggestions and receiving.
+
+Products that are low on stock, or at their suggested reorder point, are
+grouped by vendor into draft purchase orders. Each line orders up to the
+reorder point plus PO_TARGET_DAYS_OF_COVER days of demand, so the stock
+lasts that long before it is due again. Demand and reorder point come from
+the stored forecast (ReorderSuggestion); without one, demand is the average
+usage over the last PO_USAGE_DAYS days and the reorder point its lead-time
+demand, never below the low stock threshold. Products without any demand
+are ordered PO_SAFETY_MARGIN above the threshold. Products already on a
+draft order are left out, so generating again does not order twice.
+
+Receiving an order posts all its lines as purchase transactions in one
+post_transactions batch and marks the order received in the same commit.
+"""
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, or_, select, update
+from app import db
+from forecasting import FORECAST_LEAD_TIME_DAYS
+from models import Product, InventoryTransaction, PurchaseOrder, PurchaseOrderLine, ReorderSuggestion
+from stock import post_transactions
+
+# Days of demand a suggested order should cover
+PO_TARGET_DAYS_OF_COVER = float(os.environ.get('PO_TARGET_DAYS_OF_COVER', 14))
+# Days of usage averaged for products without a forecast
+PO_USAGE_DAYS = int(os.environ.get('PO_USAGE_DAYS', 28))
+# Fraction of the low stock threshold ordered above it for products without demand
+PO_SAFETY_MARGIN = float(os.environ.get('PO_SAFETY_MARGIN', 0.25))
+
+
+class PurchaseOrderError(ValueError):
+    """Raised when a purchase order cannot be changed in its current state"""
+
+
+def reorder_needs(target_days=None, now=None):
+    """
+    Products to reorder with the quantity that restores target_days of
+    cover. Returns a list of dicts with product_id, vendor_id, quantity,
+    unit_price and daily_demand; vendor_id is None for products without one.
+    """
+    target_days = PO_TARGET_DAYS_OF_COVER if target_days is None else target_days
+    now = now or datetime.utcnow()
+
+    recent_usage = select(
+        InventoryTransaction.product_id,
+        (func.sum(InventoryTransaction.quantity) / PO_USAGE_DAYS).label('daily_usage')
+    ).where(
+        InventoryTransaction.transaction_type == 'usage',
+        InventoryTransaction.transaction_date >= now - timedelta(days=PO_USAGE_DAYS)
+    ).group_by(InventoryTransaction.product_id).subquery()
+
+    on_order = select(PurchaseOrderLine.product_id).join(PurchaseOrder).where(PurchaseOrder.status == 'draft')
+
+    rows = db.session.execute(
+        select(
+            Product.id,
+            Product.vendor_id,
+            Product.quantity,
+            Product.min_quantity,
+            Product.price,
+            func.coalesce(ReorderSuggestion.daily_demand, recent_usage.c.daily_usage, 0.0).label('daily_demand'),
+            ReorderSuggestion.reorder_point
+        ).outerjoin(ReorderSuggestion, ReorderSuggestion.product_id == Product.id).outerjoin(
+            recent_usage, recent_usage.c.product_id == Product.id
+        ).where(
+            or_(Product.is_low_stock, Product.quantity <= ReorderSuggestion.reorder_point),
+            Product.id.not_in(on_order)
+        ).order_by(Product.name)
+    ).all()
+
+    needs = []
+    for product_id, vendor_id, quantity, min_quantity, price, daily_demand, reorder_point in rows:
+        quantity, min_quantity = quantity or 0.0, min_quantity or 0.0
+        if daily_demand > 0:
+            if reorder_point is None:
+                reorder_point = daily_demand * FORECAST_LEAD_TIME_DAYS
+            order_up_to = max(reorder_point, min_quantity) + daily_demand * target_days
+        else:
+            order_up_to = min_quantity * (1 + PO_SAFETY_MARGIN)
+        # Whole units, and always enough to leave stock above the threshold
+        order_quantity = max(math.ceil(order_up_to - quantity), math.floor(min_quantity - quantity) + 1)
+        if order_quantity > 0:
+            needs.append({
+                'product_id': product_id,
+                'vendor_id': vendor_id,
+                'quantity': float(order_quantity),
+                'unit_price': price,
+                'daily_demand': daily_demand,
+            })
+    return needs
+
+
+def generate_purchase_orders(target_days=None, user_id=None):
+    """
+    Create one draft purchase order per vendor from the current reorder
+    needs, in one commit. Returns (orders, number of products skipped
+    because they have no vendor).
+    """
+    target_days = PO_TARGET_DAYS_OF_COVER if target_days is None else target_days
+
+    by_vendor = defaultdict(list)
+    unassigned = 0
+    for need in reorder_needs(target_days):
+        if need['vendor_id'] is None:
+            unassigned += 1
+        else:
+            by_vendor[need['vendor_id']].append(need)
+
+    orders = [
+        PurchaseOrder(
+            vendor_id=vendor_id,
+            status='draft',
+            target_days=target_days,
+            created_by=user_id,
+            lines=[PurchaseOrderLine(
+                product_id=need['product_id'],
+                quantity=need['quantity'],
+                unit_price=need['unit_price'],
+                daily_demand=need['daily_demand']
+            ) for need in needs]
+        )
+        for vendor_id, needs in by_vendor.items()
+    ]
+    db.session.add_all(orders)
+    db.session.commit()
+    return orders, unassigned
+
+
+def receive_purchase_order(order, user_id=None, received_date=None):
+    """
+    Post every line of a draft order as a purchase transaction in one batch
+    and mark the order received. Returns the per-line results; if any line
+    is rejected nothing is posted.
+    """
+    if order.status != 'draft':
+        raise PurchaseOrderError(f'Purchase order #{order.id} is {order.status}')
+
+    order_id = order.id
+    lines = [(line.id, {
+        'product_id': line.product_id,
+        'transaction_type': 'purchase',
+        'quantity': line.quantity,
+        'transaction_date': received_date,
+        'notes': f'Purchase order #{order_id}',
+    }) for line in order.lines if line.quantity > 0]
+    if not lines:
+        raise PurchaseOrderError(f'Purchase order #{order_id} has nothing to receive')
+
+    def mark_received(results):
+        now = datetime.utcnow()
+        # Guarded on the status, so an order is only ever received once
+        claimed = db.session.execute(
+            update(PurchaseOrder).where(
+                PurchaseOrder.id == order_id,
+                PurchaseOrder.status == 'draft'
+            ).values(status='received', received_at=now, received_by=user_id)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if not claimed:
+            raise PurchaseOrderError(f'Purchase order #{order_id} was already received or cancelled')
+
+        table = PurchaseOrderLine.__table__
+        db.session.execute(
+            update(table).where(table.c.id == bindparam('b_id')).values(transaction_id=bindparam('b_transaction_id')),
+            [{'b_id': line_id, 'b_transaction_id': result['transaction_id']}
+             for (line_id, _), result in zip(lines, results)]
+        )
+
+    try:
+        return post_transactions([line for _, line in lines], user_id=user_id, all_or_nothing=True,
+                                 before_commit=mark_received)
+    except PurchaseOrderError:
+        db.session.rollback()
+        raise
+
+
+def cancel_purchase_order(order):
+    """
+    Cancel a draft purchase order
+    """
+    if order.status != 'draft':
+        raise PurchaseOrderError(f'Purchase order #{order.id} is {order.status}')
+    order.status = 'cancelled'
+    db.session.commit()
@@ -0,0 +1,113 @@
+from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload, selectinload
+from app import db
+from models import PurchaseOrder, PurchaseOrderLine
+from forms import PurchaseOrderGenerateForm
+from purchase_orders import (PO_TARGET_DAYS_OF_COVER, PurchaseOrderError, cancel_purchase_order,
+                             generate_purchase_orders, receive_purchase_order)
+
+purchasing = Blueprint('purchasing', __name__)
+
+@purchasing.route('/purchase-orders')
+@login_required
+def purchase_order_list():
+    """
+    Draft and past purchase orders, with the form that drafts new ones
+    """
+    form = PurchaseOrderGenerateForm(target_days=PO_TARGET_DAYS_OF_COVER)
+    orders = PurchaseOrder.query.options(
+        joinedload(PurchaseOrder.vendor),
+        selectinload(PurchaseOrder.lines)
+    ).order_by(
+        (PurchaseOrder.status != 'draft'), PurchaseOrder.created_at.desc()
+    ).limit(100).all()
+    return render_template('purchase_orders.html', orders=orders, form=form)
+
+@purchasing.route('/purchase-orders/generate', methods=['POST'])
+@login_required
+def generate_orders():
+    """
+    Draft one purchase order per vendor for everything that needs reordering
+    """
+    form = PurchaseOrderGenerateForm()
+    
+    if form.validate_on_submit():
+        orders, unassigned = generate_purchase_orders(form.target_days.data, user_id=current_user.id)
+        if orders:
+            lines = sum(len(order.lines) for order in orders)
+            flash(f'Drafted {len(orders)} purchase orders with {lines} lines.', 'success')
+        else:
+            flash('Nothing needs reordering right now.', 'info')
+        if unassigned:
+            flash(f'{unassigned} products need reordering but have no vendor.', 'warning')
+    else:
+        flash('Enter the days of cover to order for (1-365).', 'danger')
+    
+    return redirect(url_for('purchasing.purchase_order_list'))
+
+@purchasing.route('/purchase-orders/<int:id>', methods=['GET', 'POST'])
+@login_required
+def purchase_order_detail(id):
+    """
+    Show a purchase order; a draft's line quantities can be changed, and a
+    quantity of zero removes the line
+    """
+    order = db.get_or_404(PurchaseOrder, id)
+    
+    if request.method == 'POST':
+        if order.status != 'draft':
+            flash(f'Purchase order #{order.id} is {order.status} and can no longer be changed.', 'warning')
+            return redirect(url_for('purchasing.purchase_order_detail', id=id))
+        
+        for line in list(order.lines):
+            quantity = request.form.get(f'quantity-{line.id}', type=float)
+            if quantity is None or quantity < 0:
+                continue
+            if quantity == 0:
+                order.lines.remove(line)
+            else:
+                line.quantity = quantity
+        db.session.commit()
+        flash(f'Purchase order #{order.id} has been updated.', 'success')
+        return redirect(url_for('purchasing.purchase_order_detail', id=id))
+    
+    lines = PurchaseOrderLine.query.options(joinedload(PurchaseOrderLine.product)).filter_by(
+        purchase_order_id=order.id
+    ).order_by(PurchaseOrderLine.id).all()
+    return render_template('purchase_order.html', order=order, lines=lines)
+
+@purchasing.route('/purchase-orders/<int:id>/receive', methods=['POST'])
+@login_required
+def receive_order(id):
+    """
+    Post every line of a draft order as a purchase in one batch
+    """
+    order = db.get_or_404(PurchaseOrder, id)
+    
+    try:
+        results = receive_purchase_order(order, user_id=current_user.id)
+    except PurchaseOrderError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('purchasing.purchase_order_detail', id=id))
+    
+    rejected = [result for result in results if result['status'] == 'rejected']
+    if rejected:
+        flash(f'Purchase order #{id} was not received: {rejected[0]["error"]}.', 'danger')
+    else:
+        flash(f'Received purchase order #{id}: {len(results)} purchases recorded.', 'success')
+    return redirect(url_for('purchasing.purchase_order_detail', id=id))
+
+@purchasing.route('/purchase-orders/<int:id>/cancel', methods=['POST'])
+@login_required
+def cancel_order(id):
+    order = db.get_or_404(PurchaseOrder, id)
+    
+    try:
+        cancel_purchase_order(order)
+    except PurchaseOrderError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('purchasing.purchase_order_detail', id=id))
+    
+    flash(f'Purchase order #{id} has been cancelled.', 'success')
+    return redirect(url_for('purchasing.purchase_order_list'))
@@ -0,0 +1,72 @@
+"""
+Eager-loading query profiles for list views.
+
+Each helper fetches what its view renders in one or two statements:
+many-to-one relations are joined into the main query, and views that only
+show how many rows hang off a parent get an aggregate count instead of the
+loaded relationship list.
+"""
+from sqlalchemy import func, select
+from sqlalchemy.orm import joinedload
+from app import db
+from models import Product, Category, Vendor, InventoryTransaction, Shift
+
+
+def recent_transactions(limit=5):
+    """
+    Latest inventory transactions with their products
+    """
+    return InventoryTransaction.query.options(
+        joinedload(InventoryTransaction.product)
+    ).order_by(InventoryTransaction.transaction_date.desc()).limit(limit).all()
+
+
+def shifts_with_staff(*criteria):
+    """
+    Shifts matching criteria with their staff member
+    """
+    return Shift.query.options(
+        joinedload(Shift.staff)
+    ).filter(*criteria).order_by(Shift.start_time.desc()).all()
+
+
+def _with_product_counts(model, foreign_key):
+    counts = (
+        select(foreign_key.label('owner_id'), func.count(Product.id).label('product_count'))
+        .group_by(foreign_key)
+        .subquery()
+    )
+    rows = db.session.execute(
+        select(model, func.coalesce(counts.c.product_count, 0))
+        .outerjoin(counts, counts.c.owner_id == model.id)
+        .order_by(model.name)
+    )
+    return rows.all()
+
+
+def categories_with_product_counts():
+    """
+    (category, product count) pairs ordered by category name
+    """
+    return _with_product_counts(Category, Product.category_id)
+
+
+def vendors_with_product_counts():
+    """
+    (vendor, product count) pairs ordered by vendor name
+    """
+    return _with_product_counts(Vendor, Product.vendor_id)
+
+
+def count_products(*criteria):
+    """
+    Number of products matching criteria, without loading them
+    """
+    return db.session.scalar(select(func.count(Product.id)).where(*criteria))
+
+
+def has_shifts(staff_id):
+    """
+    True if the staff member has any shift
+    """
+    return db.session.scalar(select(select(Shift.id).where(Shift.staff_id == staff_id).exists()))
@@ -0,0 +1,178 @@
+"""
+Recipe-driven stock depletion.
+
+A RecipeItem says how much of an ingredient product one unit of a sold
+product uses (a latte: 18 g of beans and 240 ml of milk). Sales imports
+explode each chunk of sale rows against the recipes with one pandas merge
+and group the result by ingredient and day, so a day of sales becomes one
+usage transaction per ingredient, posted in batches once the import is
+committed. Ingredient-days an import has already posted are not posted
+again, so the usage of an interrupted import can be posted later from its
+stored sales. Reverting the import puts that usage back.
+"""
+import logging
+import pandas as pd
+from sqlalchemy import func, select
+from app import db
+from ledger import record_stock_changes
+from models import InventoryTransaction, RecipeItem, Sale
+from stock import MAX_BATCH_LINES, change_stock, post_transactions
+
+logger = logging.getLogger(__name__)
+
+USAGE_COLUMNS = ['ingredient_id', 'day', 'usage']
+
+
+def recipe_frame():
+    """
+    Every recipe line as a DataFrame of product_id, ingredient_id and
+    quantity (per unit sold)
+    """
+    rows = db.session.execute(
+        select(RecipeItem.product_id, RecipeItem.ingredient_id, RecipeItem.quantity)
+    ).all()
+    return pd.DataFrame(rows, columns=['product_id', 'ingredient_id', 'quantity'])
+
+
+def ingredient_usage(sales, recipes):
+    """
+    Ingredient usage of a chunk of sale dicts (product_id, quantity,
+    sale_date) as a DataFrame of ingredient_id, day and usage
+    """
+    if not sales or recipes.empty:
+        return pd.DataFrame(columns=USAGE_COLUMNS)
+
+    frame = pd.DataFrame(sales, columns=['product_id', 'quantity', 'sale_date'])
+    exploded = frame.merge(recipes, on='product_id', suffixes=('_sold', '_per_unit'))
+    exploded['usage'] = exploded['quantity_sold'] * exploded['quantity_per_unit']
+    exploded['day'] = pd.to_datetime(exploded['sale_date']).dt.normalize()
+    return exploded.groupby(['ingredient_id', 'day'], as_index=False)['usage'].sum()
+
+
+class UsageAccumulator:
+    """
+    Sums the ingredient usage of an import's chunks by ingredient and day
+    """
+
+    def __init__(self):
+        self.recipes = recipe_frame()
+        self.frames = []
+
+    def add(self, sales):
+        if self.recipes.empty:
+            return
+        usage = ingredient_usage(sales, self.recipes)
+        if not usage.empty:
+            self.frames.append(usage)
+
+    def totals(self):
+        if not self.frames:
+            return pd.DataFrame(columns=USAGE_COLUMNS)
+        usage = pd.concat(self.frames, ignore_index=True)
+        return usage.groupby(['ingredient_id', 'day'], as_index=False)['usage'].sum()
+
+
+def batch_ingredient_usage(import_batch_id, chunk_size=5000):
+    """
+    Ingredient usage of the sales stored for an import batch, read in
+    chunks, as a DataFrame of ingredient_id, day and usage
+    """
+    usage = UsageAccumulator()
+    if usage.recipes.empty:
+        return usage.totals()
+
+    rows = db.session.execute(
+        select(Sale.product_id, Sale.quantity, Sale.sale_date)
+        .where(Sale.batch_id == import_batch_id)
+        .execution_options(yield_per=chunk_size)
+    )
+    for chunk in rows.partitions():
+        usage.add([row._asdict() for row in chunk])
+    return usage.totals()
+
+
+def _posted_usage_days(import_batch_id):
+    """
+    (ingredient_id, day) pairs an import batch has already posted usage for
+    """
+    rows = db.session.execute(
+        select(InventoryTransaction.product_id, InventoryTransaction.transaction_date).where(
+            InventoryTransaction.import_batch_id == import_batch_id,
+            InventoryTransaction.transaction_type == 'usage'
+        )
+    )
+    return {(product_id, transaction_date.date()) for product_id, transaction_date in rows}
+
+
+def post_ingredient_usage(usage, import_batch_id=None, user_id=None):
+    """
+    Record one usage transaction per ingredient and day of a usage frame,
+    in batches of at most MAX_BATCH_LINES, each committed on its own.
+    Ingredient-days the import batch already posted are left out, so a
+    failed post can be repeated. Usage beyond the stock on hand depletes
+    it to zero. Returns the per-line results of post_transactions.
+    """
+    usage = usage[usage['usage'] > 0]
+    if usage.empty:
+        return []
+
+    posted = _posted_usage_days(import_batch_id) if import_batch_id else set()
+    notes = f'Sales import batch #{import_batch_id}' if import_batch_id else 'Sales usage'
+    lines = [{
+        'product_id': int(ingredient_id),
+        'transaction_type': 'usage',
+        'quantity': float(quantity),
+        'transaction_date': day.to_pydatetime(),
+        'notes': notes,
+    } for ingredient_id, day, quantity in usage[USAGE_COLUMNS].itertuples(index=False)
+        if (int(ingredient_id), day.date()) not in posted]
+
+    results = []
+    for start in range(0, len(lines), MAX_BATCH_LINES):
+        results.extend(post_transactions(lines[start:start + MAX_BATCH_LINES], user_id=user_id,
+                                         clamp_usage=True, import_batch_id=import_batch_id))
+    short = [result for result in results if result.get('shortfall')]
+    if short:
+        logger.warning('Sales usage exceeded stock on hand for %s ingredient-days', len(short))
+    return results
+
+
+def restore_ingredient_usage(import_batch_id, user_id=None):
+    """
+    Put back the stock a sales import used, as one adjustment per
+    ingredient. Leaves the changes for the caller to commit.
+    Returns the number of ingredients restored.
+    """
+    used = db.session.execute(
+        select(InventoryTransaction.product_id, func.sum(InventoryTransaction.quantity)).where(
+            InventoryTransaction.import_batch_id == import_batch_id,
+            InventoryTransaction.transaction_type == 'usage'
+        ).group_by(InventoryTransaction.product_id)
+    ).all()
+
+    restored = []
+    for product_id, quantity in used:
+        if not quantity:
+            continue
+        change_stock(product_id, quantity)
+        transaction = InventoryTransaction(
+            product_id=product_id,
+            transaction_type='adjustment',
+            quantity=quantity,
+            notes=f'Reverted sales import batch #{import_batch_id}',
+            created_by=user_id,
+            import_batch_id=import_batch_id
+        )
+        db.session.add(transaction)
+        restored.append(transaction)
+
+    db.session.flush()
+    record_stock_changes([{
+        'product_id': transaction.product_id,
+        'entry_type': 'adjustment',
+        'quantity_change': transaction.quantity,
+        'entry_date': transaction.transaction_date,
+        'transaction_id': transaction.id,
+        'created_by': user_id,
+    } for transaction in restored])
+    return len(restored)
@@ -0,0 +1,206 @@
+"""
+Background report generation.
+
+A report request is queued as a ReportJob and written to a file under
+instance/reports by the background executor; the user follows a status
+page and downloads the file when it is ready. Requests are keyed by report
+type, date range, format and the current versions of the report's tables,
+so an identical request reuses the job that is queued, running or already
+finished for the same data. Finished files are kept for
+REPORT_RETENTION_HOURS and then deleted. A job still queued or running
+after REPORT_STALE_MINUTES is taken to have died with its worker and is
+marked failed, so it is not reused.
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import func
+from app import db
+from exports import EXPORT_FORMATS, EXPORT_BATCH_SIZE, COLUMNAR_BATCH_SIZE, iter_batches, csv_chunks, columnar_chunks
+from jobs import submit_job
+from models import ReportJob
+from versioning import data_versions
+
+logger = logging.getLogger(__name__)
+
+# How long finished report files stay downloadable
+REPORT_RETENTION_HOURS = int(os.environ.get('REPORT_RETENTION_HOURS', 24))
+
+# Transaction reports spanning more days than this are generated in the background
+REPORT_INLINE_MAX_DAYS = int(os.environ.get('REPORT_INLINE_MAX_DAYS', 92))
+
+# Minutes after which a queued or running report is taken to have died
+# with its process; generous, as a report file takes seconds to write
+REPORT_STALE_MINUTES = int(os.environ.get('REPORT_STALE_MINUTES', 30))
+
+ACTIVE_STATUSES = ('queued', 'running', 'completed')
+
+
+def report_directory():
+    """
+    Directory where generated report files are kept until they expire
+    """
+    path = os.path.join(current_app.instance_path, 'reports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def report_request_key(report_type, start_date, end_date, export_format):
+    """
+    Identity of a report request against the current state of its tables
+    """
+    from reports import REPORT_TABLES
+
+    versions = data_versions(*REPORT_TABLES[report_type])
+    parts = [report_type, str(start_date), str(end_date), export_format]
+    parts += [f'{name}={versions[name]}' for name in REPORT_TABLES[report_type]]
+    return hashlib.sha256('|'.join(parts).encode('utf-8')).hexdigest()
+
+
+def enqueue_report(report_type, start_date, end_date, export_format='csv', user_id=None):
+    """
+    Queue a report file, or return the job already producing or holding
+    the same file. Returns the ReportJob.
+    """
+    from reports import REPORT_FILENAMES
+
+    if report_type != 'transactions':
+        start_date = end_date = None
+
+    purge_expired_reports()
+    fail_stale_reports()
+
+    request_key = report_request_key(report_type, start_date, end_date, export_format)
+    job = ReportJob.query.filter(
+        ReportJob.request_key == request_key,
+        ReportJob.status.in_(ACTIVE_STATUSES)
+    ).order_by(ReportJob.created_at.desc()).first()
+    if job is not None:
+        return job
+
+    extension, _ = EXPORT_FORMATS[export_format]
+    job = ReportJob(
+        report_type=report_type,
+        start_date=start_date,
+        end_date=end_date,
+        export_format=export_format,
+        request_key=request_key,
+        filename=f'{REPORT_FILENAMES[report_type]}.{extension}',
+        status='queued',
+        created_by=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    submit_job(run_report_job, job.id)
+    return job
+
+
+def run_report_job(job_id):
+    """
+    Write the file of a ReportJob from a batched cursor
+    """
+    from reports import report_query
+
+    job = db.session.get(ReportJob, job_id)
+    if job is None or job.status != 'queued':
+        return
+
+    job.status = 'running'
+    job.started_at = datetime.utcnow()
+    db.session.commit()
+
+    artifact_path = os.path.join(report_directory(), f'{job.id}-{job.filename}')
+    partial_path = artifact_path + '.part'
+    rows_written = 0
+
+    def counted(batches):
+        nonlocal rows_written
+        for batch in batches:
+            rows_written += len(batch)
+            yield batch
+
+    try:
+        headers, statement, format_row = report_query(job.report_type, job.start_date, job.end_date)
+        if job.export_format == 'csv':
+            batches = counted(iter_batches(statement, EXPORT_BATCH_SIZE))
+            chunks = (chunk.encode('utf-8') for chunk in csv_chunks(headers, batches, format_row))
+        else:
+            batches = counted(iter_batches(statement, COLUMNAR_BATCH_SIZE))
+            chunks = columnar_chunks(job.export_format, headers, batches, statement)
+
+        with open(partial_path, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+        os.replace(partial_path, artifact_path)
+
+        job.artifact_path = artifact_path
+        job.rows_written = rows_written
+        job.status = 'completed'
+        job.expires_at = datetime.utcnow() + timedelta(hours=REPORT_RETENTION_HOURS)
+    except Exception as e:
+        db.session.rollback()
+        logger.exception('Report job %s failed', job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        _remove_file(partial_path)
+    finally:
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+
+def purge_expired_reports(now=None):
+    """
+    Delete report files past their retention time.
+    Returns the number of files removed.
+    """
+    now = now or datetime.utcnow()
+    expired = ReportJob.query.filter(
+        ReportJob.status == 'completed',
+        ReportJob.expires_at < now
+    ).all()
+
+    for job in expired:
+        _remove_file(job.artifact_path)
+        job.status = 'expired'
+        job.artifact_path = None
+
+    if expired:
+        db.session.commit()
+    return len(expired)
+
+
+def fail_stale_reports(now=None):
+    """
+    Mark report jobs queued or running for longer than REPORT_STALE_MINUTES
+    as failed, so identical requests queue a new job instead of waiting on
+    one whose worker is gone. Returns the number of jobs failed.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(minutes=REPORT_STALE_MINUTES)
+    stale = ReportJob.query.filter(
+        ReportJob.status.in_(('queued', 'running')),
+        func.coalesce(ReportJob.started_at, ReportJob.created_at) < cutoff
+    ).all()
+
+    for job in stale:
+        _remove_file(os.path.join(report_directory(), f'{job.id}-{job.filename}.part'))
+        job.status = 'failed'
+        job.error = 'The report was interrupted. Request it again.'
+        job.finished_at = now
+
+    if stale:
+        db.session.commit()
+        logger.warning('Marked %s interrupted report jobs as failed', len(stale))
+    return len(stale)
+
+
+def _remove_file(path):
+    if not path:
+        return
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -1,13 +1,15 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file
-from flask_login import login_required
+import os
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, send_file
+from flask_login import login_required, current_user
+from sqlalchemy import select
 from app import db
-from models import Product, Category, Vendor, InventoryTransaction
+from models import Product, Category, Vendor, InventoryTransaction, ReportJob
 from forms import ReportForm
-from datetime import datetime, timedelta
-import pandas as pd
-import io
-import tempfile
-import os
+from cache import cache
+from exports import EXPORT_FORMATS, columnar_available, export_response
+from valuation import inventory_valuation, category_values, product_value
+from report_jobs import REPORT_INLINE_MAX_DAYS, enqueue_report, fail_stale_reports, purge_expired_reports
+from datetime import date, datetime, time, timedelta
 
 reports = Blueprint('reports', __name__)
 
@@ -30,95 +32,195 @@ def report_dashboard():
         start_date = form.start_date.data
         end_date = form.end_date.data
         
+        # Build the report as a file in the background when asked to, or when
+        # the transaction range is too long to render within one request
+        long_range = (report_type == 'transactions' and
+                      (_as_date(end_date) - _as_date(start_date)).days > REPORT_INLINE_MAX_DAYS)
+        if report_type in REPORT_TABLES and (form.generate_file.data or long_range):
+            export_format = form.export_format.data or 'csv'
+            if export_format != 'csv' and not columnar_available():
+                flash('Parquet and Arrow exports require the pyarrow package.', 'warning')
+                return redirect(url_for('reports.report_dashboard'))
+            if long_range and not form.generate_file.data:
+                flash(f'Reports covering more than {REPORT_INLINE_MAX_DAYS} days are generated in the background.', 'info')
+            job = enqueue_report(report_type, _as_date(start_date), _as_date(end_date),
+                                 export_format, user_id=current_user.id)
+            return redirect(url_for('reports.report_job', job_id=job.id))
+        
         if report_type == 'low_stock':
             report_data = generate_low_stock_report()
         elif report_type == 'inventory_value':
             report_data = generate_inventory_value_report()
         elif report_type == 'transactions':
-            report_data = generate_transaction_report(start_date, end_date)
+            report_data = generate_transaction_report(_as_date(start_date), _as_date(end_date))
+    
+    recent_jobs = ReportJob.query.filter_by(created_by=current_user.id).order_by(
+        ReportJob.created_at.desc()).limit(5).all()
+    
+    return render_template('reports.html', form=form, report_data=report_data, report_type=report_type,
+                           recent_jobs=recent_jobs)
+
+@reports.cli.command('purge')
+def purge_reports_command():
+    """
+    Delete generated report files past their retention time
+    """
+    removed = purge_expired_reports()
+    print(f'Removed {removed} expired report file(s).')
+
+@reports.route('/reports/jobs/<int:job_id>')
+@login_required
+def report_job(job_id):
+    """
+    Status page of a background report, with its download link once ready
+    """
+    job = db.get_or_404(ReportJob, job_id)
+    return render_template('report_job.html', job=job, report_names=dict(ReportForm().report_type.choices))
+
+@reports.route('/api/reports/jobs/<int:job_id>')
+@login_required
+def report_job_status(job_id):
+    """
+    API endpoint reporting the progress of a background report
+    """
+    fail_stale_reports()
+    job = db.get_or_404(ReportJob, job_id)
+    return jsonify(job.to_dict())
+
+@reports.route('/reports/jobs/<int:job_id>/download')
+@login_required
+def download_report_job(job_id):
+    """
+    Download the file produced by a background report
+    """
+    job = db.get_or_404(ReportJob, job_id)
+    
+    if job.status != 'completed' or not job.artifact_path or not os.path.exists(job.artifact_path):
+        flash('This report file is not available. Generate it again to download it.', 'warning')
+        return redirect(url_for('reports.report_job', job_id=job.id))
     
-    return render_template('reports.html', form=form, report_data=report_data, report_type=report_type)
+    _, mimetype = EXPORT_FORMATS[job.export_format]
+    return send_file(job.artifact_path, as_attachment=True, download_name=job.filename, mimetype=mimetype)
 
 @reports.route('/reports/export/<report_type>')
 @login_required
 def export_report(report_type):
-    start_date_str = request.args.get('start_date', '')
-    end_date_str = request.args.get('end_date', '')
+    start_date = _parse_date(request.args.get('start_date', ''), date.today() - timedelta(days=7))
+    end_date = _parse_date(request.args.get('end_date', ''), date.today())
     
-    start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else (datetime.today() - timedelta(days=7))
-    end_date = datetime.strptime(end_date_str, '%Y-%m-%d') if end_date_str else datetime.today()
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flash('Invalid export format.', 'danger')
+        return redirect(url_for('reports.report_dashboard'))
+    if export_format != 'csv' and not columnar_available():
+        flash('Parquet and Arrow exports require the pyarrow package.', 'warning')
+        return redirect(url_for('reports.report_dashboard'))
     
-    if report_type == 'low_stock':
-        df = create_low_stock_dataframe()
-        filename = 'low_stock_report.csv'
-    elif report_type == 'inventory_value':
-        df = create_inventory_value_dataframe()
-        filename = 'inventory_value_report.csv'
-    elif report_type == 'transactions':
-        df = create_transaction_dataframe(start_date, end_date)
-        filename = 'transaction_report.csv'
-    else:
+    if report_type not in REPORT_TABLES:
         flash('Invalid report type.', 'danger')
         return redirect(url_for('reports.report_dashboard'))
     
-    # Create a BytesIO object
-    output = io.BytesIO()
-    df.to_csv(output, index=False)
-    output.seek(0)
-    
-    # Create a tempfile to return
-    with tempfile.NamedTemporaryFile(delete=False, suffix='.csv') as temp:
-        temp.write(output.getvalue())
-        temp_path = temp.name
+    basename = REPORT_FILENAMES[report_type]
+    headers, statement, format_row = report_query(report_type, start_date, end_date)
     
-    return send_file(
-        temp_path,
-        as_attachment=True,
-        download_name=filename,
-        mimetype='text/csv'
-    )
+    # Reuse the rows if the report was just viewed; otherwise stream from the database
+    rows = cached_report_rows(report_type, start_date, end_date)
+    return export_response(export_format, basename, headers, statement, format_row, rows=rows)
+
+# Tables each report reads; a committed write to any of them drops its cached rows
+REPORT_TABLES = {
+    'low_stock': ('product', 'vendor', 'category'),
+    'inventory_value': ('product', 'vendor', 'category'),
+    'transactions': ('inventory_transaction', 'product'),
+}
+
+REPORT_FILENAMES = {
+    'low_stock': 'low_stock_report',
+    'inventory_value': 'inventory_value_report',
+    'transactions': 'transaction_report',
+}
+
+# Reports with more rows than this are recomputed instead of cached
+REPORT_CACHE_MAX_ROWS = 10000
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+def _parse_date(value, default):
+    try:
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return default
+
+def _report_cache_key(report_type, start_date, end_date):
+    # Only the transaction report depends on the date range; whole days are the unit
+    if report_type != 'transactions':
+        start_date = end_date = None
+    return ('report_rows', report_type, _as_date(start_date), _as_date(end_date))
+
+def report_query(report_type, start_date=None, end_date=None):
+    """
+    (headers, select, CSV row formatter) for a report type
+    """
+    if report_type == 'low_stock':
+        return low_stock_export()
+    if report_type == 'inventory_value':
+        return inventory_value_export()
+    return transaction_export(_as_date(start_date), _as_date(end_date))
+
+def cached_report_rows(report_type, start_date=None, end_date=None):
+    """
+    The report's rows if they are cached, else None
+    """
+    return cache.get(_report_cache_key(report_type, start_date, end_date))
+
+def report_rows(report_type, start_date=None, end_date=None):
+    """
+    All rows of a report, shared by the report page and its exports until
+    one of the report's tables is written
+    """
+    rows = cached_report_rows(report_type, start_date, end_date)
+    if rows is None:
+        _, statement, _ = report_query(report_type, start_date, end_date)
+        rows = db.session.execute(statement).all()
+        if len(rows) <= REPORT_CACHE_MAX_ROWS:
+            cache.set(_report_cache_key(report_type, start_date, end_date), rows,
+                      tags=REPORT_TABLES[report_type])
+    return rows
 
 def generate_low_stock_report():
-    low_stock_items = Product.query.filter(Product.quantity <= Product.min_quantity).all()
     return {
         'title': 'Low Stock Items Report',
         'headers': ['Name', 'SKU', 'Current Qty', 'Min Qty', 'Unit', 'Vendor'],
         'data': [
             [
-                p.name,
-                p.sku or '-',
-                p.quantity,
-                p.min_quantity,
-                p.unit,
-                p.vendor.name if p.vendor else '-'
-            ] for p in low_stock_items
+                name,
+                sku or '-',
+                quantity,
+                min_quantity,
+                unit,
+                vendor or '-'
+            ] for name, sku, quantity, min_quantity, unit, vendor, _, _ in report_rows('low_stock')
         ]
     }
 
 def generate_inventory_value_report():
-    products = Product.query.all()
-    total_value = sum(p.quantity * p.price for p in products)
-    
-    by_category = {}
-    categories = Category.query.all()
-    
-    for category in categories:
-        category_value = sum(p.quantity * p.price for p in category.products)
-        if category_value > 0:
-            by_category[category.name] = category_value
+    rows = report_rows('inventory_value')
+    total_value = inventory_valuation()['total_value']
+    by_category = category_values()
     
     return {
         'title': 'Inventory Value Report',
         'headers': ['Name', 'SKU', 'Quantity', 'Unit', 'Price', 'Total Value'],
         'data': [
             [
-                p.name,
-                p.sku or '-',
-                p.quantity,
-                p.unit,
-                f'${p.price:.2f}',
-                f'${p.quantity * p.price:.2f}'
-            ] for p in products
+                name,
+                sku or '-',
+                quantity,
+                unit,
+                f'${price:.2f}',
+                f'${total:.2f}'
+            ] for name, sku, quantity, unit, price, total, _, _ in rows
         ],
         'summary': {
             'total_value': f'${total_value:.2f}',
@@ -128,83 +230,77 @@ def generate_inventory_value_report():
 
 def generate_transaction_report(start_date, end_date):
     # Add one day to end_date to include the end_date in the query
-    end_date = end_date + timedelta(days=1)
-    
-    transactions = InventoryTransaction.query.filter(
-        InventoryTransaction.transaction_date >= start_date,
-        InventoryTransaction.transaction_date < end_date
-    ).order_by(InventoryTransaction.transaction_date.desc()).all()
+    title_end_date = end_date + timedelta(days=1)
     
     return {
-        'title': f'Transaction Report ({start_date.strftime("%Y-%m-%d")} to {end_date.strftime("%Y-%m-%d")})',
+        'title': f'Transaction Report ({start_date.strftime("%Y-%m-%d")} to {title_end_date.strftime("%Y-%m-%d")})',
         'headers': ['Date', 'Product', 'Type', 'Quantity', 'Notes'],
         'data': [
             [
-                t.transaction_date.strftime('%Y-%m-%d'),
-                t.product.name,
-                t.transaction_type.capitalize(),
-                t.quantity,
-                t.notes or '-'
-            ] for t in transactions
+                transaction_date.strftime('%Y-%m-%d'),
+                product,
+                transaction_type.capitalize(),
+                quantity,
+                notes or '-'
+            ] for transaction_date, product, _, transaction_type, quantity, _, notes
+            in report_rows('transactions', start_date, end_date)
         ]
     }
 
-def create_low_stock_dataframe():
-    low_stock_items = Product.query.filter(Product.quantity <= Product.min_quantity).all()
-    data = []
-    
-    for p in low_stock_items:
-        data.append({
-            'Name': p.name,
-            'SKU': p.sku or '-',
-            'Current Quantity': p.quantity,
-            'Minimum Quantity': p.min_quantity,
-            'Unit': p.unit,
-            'Vendor': p.vendor.name if p.vendor else '-',
-            'Category': p.category.name if p.category else '-',
-            'Price': p.price
-        })
-    
-    return pd.DataFrame(data)
-
-def create_inventory_value_dataframe():
-    products = Product.query.all()
-    data = []
-    
-    for p in products:
-        data.append({
-            'Name': p.name,
-            'SKU': p.sku or '-',
-            'Quantity': p.quantity,
-            'Unit': p.unit,
-            'Unit Price': p.price,
-            'Total Value': p.quantity * p.price,
-            'Category': p.category.name if p.category else '-',
-            'Vendor': p.vendor.name if p.vendor else '-'
-        })
-    
-    return pd.DataFrame(data)
-
-def create_transaction_dataframe(start_date, end_date):
-    # Add one day to end_date to include the end_date in the query
-    end_date = end_date + timedelta(days=1)
-    
-    transactions = InventoryTransaction.query.filter(
-        InventoryTransaction.transaction_date >= start_date,
-        InventoryTransaction.transaction_date < end_date
-    ).order_by(InventoryTransaction.transaction_date.desc()).all()
-    
-    data = []
-    
-    for t in transactions:
-        data.append({
-            'Date': t.transaction_date.strftime('%Y-%m-%d'),
-            'Product': t.product.name,
-            'SKU': t.product.sku or '-',
-            'Transaction Type': t.transaction_type.capitalize(),
-            'Quantity': t.quantity,
-            'Unit': t.product.unit,
-            'Notes': t.notes or '-'
-        })
-    
-    return pd.DataFrame(data)
+def low_stock_export():
+    statement = select(
+        Product.name, Product.sku, Product.quantity, Product.min_quantity,
+        Product.unit, Vendor.name.label('vendor'), Category.name.label('category'), Product.price
+    ).outerjoin(Product.vendor).outerjoin(Product.category).where(Product.is_low_stock)
+    
+    headers = ['Name', 'SKU', 'Current Quantity', 'Minimum Quantity', 'Unit', 'Vendor', 'Category', 'Price']
+    
+    def format_row(row):
+        name, sku, quantity, min_quantity, unit, vendor, category, price = row
+        return [name, sku or '-', quantity, min_quantity, unit, vendor or '-', category or '-', price]
+    
+    return headers, statement, format_row
+
+def inventory_value_export():
+    statement = select(
+        Product.name, Product.sku, Product.quantity, Product.unit, Product.price,
+        product_value().label('total_value'), Category.name.label('category'), Vendor.name.label('vendor')
+    ).outerjoin(Product.category).outerjoin(Product.vendor).order_by(Product.id)
+    
+    headers = ['Name', 'SKU', 'Quantity', 'Unit', 'Unit Price', 'Total Value', 'Category', 'Vendor']
+    
+    def format_row(row):
+        name, sku, quantity, unit, price, total_value, category, vendor = row
+        return [name, sku or '-', quantity, unit, price, total_value, category or '-', vendor or '-']
+    
+    return headers, statement, format_row
+
+def transaction_export(start_date, end_date):
+    # Whole days, including the end date
+    start = datetime.combine(start_date, time.min)
+    end = datetime.combine(end_date + timedelta(days=1), time.min)
+    
+    statement = select(
+        InventoryTransaction.transaction_date, Product.name, Product.sku,
+        InventoryTransaction.transaction_type, InventoryTransaction.quantity,
+        Product.unit, InventoryTransaction.notes
+    ).join(InventoryTransaction.product).where(
+        InventoryTransaction.transaction_date >= start,
+        InventoryTransaction.transaction_date < end
+    ).order_by(InventoryTransaction.transaction_date.desc())
+    
+    headers = ['Date', 'Product', 'SKU', 'Transaction Type', 'Quantity', 'Unit', 'Notes']
+    
+    def format_row(row):
+        transaction_date, product, sku, transaction_type, quantity, unit, notes = row
+        return [
+            transaction_date.strftime('%Y-%m-%d'),
+            product,
+            sku or '-',
+            transaction_type.capitalize(),
+            quantity,
+            unit,
+            notes or '-'
+        ]
+    
+    return headers, statement, format_row
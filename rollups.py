@@ -0,0 +1,270 @@
+import logging
+from collections import defaultdict
+from datetime import date, datetime
+from dateutil.relativedelta import relativedelta
+from sqlalchemy import Date, func, select, delete, insert, case, and_, type_coerce
+from app import db
+from cache import cached
+from utils import dialect_insert
+from models import Sale, SalesDailyRollup, Product, Category
+
+logger = logging.getLogger(__name__)
+
+
+def _upsert_statement():
+    """
+    INSERT ... ON CONFLICT for the rollup table, adding to existing totals
+    """
+    stmt = dialect_insert(db.session.get_bind(), SalesDailyRollup)
+    return stmt.on_conflict_do_update(
+        index_elements=[SalesDailyRollup.product_id, SalesDailyRollup.day],
+        set_={
+            'quantity': SalesDailyRollup.quantity + stmt.excluded.quantity,
+            'revenue': SalesDailyRollup.revenue + stmt.excluded.revenue,
+            'sale_count': SalesDailyRollup.sale_count + stmt.excluded.sale_count,
+        }
+    )
+
+
+def apply_to_rollup(totals, sign=1):
+    """
+    Add (sign=1) or subtract (sign=-1) per product/day totals to the rollup.
+    `totals` maps (product_id, day) to (quantity, revenue, sale_count).
+    """
+    if not totals:
+        return
+
+    values = [
+        {
+            'product_id': product_id,
+            'day': day,
+            'quantity': sign * quantity,
+            'revenue': sign * revenue,
+            'sale_count': sign * sale_count,
+        }
+        for (product_id, day), (quantity, revenue, sale_count) in totals.items()
+    ]
+    db.session.execute(_upsert_statement(), values)
+
+    if sign < 0:
+        db.session.execute(delete(SalesDailyRollup).where(SalesDailyRollup.sale_count <= 0))
+
+
+def sales_rollup_totals(sales, totals=None):
+    """
+    Sum sale value dicts into per product/day totals for apply_to_rollup,
+    adding to an earlier result if given
+    """
+    totals = defaultdict(lambda: [0.0, 0.0, 0]) if totals is None else totals
+    for sale in sales:
+        day = sale['sale_date'].date() if isinstance(sale['sale_date'], datetime) else sale['sale_date']
+        entry = totals[(sale['product_id'], day)]
+        entry[0] += sale['quantity']
+        entry[1] += sale['total']
+        entry[2] += 1
+    return totals
+
+
+def add_sales_to_rollup(sales):
+    """
+    Fold freshly inserted sale value dicts into the rollup
+    """
+    apply_to_rollup(sales_rollup_totals(sales))
+
+
+def _day_column():
+    return func.date(Sale.sale_date)
+
+
+def sale_days(*criteria):
+    """
+    Days on which the sales matching the given criteria fall
+    """
+    day = _day_column()
+    return {_to_date(value) for value in db.session.scalars(select(day).where(*criteria).distinct())}
+
+
+def rebuild_rollup_days(days):
+    """
+    Recompute the rollup rows of the given days from the Sale table, for
+    sales whose rollup state is unknown, such as an interrupted import's
+    """
+    days = sorted(days)
+    if not days:
+        return
+    day = type_coerce(_day_column(), Date)
+    db.session.execute(delete(SalesDailyRollup).where(SalesDailyRollup.day.in_(days)))
+    db.session.execute(
+        insert(SalesDailyRollup).from_select(
+            ['product_id', 'day', 'quantity', 'revenue', 'sale_count'],
+            select(Sale.product_id, day, func.sum(Sale.quantity), func.sum(Sale.total), func.count(Sale.id))
+            .where(day.in_(days))
+            .group_by(Sale.product_id, day)
+        )
+    )
+
+
+def _to_date(value):
+    # SQLite returns DATE() results as 'YYYY-MM-DD' strings
+    if isinstance(value, str):
+        return date.fromisoformat(value)
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def remove_sales_from_rollup(*criteria):
+    """
+    Subtract the sales matching the given criteria from the rollup.
+    Must run before those sales are deleted.
+    """
+    day = _day_column()
+    rows = db.session.execute(
+        select(Sale.product_id, day, func.sum(Sale.quantity), func.sum(Sale.total), func.count(Sale.id))
+        .where(*criteria)
+        .group_by(Sale.product_id, day)
+    )
+    totals = {
+        (product_id, _to_date(sale_day)): (quantity or 0.0, revenue or 0.0, count)
+        for product_id, sale_day, quantity, revenue, count in rows
+    }
+    apply_to_rollup(totals, sign=-1)
+
+
+def rebuild_sales_rollup():
+    """
+    Recompute the whole rollup from the Sale table.
+    Returns the number of rollup rows written.
+    """
+    day = _day_column()
+    db.session.execute(delete(SalesDailyRollup))
+    db.session.execute(
+        insert(SalesDailyRollup).from_select(
+            ['product_id', 'day', 'quantity', 'revenue', 'sale_count'],
+            select(Sale.product_id, day, func.sum(Sale.quantity), func.sum(Sale.total), func.count(Sale.id))
+            .group_by(Sale.product_id, day)
+        )
+    )
+    db.session.commit()
+
+    count = db.session.query(func.count()).select_from(SalesDailyRollup).scalar()
+    logger.info('Rebuilt sales rollup with %d rows', count)
+    return count
+
+
+def has_sales_data():
+    """
+    True if any sales have been recorded
+    """
+    return db.session.query(select(SalesDailyRollup.product_id).limit(1).exists()).scalar()
+
+
+def daily_revenue(start=None, end=None):
+    """
+    Revenue per day, ordered by day, optionally limited to [start, end] (dates)
+    """
+    query = db.session.query(
+        SalesDailyRollup.day,
+        func.sum(SalesDailyRollup.revenue)
+    )
+    if start is not None:
+        query = query.filter(SalesDailyRollup.day >= start)
+    if end is not None:
+        query = query.filter(SalesDailyRollup.day <= end)
+    return query.group_by(SalesDailyRollup.day).order_by(SalesDailyRollup.day).all()
+
+
+def bucket_revenue(days, period='monthly'):
+    """
+    Group (day, revenue) pairs into daily, weekly or monthly buckets.
+    Returns a list of (label, revenue) in chronological order.
+    """
+    if period == 'daily':
+        key, label_format = (lambda d: d), '%Y-%m-%d'
+    elif period == 'weekly':
+        key, label_format = (lambda d: (d.year, int(d.strftime('%W')))), 'Week %W, %Y'
+    else:  # monthly
+        key, label_format = (lambda d: (d.year, d.month)), '%b %Y'
+
+    buckets = {}
+    for day, revenue in days:
+        bucket = key(day)
+        if bucket not in buckets:
+            buckets[bucket] = [day.strftime(label_format), 0.0]
+        buckets[bucket][1] += float(revenue or 0)
+
+    return [tuple(value) for value in buckets.values()]
+
+
+@cached('sales_daily_rollup')
+def revenue_summary(today=None, months=6):
+    """
+    Dashboard revenue KPIs computed in a single aggregate pass over the rollup.
+
+    Returns a dict with the total sale count and revenue, current and previous
+    month revenue, and a list of (label, revenue) for the last `months`
+    calendar months including the current one.
+    """
+    today = today or date.today()
+    current_month_start = date(today.year, today.month, 1)
+    previous_month_start = current_month_start - relativedelta(months=1)
+    month_starts = [current_month_start - relativedelta(months=i) for i in range(months - 1, -1, -1)]
+    next_month_start = current_month_start + relativedelta(months=1)
+
+    def revenue_between(start, end):
+        return func.coalesce(func.sum(case(
+            (and_(SalesDailyRollup.day >= start, SalesDailyRollup.day < end), SalesDailyRollup.revenue),
+            else_=0.0
+        )), 0.0)
+
+    bounds = list(zip(month_starts, month_starts[1:] + [next_month_start]))
+    row = db.session.execute(select(
+        func.coalesce(func.sum(SalesDailyRollup.sale_count), 0),
+        func.coalesce(func.sum(SalesDailyRollup.revenue), 0.0),
+        revenue_between(previous_month_start, current_month_start),
+        *(revenue_between(start, end) for start, end in bounds)
+    )).one()
+
+    sale_count, total_revenue, previous_month_revenue = row[0], row[1], row[2]
+    series = [(start.strftime('%b %Y'), float(value)) for start, value in zip(month_starts, row[3:])]
+
+    return {
+        'sale_count': int(sale_count),
+        'total_revenue': float(total_revenue),
+        'monthly_revenue': series[-1][1],
+        'previous_month_revenue': float(previous_month_revenue),
+        'months': series,
+    }
+
+
+@cached('sales_daily_rollup', 'product', 'category')
+def revenue_by_category():
+    """
+    Revenue per category as a list of (name, revenue), largest first.
+    Products without a category are reported as 'Uncategorized'.
+    """
+    name = func.coalesce(Category.name, 'Uncategorized')
+    rows = db.session.query(
+        name.label('name'),
+        func.sum(SalesDailyRollup.revenue).label('revenue')
+    ).select_from(SalesDailyRollup).join(
+        Product, SalesDailyRollup.product_id == Product.id
+    ).outerjoin(
+        Category, Product.category_id == Category.id
+    ).group_by(Category.id, name).order_by(func.sum(SalesDailyRollup.revenue).desc()).all()
+
+    return [(row.name, float(row.revenue or 0)) for row in rows]
+
+
+@cached('sales_daily_rollup', 'product')
+def top_products_by_revenue(limit=5):
+    """
+    Best selling products by revenue as rows of (name, quantity_sold, revenue)
+    """
+    return db.session.query(
+        Product.name,
+        func.sum(SalesDailyRollup.quantity).label('quantity_sold'),
+        func.sum(SalesDailyRollup.revenue).label('revenue')
+    ).join(SalesDailyRollup).group_by(Product.id, Product.name).order_by(
+        func.sum(SalesDailyRollup.revenue).desc()
+    ).limit(limit).all()
@@ -1,18 +1,43 @@
 import os
-import csv
-from datetime import datetime
-from io import StringIO
+from datetime import datetime, timedelta
+import click
 import pandas as pd
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
-from sqlalchemy import func, extract
+from sqlalchemy import func, tuple_, select
+from sqlalchemy.orm import joinedload
 from app import db
-from models import Product, Sale
+from models import Product, Sale, SalesDailyRollup, ImportBatch, ImportJob
 from forms import SalesUploadForm, ReportForm
+from sales_import import enqueue_sales_import, fail_stale_imports, post_batch_usage, revert_batch
+from versioning import conditional_on
+from exports import EXPORT_FORMATS, columnar_available, export_response
+from rollups import has_sales_data, daily_revenue, bucket_revenue, rebuild_sales_rollup, revenue_by_category
 
 sales = Blueprint('sales', __name__)
 
+@sales.cli.command('rebuild-rollup')
+def rebuild_rollup_command():
+    """
+    Recompute the daily sales rollup from the sale table
+    """
+    count = rebuild_sales_rollup()
+    print(f'Rebuilt sales rollup: {count} product/day rows.')
+
+@sales.cli.command('post-usage')
+@click.argument('batch_id', type=int)
+def post_usage_command(batch_id):
+    """
+    Post the recipe ingredient usage an import batch has not posted yet
+    """
+    batch = db.session.get(ImportBatch, batch_id)
+    if batch is None or batch.status == 'reverted':
+        print(f'No import batch #{batch_id} with sales to post usage for.')
+        return
+    count = post_batch_usage(batch)
+    print(f'Posted {count} ingredient usage transactions for import batch #{batch_id}.')
+
 @sales.route('/revenue')
 @login_required
 def revenue_dashboard():
@@ -21,20 +46,14 @@ def revenue_dashboard():
     """
     try:
         # Check if we have any sales data
-        sales_count = db.session.query(func.count(Sale.id)).scalar() or 0
+        has_sales = has_sales_data()
     except Exception as e:
         # Handle database errors
         flash(f'Database error: {str(e)}. Please make sure your database is properly set up.', 'danger')
         return redirect(url_for('routes.index'))
     
     # Get statistics
-    total_revenue = db.session.query(func.sum(Sale.total)).scalar() or 0
-    
-    # Get today's date for default end date
-    today = datetime.now()
-    
-    # Get start of current month for default start date
-    start_of_month = datetime(today.year, today.month, 1)
+    total_revenue = db.session.query(func.sum(SalesDailyRollup.revenue)).scalar() or 0
     
     # Format the data for Chart.js
     months = []
@@ -43,48 +62,25 @@ def revenue_dashboard():
     category_revenue = []
     
     # Only fetch data if we have sales
-    if sales_count > 0:
-        print(f"Found {sales_count} sales records")
-        
+    if has_sales:
         # Get monthly revenue data for chart
-        monthly_revenue = db.session.query(
-            extract('year', Sale.sale_date).label('year'),
-            extract('month', Sale.sale_date).label('month'),
-            func.sum(Sale.total).label('revenue')
-        ).group_by('year', 'month').order_by('year', 'month').all()
-        
-        for item in monthly_revenue:
-            month_name = datetime(int(item.year), int(item.month), 1).strftime('%b %Y')
-            months.append(month_name)
-            revenue_data.append(float(item.revenue))
+        for label, revenue in bucket_revenue(daily_revenue(), 'monthly'):
+            months.append(label)
+            revenue_data.append(revenue)
         
         # Get top selling products
         top_products = db.session.query(
             Product.name,
-            func.sum(Sale.quantity).label('total_quantity'),
-            func.sum(Sale.total).label('total_revenue')
-        ).join(Sale).group_by(Product.name).order_by(func.sum(Sale.total).desc()).limit(5).all()
+            func.sum(SalesDailyRollup.quantity).label('total_quantity'),
+            func.sum(SalesDailyRollup.revenue).label('total_revenue')
+        ).join(SalesDailyRollup).group_by(Product.name).order_by(func.sum(SalesDailyRollup.revenue).desc()).limit(5).all()
         
         # Calculate revenue by category
-        category_revenue = db.session.query(
-            Product.category_id,
-            func.sum(Sale.total).label('revenue')
-        ).join(Sale).group_by(Product.category_id).all()
+        category_revenue = revenue_by_category()
         
         # Prepare data for direct rendering to charts
-        category_labels = []
-        category_data = []
-        
-        # Get category names for each product category_id
-        for item in category_revenue:
-            product = Product.query.filter_by(category_id=item.category_id).first()
-            if product and product.category:
-                category_name = product.category.name
-            else:
-                category_name = 'Uncategorized'
-            
-            category_labels.append(category_name)
-            category_data.append(float(item.revenue))
+        category_labels = [name for name, _ in category_revenue]
+        category_data = [revenue for _, revenue in category_revenue]
     else:
         # If no sales data, display a message
         flash('No sales data available. Please upload sales data to see revenue insights.', 'info')
@@ -92,8 +88,12 @@ def revenue_dashboard():
         category_labels = []
         category_data = []
     
+    # Import job to show progress for, if one was just started
+    import_job = request.args.get('import_job', type=int)
+    
     return render_template('revenue_dashboard.html',
                            title='Revenue Dashboard',
+                           import_job=import_job,
                            total_revenue=total_revenue,
                            months=months,
                            revenue_data=revenue_data,
@@ -114,78 +114,50 @@ def upload_sales():
         # Get the uploaded file
         file = form.csv_file.data
         
-        # Process the file
+        # Store the file and import it in the background so this worker stays free
         try:
-            # Print debug information
-            print(f"File name: {file.filename}")
-            print(f"File content type: {file.content_type}")
-            
-            # Create file-like object from the file data
-            file_content = file.stream.read().decode("utf-8")
-            print(f"File content (first 200 chars): {file_content[:200]}")
-            
-            stream = StringIO(file_content)
-            
-            # Parse CSV content
-            csv_data = csv.DictReader(stream)
-            
-            # Import the data
-            records_added = 0
-            records_skipped = 0
-            
-            # Convert to list to check if there are rows
-            rows = list(csv_data)
-            print(f"Number of rows in CSV: {len(rows)}")
-            
-            if len(rows) == 0:
-                flash('No data found in the CSV file.', 'warning')
-                return render_template('sales_upload.html', form=form, title='Upload Sales Data')
-            
-            # Print first row as debug info
-            if rows:
-                print(f"First row: {rows[0]}")
-            
-            for row in rows:
-                try:
-                    # Check if product exists
-                    product_id = int(row.get('product_id', 0))
-                    product = Product.query.get(product_id)
-                    
-                    if not product:
-                        print(f"Product not found: {product_id}")
-                        records_skipped += 1
-                        continue
-                    
-                    # Create sale record
-                    sale = Sale(
-                        product_id=product_id,
-                        quantity=float(row['quantity']),
-                        unit_price=float(row['unit_price']),
-                        total=float(row['total']),
-                        sale_date=datetime.strptime(row['date'], '%Y-%m-%d')
-                    )
-                    
-                    db.session.add(sale)
-                    records_added += 1
-                    print(f"Added sale record for product {product_id}")
-                except (ValueError, KeyError) as e:
-                    print(f"Error processing row: {e}")
-                    records_skipped += 1
-                    continue
-            
-            db.session.commit()
-            print(f"Committed {records_added} records to database")
-            flash(f'Successfully imported {records_added} sales records. {records_skipped} records were skipped.', 'success')
-            
-            return redirect(url_for('sales.revenue_dashboard'))
-            
+            job = enqueue_sales_import(file, user_id=current_user.id)
         except Exception as e:
+            db.session.rollback()
             flash(f'Error processing CSV file: {str(e)}', 'danger')
+        else:
+            flash(f'Import of "{job.filename}" has started. Progress is shown below.', 'info')
+            return redirect(url_for('sales.revenue_dashboard', import_job=job.id))
+    
+    fail_stale_imports()
+    recent_batches = ImportBatch.query.order_by(ImportBatch.created_at.desc()).limit(10).all()
+    return render_template('sales_upload.html', form=form, recent_batches=recent_batches, title='Upload Sales Data')
+
+@sales.route('/sales_upload/batches/<int:batch_id>/revert', methods=['POST'])
+@login_required
+def revert_import_batch(batch_id):
+    """
+    Remove every sale imported by one batch
+    """
+    fail_stale_imports()
+    batch = db.get_or_404(ImportBatch, batch_id)
     
-    return render_template('sales_upload.html', form=form, title='Upload Sales Data')
+    if batch.status in ('importing', 'reverted'):
+        flash(f'Import batch #{batch.id} cannot be reverted while it is {batch.status}.', 'warning')
+        return redirect(url_for('sales.upload_sales'))
+    
+    removed = revert_batch(batch, user_id=current_user.id)
+    flash(f'Reverted import batch #{batch.id}: {removed} sales records removed.', 'success')
+    return redirect(url_for('sales.upload_sales'))
+
+@sales.route('/api/sales/imports/<int:job_id>')
+@login_required
+def import_job_status(job_id):
+    """
+    API endpoint reporting the progress of a background sales import
+    """
+    fail_stale_imports()
+    job = db.get_or_404(ImportJob, job_id)
+    return jsonify(job.to_dict())
 
 @sales.route('/api/sales/timeline')
 @login_required
+@conditional_on('sales_daily_rollup')
 def sales_timeline_data():
     """
     API endpoint to get sales timeline data for charts
@@ -200,11 +172,8 @@ def sales_timeline_data():
     }
     
     try:
-        # Check if we have any sales data
-        sales_count = db.session.query(func.count(Sale.id)).scalar() or 0
-        
         # If no sales data, return empty structure
-        if sales_count == 0:
+        if not has_sales_data():
             return jsonify(data)
         
         # Get parameters
@@ -212,45 +181,26 @@ def sales_timeline_data():
         start_date = request.args.get('start_date')
         end_date = request.args.get('end_date')
         
-        # Query base
-        query = db.session.query(
-            Sale.sale_date,
-            func.sum(Sale.total).label('revenue')
-        )
+        start = None
+        end = None
         
         # Apply date filters if provided
         if start_date:
             try:
-                start = datetime.strptime(start_date, '%Y-%m-%d')
-                query = query.filter(Sale.sale_date >= start)
+                start = datetime.strptime(start_date, '%Y-%m-%d').date()
             except ValueError:
                 pass
                 
         if end_date:
             try:
-                end = datetime.strptime(end_date, '%Y-%m-%d')
-                query = query.filter(Sale.sale_date <= end)
+                end = datetime.strptime(end_date, '%Y-%m-%d').date()
             except ValueError:
                 pass
         
-        # Group by the appropriate time period
-        if period == 'daily':
-            query = query.group_by(func.date(Sale.sale_date))
-            date_format = '%Y-%m-%d'
-        elif period == 'weekly':
-            query = query.group_by(func.strftime('%Y-%W', Sale.sale_date))
-            date_format = 'Week %W, %Y'
-        else:  # monthly
-            query = query.group_by(func.strftime('%Y-%m', Sale.sale_date))
-            date_format = '%b %Y'
-        
-        # Execute the query
-        results = query.order_by(Sale.sale_date).all()
-        
-        # Add data to the response structure
-        for date, revenue in results:
-            data['labels'].append(date.strftime(date_format))
-            data['datasets'][0]['data'].append(float(revenue))
+        # Daily totals come from the rollup and are grouped by the requested period
+        for label, revenue in bucket_revenue(daily_revenue(start, end), period):
+            data['labels'].append(label)
+            data['datasets'][0]['data'].append(revenue)
             
     except Exception as e:
         # Log the error but return empty data
@@ -260,6 +210,7 @@ def sales_timeline_data():
 
 @sales.route('/api/sales/category')
 @login_required
+@conditional_on('sales_daily_rollup', 'product', 'category')
 def sales_by_category_data():
     """
     API endpoint to get sales data by category for charts
@@ -278,33 +229,14 @@ def sales_by_category_data():
     }
     
     try:
-        # Check if we have any sales data
-        sales_count = db.session.query(func.count(Sale.id)).scalar() or 0
-        
         # If no sales data, return empty structure
-        if sales_count == 0:
+        if not has_sales_data():
             return jsonify(data)
         
         # Get categories with their sales data
-        results = db.session.query(
-            Product.category_id,
-            func.sum(Sale.total).label('revenue')
-        ).join(Sale).group_by(Product.category_id).all()
-        
-        for category_id, revenue in results:
-            try:
-                # Handle case where category might have been deleted
-                product = Product.query.get(category_id)
-                if product and product.category:
-                    category_name = product.category.name
-                else:
-                    category_name = 'Uncategorized'
-                    
-                data['labels'].append(category_name)
-                data['datasets'][0]['data'].append(float(revenue))
-            except Exception as e:
-                print(f"Error processing category {category_id}: {e}")
-                continue
+        for category_name, revenue in revenue_by_category():
+            data['labels'].append(category_name)
+            data['datasets'][0]['data'].append(revenue)
     
     except Exception as e:
         # Log the error but return empty data
@@ -322,9 +254,7 @@ def sales_report():
     
     try:
         # Check if we have any sales data
-        sales_count = db.session.query(func.count(Sale.id)).scalar() or 0
-        
-        if sales_count == 0 and request.method == 'GET':
+        if request.method == 'GET' and not has_sales_data():
             flash('No sales data available. Please upload sales data first.', 'info')
             return redirect(url_for('sales.upload_sales'))
         
@@ -334,38 +264,156 @@ def sales_report():
             start_date = form.start_date.data
             end_date = form.end_date.data
             
-            # Base query
-            query = Sale.query
-            
-            # Apply date filters if provided
-            if start_date:
-                query = query.filter(Sale.sale_date >= start_date)
-            if end_date:
-                query = query.filter(Sale.sale_date <= end_date)
-            
             # Get results based on report type
             if report_type == 'sales':
-                try:
-                    # Get sales with product details
-                    sales_data = query.order_by(Sale.sale_date.desc()).all()
-                    
-                    if not sales_data:
-                        flash('No sales data found for the selected date range.', 'warning')
-                        return render_template('sales_report_form.html', form=form, title='Generate Sales Report')
-                    
-                    return render_template('sales_report.html',
-                                       title='Sales Report',
-                                       sales=sales_data,
-                                       start_date=start_date,
-                                       end_date=end_date)
-                except Exception as e:
-                    flash(f'Error generating sales report: {str(e)}', 'danger')
-                    print(f"Error in sales report generation: {str(e)}")
-                    return render_template('sales_report_form.html', form=form, title='Generate Sales Report')
+                return redirect(url_for('sales.sales_report_results',
+                                        start_date=start_date.isoformat() if start_date else None,
+                                        end_date=end_date.isoformat() if end_date else None))
         
     except Exception as e:
         flash(f'Database error: {str(e)}. Please make sure your database is properly set up.', 'danger')
         print(f"Error in sales_report: {str(e)}")
         return redirect(url_for('routes.index'))
     
-    return render_template('sales_report_form.html', form=form, title='Generate Sales Report')
\ No newline at end of file
+    return render_template('sales_report_form.html', form=form, title='Generate Sales Report')
+
+# Rows per page of the sales report, and the largest page a client may ask for
+SALES_REPORT_PAGE_SIZE = 100
+SALES_REPORT_MAX_PAGE_SIZE = 500
+
+def _parse_report_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+def _encode_cursor(sale):
+    return f'{sale.sale_date.isoformat()}_{sale.id}'
+
+def _decode_cursor(cursor):
+    try:
+        sale_date, sale_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(sale_date), int(sale_id)
+    except (AttributeError, ValueError):
+        return None
+
+def sales_page(start_date=None, end_date=None, cursor=None, direction='next', per_page=SALES_REPORT_PAGE_SIZE):
+    """
+    One page of sales, newest first, using keyset pagination on (sale_date, id).
+    
+    `cursor` is the encoded key of the last row of the previous page (for
+    direction 'next') or the first row of the following page (for 'prev').
+    Returns (sales, has_next, has_prev).
+    """
+    query = Sale.query.options(joinedload(Sale.product))
+    
+    if start_date:
+        query = query.filter(Sale.sale_date >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        query = query.filter(Sale.sale_date < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    
+    key = _decode_cursor(cursor) if cursor else None
+    if key and direction == 'prev':
+        # Walk backwards from the cursor, then restore newest-first order
+        rows = query.filter(tuple_(Sale.sale_date, Sale.id) > key).order_by(
+            Sale.sale_date.asc(), Sale.id.asc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        rows = list(reversed(rows[:per_page]))
+        return rows, True, has_prev
+    
+    if key:
+        query = query.filter(tuple_(Sale.sale_date, Sale.id) < key)
+    rows = query.order_by(Sale.sale_date.desc(), Sale.id.desc()).limit(per_page + 1).all()
+    has_next = len(rows) > per_page
+    return rows[:per_page], has_next, key is not None
+
+def sales_range_totals(start_date=None, end_date=None):
+    """
+    Count, quantity and revenue of all sales in the date range, from the daily rollup
+    """
+    query = db.session.query(
+        func.coalesce(func.sum(SalesDailyRollup.sale_count), 0).label('count'),
+        func.coalesce(func.sum(SalesDailyRollup.quantity), 0.0).label('quantity'),
+        func.coalesce(func.sum(SalesDailyRollup.revenue), 0.0).label('revenue')
+    )
+    if start_date:
+        query = query.filter(SalesDailyRollup.day >= start_date)
+    if end_date:
+        query = query.filter(SalesDailyRollup.day <= end_date)
+    return query.one()
+
+@sales.route('/sales_report/results')
+@login_required
+def sales_report_results():
+    """
+    Display one page of the sales report for a date range
+    """
+    start_date = _parse_report_date(request.args.get('start_date'))
+    end_date = _parse_report_date(request.args.get('end_date'))
+    cursor = request.args.get('cursor')
+    direction = request.args.get('direction', 'next')
+    per_page = min(max(request.args.get('per_page', SALES_REPORT_PAGE_SIZE, type=int), 1), SALES_REPORT_MAX_PAGE_SIZE)
+    
+    totals = sales_range_totals(start_date, end_date)
+    if totals.count == 0:
+        flash('No sales data found for the selected date range.', 'warning')
+        return redirect(url_for('sales.sales_report'))
+    
+    sales_data, has_next, has_prev = sales_page(start_date, end_date, cursor, direction, per_page)
+    
+    page_args = {
+        'start_date': start_date.isoformat() if start_date else None,
+        'end_date': end_date.isoformat() if end_date else None,
+        'per_page': per_page if per_page != SALES_REPORT_PAGE_SIZE else None,
+    }
+    next_url = url_for('sales.sales_report_results', cursor=_encode_cursor(sales_data[-1]),
+                       **page_args) if has_next and sales_data else None
+    prev_url = url_for('sales.sales_report_results', cursor=_encode_cursor(sales_data[0]),
+                       direction='prev', **page_args) if has_prev and sales_data else None
+    
+    return render_template('sales_report.html',
+                           title='Sales Report',
+                           sales=sales_data,
+                           totals=totals,
+                           page_total=sum(sale.total for sale in sales_data),
+                           first_url=url_for('sales.sales_report_results', **page_args) if has_prev else None,
+                           next_url=next_url,
+                           prev_url=prev_url,
+                           start_date=start_date,
+                           end_date=end_date)
+
+@sales.route('/sales/export')
+@login_required
+def export_sales():
+    """
+    Download every sale in a date range as CSV, Parquet or Arrow IPC
+    """
+    start_date = _parse_report_date(request.args.get('start_date'))
+    end_date = _parse_report_date(request.args.get('end_date'))
+    export_format = request.args.get('format', 'csv')
+    
+    if export_format not in EXPORT_FORMATS:
+        flash('Invalid export format.', 'danger')
+        return redirect(url_for('sales.sales_report'))
+    if export_format != 'csv' and not columnar_available():
+        flash('Parquet and Arrow exports require the pyarrow package.', 'warning')
+        return redirect(url_for('sales.sales_report'))
+    
+    statement = select(
+        Sale.id, Sale.sale_date, Product.name, Product.sku,
+        Sale.quantity, Sale.unit_price, Sale.total, Sale.batch_id
+    ).join(Sale.product).order_by(Sale.sale_date, Sale.id)
+    if start_date:
+        statement = statement.where(Sale.sale_date >= datetime.combine(start_date, datetime.min.time()))
+    if end_date:
+        statement = statement.where(Sale.sale_date < datetime.combine(end_date + timedelta(days=1), datetime.min.time()))
+    
+    headers = ['Sale ID', 'Date', 'Product', 'SKU', 'Quantity', 'Unit Price', 'Total', 'Import Batch']
+    
+    def format_row(row):
+        sale_id, sale_date, product, sku, quantity, unit_price, total, batch_id = row
+        return [sale_id, sale_date.strftime('%Y-%m-%d %H:%M:%S'), product, sku or '-',
+                quantity, unit_price, total, batch_id or '']
+    
+    return export_response(export_format, 'sales_export', headers, statement, format_row)
+
@@ -0,0 +1,389 @@
+import csv
+import hashlib
+import io
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+from itertools import islice
+from flask import current_app
+from collections import Counter
+from sqlalchemy import insert, delete, func, select
+from app import db
+from models import Product, Sale, ImportBatch, ImportJob
+from jobs import submit_job
+from recipes import UsageAccumulator, batch_ingredient_usage, post_ingredient_usage, restore_ingredient_usage
+from rollups import apply_to_rollup, rebuild_rollup_days, remove_sales_from_rollup, sale_days, sales_rollup_totals
+
+logger = logging.getLogger(__name__)
+
+# Number of CSV rows parsed and inserted per bulk statement
+CHUNK_SIZE = 5000
+
+REQUIRED_COLUMNS = ('product_id', 'quantity', 'unit_price', 'total', 'date')
+
+# Optional column carrying the POS system's own identifier for a sale line
+TRANSACTION_ID_COLUMN = 'transaction_id'
+
+# Minutes without progress after which a queued or running import is
+# taken to have died with its process
+IMPORT_STALE_MINUTES = int(os.environ.get('IMPORT_STALE_MINUTES', 15))
+
+
+class SalesImportError(ValueError):
+    """Raised when an uploaded sales file cannot be imported at all"""
+
+
+def iter_chunks(iterable, size=CHUNK_SIZE):
+    """
+    Yield lists of at most `size` items from an iterable without materializing it
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+@lru_cache(maxsize=4096)
+def parse_sale_date(value):
+    """
+    Parse a YYYY-MM-DD sale date. Exports repeat a few hundred distinct
+    days across all their rows, so each is parsed only once.
+    """
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def parse_sale_row(row, product_ids):
+    """
+    Convert a CSV row into a dict of Sale column values.
+    Returns None if the row references an unknown product.
+    Raises ValueError/KeyError/TypeError for malformed rows.
+    """
+    product_id = int(row['product_id'])
+    if product_id not in product_ids:
+        return None
+
+    return {
+        'product_id': product_id,
+        'quantity': float(row['quantity']),
+        'unit_price': float(row['unit_price']),
+        'total': float(row['total']),
+        'sale_date': parse_sale_date(row['date'].strip()),
+    }
+
+
+def file_fingerprint(path):
+    """
+    SHA-256 hex digest of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class NaturalKeyBuilder:
+    """
+    Builds the natural key that identifies a sale row across uploads.
+
+    Rows carrying a POS transaction_id are keyed by it and the product, as
+    one receipt can hold several lines. Otherwise the key is derived from
+    the row's values. Either way it ends with how many rows with the same
+    key preceded it in the file, so two identical lattes sold on the same
+    day stay distinct while re-uploading an overlapping export maps each
+    row onto the same key again.
+    """
+
+    def __init__(self):
+        self.seen = Counter()
+
+    def __call__(self, row, sale):
+        transaction_id = (row.get(TRANSACTION_ID_COLUMN) or '').strip()
+        if transaction_id:
+            source = f'txn|{transaction_id}|{sale["product_id"]}'
+        else:
+            source = (f"{sale['product_id']}|{sale['sale_date'].date().isoformat()}|"
+                      f"{sale['quantity']!r}|{sale['unit_price']!r}|{sale['total']!r}")
+        self.seen[source] += 1
+        source = f'{source}|{self.seen[source]}'
+        return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def existing_natural_keys(keys):
+    """
+    Return the subset of keys already present in the Sale table (index lookup)
+    """
+    if not keys:
+        return set()
+    return set(db.session.scalars(select(Sale.natural_key).where(Sale.natural_key.in_(keys))))
+
+
+def import_sales_csv(binary_stream, chunk_size=CHUNK_SIZE, on_chunk=None, batch_id=None, user_id=None):
+    """
+    Stream a sales CSV from a binary file object into the Sale table.
+
+    The file is decoded and parsed incrementally, product IDs are checked
+    against a single preloaded set and each chunk is written with one Core
+    executemany INSERT, so memory use does not grow with the size of the
+    upload. The daily sales rollup is summed across the whole file and
+    upserted once, in the final commit.
+
+    Every row gets a natural key, and rows whose key was imported before are
+    counted as duplicates and not inserted again. Rows for unknown products
+    are counted as skipped, malformed rows as failed. Inserted rows are tagged
+    with batch_id. If given, on_chunk(counts) is called after every chunk and
+    may commit to make progress visible to other sessions.
+
+    Once the sales are committed, the ingredients their recipes use are
+    depleted with one usage transaction per ingredient and day.
+
+    Returns a dict with 'processed', 'added', 'duplicate', 'skipped',
+    'failed' and 'ingredient_usages' counts.
+    """
+    text_stream = io.TextIOWrapper(binary_stream, encoding='utf-8-sig', newline='')
+    reader = csv.DictReader(text_stream)
+
+    if not reader.fieldnames:
+        raise SalesImportError('No data found in the CSV file.')
+
+    missing = [c for c in REQUIRED_COLUMNS if c not in reader.fieldnames]
+    if missing:
+        raise SalesImportError(f'CSV file is missing required columns: {", ".join(missing)}')
+
+    product_ids = {pid for (pid,) in db.session.query(Product.id)}
+
+    natural_key = NaturalKeyBuilder()
+    usage = UsageAccumulator()
+    rollup = None
+    counts = {'processed': 0, 'added': 0, 'duplicate': 0, 'skipped': 0, 'failed': 0}
+
+    for chunk in iter_chunks(reader, chunk_size):
+        values = []
+        for row in chunk:
+            try:
+                sale = parse_sale_row(row, product_ids)
+            except (ValueError, KeyError, TypeError) as e:
+                logger.debug('Malformed sales row %r: %s', row, e)
+                counts['failed'] += 1
+                continue
+
+            if sale is None:
+                counts['skipped'] += 1
+                continue
+
+            sale['natural_key'] = natural_key(row, sale)
+            sale['batch_id'] = batch_id
+            values.append(sale)
+
+        # A key repeated within the chunk would fail the unique index
+        unique = {}
+        for v in values:
+            unique.setdefault(v['natural_key'], v)
+        counts['duplicate'] += len(values) - len(unique)
+        values = list(unique.values())
+
+        existing = existing_natural_keys(list(unique))
+        if existing:
+            values = [v for v in values if v['natural_key'] not in existing]
+            counts['duplicate'] += len(existing)
+
+        if values:
+            db.session.execute(insert(Sale.__table__), values)
+            rollup = sales_rollup_totals(values, rollup)
+            usage.add(values)
+            counts['added'] += len(values)
+
+        counts['processed'] += len(chunk)
+        logger.debug('Imported sales chunk: %r', counts)
+
+        if on_chunk is not None:
+            on_chunk(counts)
+
+    apply_to_rollup(rollup)
+    db.session.commit()
+    counts['ingredient_usages'] = len(post_ingredient_usage(usage.totals(), batch_id, user_id))
+    logger.info('Sales import finished: %r', counts)
+
+    return counts
+
+
+def upload_directory():
+    """
+    Directory where uploaded sales files wait for their import job
+    """
+    path = os.path.join(current_app.instance_path, 'imports')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def enqueue_sales_import(file_storage, user_id=None):
+    """
+    Store an uploaded sales file and queue a background job to import it.
+    Returns the new ImportJob.
+    """
+    stored_path = os.path.join(upload_directory(), f'{uuid.uuid4().hex}.csv')
+    file_storage.save(stored_path)
+
+    job = ImportJob(
+        filename=file_storage.filename,
+        stored_path=stored_path,
+        status='queued',
+        created_by=user_id
+    )
+    db.session.add(job)
+    db.session.commit()
+
+    submit_job(run_import_job, job.id)
+    return job
+
+
+def run_import_job(job_id):
+    """
+    Import the stored file of an ImportJob, recording progress after every chunk
+    """
+    job = db.session.get(ImportJob, job_id)
+    if job is None or job.status != 'queued':
+        return
+
+    stored_path = job.stored_path
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = datetime.utcnow()
+    db.session.commit()
+
+    batch = None
+
+    def record_progress(counts):
+        job.rows_processed = counts['processed']
+        job.rows_added = counts['added']
+        job.rows_duplicate = counts['duplicate']
+        job.rows_skipped = counts['skipped']
+        job.rows_failed = counts['failed']
+        batch.rows_added = counts['added']
+        batch.rows_duplicate = counts['duplicate']
+        job.heartbeat_at = datetime.utcnow()
+        db.session.commit()
+    
+    try:
+        fingerprint = file_fingerprint(stored_path)
+
+        # An identical file that is already imported has nothing new to offer
+        previous = ImportBatch.query.filter_by(fingerprint=fingerprint, status='completed').first()
+        if previous is not None:
+            job.batch_id = previous.id
+            job.rows_duplicate = (previous.rows_added or 0) + (previous.rows_duplicate or 0)
+            job.status = 'completed'
+            return
+
+        batch = ImportBatch(
+            filename=job.filename,
+            fingerprint=fingerprint,
+            status='importing',
+            created_by=job.created_by
+        )
+        db.session.add(batch)
+        db.session.flush()
+        job.batch_id = batch.id
+        db.session.commit()
+
+        with open(stored_path, 'rb') as f:
+            counts = import_sales_csv(f, on_chunk=record_progress, batch_id=batch.id,
+                                      user_id=job.created_by)
+        batch.status = 'completed'
+        record_progress(counts)
+        job.status = 'completed'
+    except Exception as e:
+        db.session.rollback()
+        if not isinstance(e, SalesImportError):
+            logger.exception('Sales import job %s failed', job_id)
+        job.status = 'failed'
+        job.error = str(e)
+        if batch is not None:
+            batch.status = 'failed'
+            # Chunks committed before the failure are not in the rollup yet
+            rebuild_rollup_days(sale_days(Sale.batch_id == batch.id))
+    finally:
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+
+        try:
+            os.remove(stored_path)
+        except OSError:
+            pass
+
+
+def fail_stale_imports(now=None):
+    """
+    Mark imports whose process died as failed: jobs queued or running
+    without progress for IMPORT_STALE_MINUTES, and batches still importing
+    without a live job. Their committed sales can then be reverted.
+    Returns the number of jobs and batches marked failed.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(minutes=IMPORT_STALE_MINUTES)
+
+    stale_jobs = ImportJob.query.filter(
+        ImportJob.status.in_(('queued', 'running')),
+        func.coalesce(ImportJob.heartbeat_at, ImportJob.created_at) < cutoff
+    ).all()
+    for job in stale_jobs:
+        job.status = 'failed'
+        job.error = 'The import was interrupted. Revert its batch and upload the file again.'
+        job.finished_at = now
+        try:
+            os.remove(job.stored_path)
+        except OSError:
+            pass
+
+    live_batches = select(ImportJob.batch_id).where(
+        ImportJob.status.in_(('queued', 'running')),
+        ImportJob.batch_id.isnot(None)
+    )
+    stale_batches = ImportBatch.query.filter(
+        ImportBatch.status == 'importing',
+        ImportBatch.created_at < cutoff,
+        ImportBatch.id.not_in(live_batches)
+    ).all()
+    for batch in stale_batches:
+        batch.status = 'failed'
+        rebuild_rollup_days(sale_days(Sale.batch_id == batch.id))
+
+    if stale_jobs or stale_batches:
+        db.session.commit()
+        logger.warning('Marked %s interrupted import jobs and %s batches as failed',
+                       len(stale_jobs), len(stale_batches))
+    return len(stale_jobs) + len(stale_batches)
+
+
+def post_batch_usage(batch, user_id=None):
+    """
+    Post the ingredient usage of a batch's stored sales that has not been
+    posted yet, e.g. after its import failed once the sales were committed.
+    Returns the number of usage transactions posted.
+    """
+    return len(post_ingredient_usage(batch_ingredient_usage(batch.id), batch.id, user_id))
+
+
+def revert_batch(batch, user_id=None):
+    """
+    Delete every sale imported by a batch in a single statement and put
+    back the ingredient stock its recipes used. The rollup of a batch that
+    did not complete may lack some of its sales, so its days are
+    recomputed instead of subtracted.
+    Returns the number of sales removed.
+    """
+    completed = batch.status == 'completed'
+    days = None if completed else sale_days(Sale.batch_id == batch.id)
+    if completed:
+        remove_sales_from_rollup(Sale.batch_id == batch.id)
+    restore_ingredient_usage(batch.id, user_id)
+    result = db.session.execute(delete(Sale).where(Sale.batch_id == batch.id))
+    if not completed:
+        rebuild_rollup_days(days)
+    batch.status = 'reverted'
+    batch.reverted_at = datetime.utcnow()
+    db.session.commit()
+    return result.rowcount
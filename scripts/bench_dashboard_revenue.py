@@ -0,0 +1,114 @@
+"""
+Benchmark the dashboard revenue KPIs on a large synthetic sale table.
+
+Builds a scratch SQLite database with ROWS sales spread over two years,
+then times the old per-month Sale aggregates against the single rollup
+query used by main.dashboard. Run from the repository root:
+
+    python scripts/bench_dashboard_revenue.py [ROWS]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+PRODUCTS = 200
+REPEAT = 5
+
+workdir = tempfile.mkdtemp(prefix='bench-dashboard-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dateutil.relativedelta import relativedelta  # noqa: E402
+from sqlalchemy import func, insert  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Product, Sale  # noqa: E402
+from rollups import rebuild_sales_rollup, revenue_summary  # noqa: E402
+
+
+def seed():
+    random.seed(42)
+    db.session.execute(insert(Product), [
+        {'id': i, 'name': f'Product {i}', 'price': 1.0} for i in range(1, PRODUCTS + 1)
+    ])
+    start = datetime.now() - timedelta(days=730)
+    batch = []
+    for i in range(ROWS):
+        quantity = random.randint(1, 4)
+        price = random.choice((2.5, 3.25, 4.0, 4.75))
+        batch.append({
+            'product_id': random.randint(1, PRODUCTS),
+            'quantity': quantity,
+            'unit_price': price,
+            'total': quantity * price,
+            'sale_date': start + timedelta(days=random.randint(0, 730)),
+        })
+        if len(batch) == 50_000:
+            db.session.execute(insert(Sale), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(Sale), batch)
+    db.session.commit()
+
+
+def legacy_kpis():
+    """The queries main.dashboard used to run against the sale table"""
+    today = datetime.now()
+    sale_count = db.session.query(func.count(Sale.id)).scalar() or 0
+    total_revenue = db.session.query(func.sum(Sale.total)).scalar() or 0
+    current_month_start = datetime(today.year, today.month, 1)
+    previous_month_start = current_month_start - relativedelta(months=1)
+    previous_month_end = current_month_start - relativedelta(days=1)
+    monthly = db.session.query(func.sum(Sale.total)).filter(Sale.sale_date >= current_month_start).scalar() or 0
+    previous = db.session.query(func.sum(Sale.total)).filter(
+        Sale.sale_date >= previous_month_start, Sale.sale_date <= previous_month_end).scalar() or 0
+    values = []
+    for i in range(5, -1, -1):
+        month_date = today - relativedelta(months=i)
+        month_start = datetime(month_date.year, month_date.month, 1)
+        if i > 0:
+            next_month_date = month_date + relativedelta(months=1)
+            month_end = datetime(next_month_date.year, next_month_date.month, 1) - relativedelta(days=1)
+        else:
+            month_end = today
+        values.append(db.session.query(func.sum(Sale.total)).filter(
+            Sale.sale_date >= month_start, Sale.sale_date <= month_end).scalar() or 0)
+    return sale_count, total_revenue, monthly, previous, values
+
+
+def timed(func_):
+    timings = []
+    for _ in range(REPEAT):
+        started = time.perf_counter()
+        func_()
+        timings.append(time.perf_counter() - started)
+    return min(timings) * 1000, sum(timings) / len(timings) * 1000
+
+
+def main():
+    with app.app_context():
+        print(f'Seeding {ROWS:,} sales into {workdir} ...')
+        started = time.perf_counter()
+        seed()
+        print(f'  seeded in {time.perf_counter() - started:.1f}s')
+
+        started = time.perf_counter()
+        rollup_rows = rebuild_sales_rollup()
+        print(f'  rollup rebuilt ({rollup_rows:,} rows) in {time.perf_counter() - started:.1f}s')
+
+        legacy = legacy_kpis()
+        summary = revenue_summary()
+        print(f'Sale count: legacy={legacy[0]:,} rollup={summary["sale_count"]:,}')
+        print(f'Total revenue: legacy={legacy[1]:,.2f} rollup={summary["total_revenue"]:,.2f}')
+
+        for name, func_ in (('legacy (10 queries on sale)', legacy_kpis),
+                            ('revenue_summary (1 query on rollup)', revenue_summary)):
+            best, mean = timed(func_)
+            print(f'{name:40s} best {best:8.1f} ms   mean {mean:8.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
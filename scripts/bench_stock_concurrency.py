@@ -0,0 +1,112 @@
+"""
+Check stock updates for lost writes under concurrent writers.
+
+Builds a scratch SQLite database with one product, then has WRITERS
+threads each log USAGE_PER_WRITER usage transactions of one unit at the
+same time: first with the old read-modify-write update that
+inventory.add_transaction used to do, then with stock.post_transaction.
+A correct run ends with the starting quantity minus every usage, and the
+ledger agreeing with the product row. Run from the repository root:
+
+    python scripts/bench_stock_concurrency.py [WRITERS]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+WRITERS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+USAGE_PER_WRITER = 5
+START_QUANTITY = 1_000_000.0
+
+workdir = tempfile.mkdtemp(prefix='bench-stock-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func  # noqa: E402
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app import app, db  # noqa: E402
+from models import Product, InventoryTransaction, StockLedgerEntry  # noqa: E402
+from ledger import record_stock_change  # noqa: E402
+from stock import post_transaction  # noqa: E402
+
+
+def legacy_usage(product_id):
+    """The read-modify-write update inventory.add_transaction used to do"""
+    product = db.session.get(Product, product_id)
+    if product.quantity < 1:
+        raise ValueError('Not enough stock')
+    product.quantity -= 1
+    db.session.add(InventoryTransaction(product_id=product_id, transaction_type='usage', quantity=1))
+    db.session.commit()
+
+
+def atomic_usage(product_id):
+    post_transaction(product_id, 'usage', 1)
+
+
+def run_writers(target, product_id):
+    barrier = threading.Barrier(WRITERS)
+    errors = []
+
+    def writer():
+        with app.app_context():
+            barrier.wait()
+            for _ in range(USAGE_PER_WRITER):
+                try:
+                    target(product_id)
+                except OperationalError as e:
+                    db.session.rollback()
+                    errors.append(e)
+            db.session.remove()
+
+    threads = [threading.Thread(target=writer) for _ in range(WRITERS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, errors
+
+
+def new_product(name):
+    product = Product(name=name, quantity=START_QUANTITY, min_quantity=0)
+    db.session.add(product)
+    db.session.flush()
+    record_stock_change(product.id, START_QUANTITY, 'opening')
+    db.session.commit()
+    return product.id
+
+
+def report(name, product_id, elapsed, errors):
+    db.session.expire_all()
+    quantity = db.session.get(Product, product_id).quantity
+    logged = db.session.query(func.count(InventoryTransaction.id)).filter_by(product_id=product_id).scalar()
+    ledger = db.session.query(func.sum(StockLedgerEntry.quantity_change)).filter_by(product_id=product_id).scalar()
+    expected = START_QUANTITY - logged
+    print(f'\n{name}: {WRITERS} writers x {USAGE_PER_WRITER} usages in {elapsed:.2f}s')
+    print(f'    transactions logged:   {logged}')
+    print(f'    failed with errors:    {len(errors)}')
+    print(f'    final quantity:        {quantity:.0f} (expected {expected:.0f})')
+    print(f'    lost updates:          {quantity - expected:.0f}')
+    if ledger is not None:
+        print(f'    ledger total:          {ledger:.0f}')
+
+
+def main():
+    with app.app_context():
+        legacy_id = new_product('Legacy')
+        atomic_id = new_product('Atomic')
+
+    elapsed, errors = run_writers(legacy_usage, legacy_id)
+    with app.app_context():
+        report('Read-modify-write', legacy_id, elapsed, errors)
+
+    elapsed, errors = run_writers(atomic_usage, atomic_id)
+    with app.app_context():
+        report('Atomic UPDATE with busy retry', atomic_id, elapsed, errors)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Print query plans for the hot query paths before and after the
+0004_hot_path_indexes migration.
+
+Builds a scratch SQLite database, drops the hot path indexes to show the
+old plans, then recreates them the way the migration does. Run from the
+repository root:
+
+    python scripts/explain_hot_queries.py
+"""
+import os
+import sys
+import tempfile
+from datetime import date, datetime, timedelta
+
+workdir = tempfile.mkdtemp(prefix='explain-hot-queries-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(workdir, 'explain.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import func, select, text  # noqa: E402
+from sqlalchemy.schema import DropIndex  # noqa: E402
+from app import app, db  # noqa: E402
+from migrations import create_indexes  # noqa: E402
+from models import Product, InventoryTransaction, Sale, SalesDailyRollup, Shift  # noqa: E402
+
+HOT_MODELS = (Product, InventoryTransaction, Sale, SalesDailyRollup, Shift)
+
+
+def hot_queries():
+    now = datetime(2025, 6, 15)
+    week_start = now - timedelta(days=7)
+    return {
+        'Sale revenue for a date range': select(func.sum(Sale.total)).where(
+            Sale.sale_date >= now - timedelta(days=30), Sale.sale_date <= now),
+        'Sales of one product in a range': select(Sale.id).where(
+            Sale.product_id == 1, Sale.sale_date >= week_start),
+        'Transaction report for a range': select(InventoryTransaction).where(
+            InventoryTransaction.transaction_date >= week_start,
+            InventoryTransaction.transaction_date < now
+        ).order_by(InventoryTransaction.transaction_date.desc()),
+        'Recent transactions on the dashboard': select(InventoryTransaction).order_by(
+            InventoryTransaction.transaction_date.desc()).limit(5),
+        'Shifts in the calendar window': select(Shift).where(
+            Shift.start_time >= week_start, Shift.end_time <= now + timedelta(days=31)),
+        'Low stock products': select(Product).where(Product.is_low_stock),
+        'Products in a category': select(Product).where(Product.category_id == 1),
+        'Rollup revenue for a date range': select(func.sum(SalesDailyRollup.revenue)).where(
+            SalesDailyRollup.day >= date(2025, 5, 1), SalesDailyRollup.day <= date(2025, 5, 31)),
+    }
+
+
+def explain(connection, statement):
+    compiled = statement.compile(dialect=connection.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup or ())
+    rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params)
+    return [row[-1] for row in rows]
+
+
+def print_plans(connection, heading):
+    print(f'\n=== {heading} ===')
+    for name, statement in hot_queries().items():
+        print(f'\n{name}:')
+        for line in explain(connection, statement):
+            print(f'    {line}')
+
+
+def main():
+    with app.app_context(), db.engine.begin() as connection:
+        for model in HOT_MODELS:
+            for index in model.__table__.indexes:
+                connection.execute(DropIndex(index, if_exists=True))
+        connection.execute(text('ANALYZE'))
+        print_plans(connection, 'Before: primary keys and unique constraints only')
+
+        create_indexes(connection, *HOT_MODELS)
+        connection.execute(text('ANALYZE'))
+        print_plans(connection, 'After: 0004_hot_path_indexes')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Indexed product search over name, SKU and description.
+
+On SQLite the product_fts FTS5 table (trigram tokenizer, kept in sync by
+triggers) answers substring matches from an index. The trigram tokenizer
+needs SQLite 3.34 or later, so older libraries go without the table. On
+PostgreSQL a pg_trgm GIN index serves ILIKE on the same concatenated text.
+Terms shorter than a trigram, and databases without either index, fall
+back to a plain ILIKE.
+"""
+import logging
+import re
+from sqlalchemy import func, inspect, literal_column, or_, select, text
+from sqlalchemy.exc import DBAPIError
+from app import db
+from models import Product
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'product_fts'
+
+# Trigram indexes can only answer terms of at least three characters
+MIN_INDEXED_TERM = 3
+
+# First SQLite release with the FTS5 trigram tokenizer
+MIN_TRIGRAM_SQLITE = (3, 34, 0)
+
+_fts_available = {}
+
+
+def search_document():
+    """
+    The text expression indexed for product search on PostgreSQL
+    """
+    # Literals are inlined so the expression matches ix_product_search_trgm
+    empty, space = literal_column("''"), literal_column("' '")
+    return (
+        func.coalesce(Product.name, empty).op('||')(space)
+        .op('||')(func.coalesce(Product.sku, empty)).op('||')(space)
+        .op('||')(func.coalesce(Product.description, empty))
+    )
+
+
+def search_terms(query_text):
+    return [term for term in re.split(r'\s+', query_text.strip()) if term]
+
+
+def sqlite_has_trigram(connection):
+    """
+    True if the connection's SQLite library can build FTS5 trigram tables
+    """
+    version = connection.exec_driver_sql('SELECT sqlite_version()').scalar()
+    if tuple(int(part) for part in version.split('.')[:3]) < MIN_TRIGRAM_SQLITE:
+        return False
+
+    # Builds may leave out FTS5 or its tokenizers, so try one
+    try:
+        with connection.begin_nested():
+            connection.exec_driver_sql(
+                f"CREATE VIRTUAL TABLE temp.{FTS_TABLE}_probe USING fts5(body, tokenize='trigram')")
+            connection.exec_driver_sql(f'DROP TABLE temp.{FTS_TABLE}_probe')
+    except DBAPIError:
+        return False
+    return True
+
+
+def has_fts_table(bind):
+    """
+    True if the SQLite FTS5 product index exists and the SQLite library
+    can read it (checked once per engine)
+    """
+    key = bind.engine.url
+    if key not in _fts_available:
+        with bind.engine.connect() as connection:
+            _fts_available[key] = (inspect(connection).has_table(FTS_TABLE)
+                                   and sqlite_has_trigram(connection))
+    return _fts_available[key]
+
+
+def _fts_match_expression(terms):
+    # Quote every term so punctuation in SKUs is matched literally
+    return ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+
+def _ilike_filter(terms):
+    return [
+        or_(
+            Product.name.ilike(f'%{term}%'),
+            Product.sku.ilike(f'%{term}%'),
+            Product.description.ilike(f'%{term}%')
+        )
+        for term in terms
+    ]
+
+
+def product_search_filter(query_text):
+    """
+    SQL criteria matching products whose name, SKU or description contain
+    every whitespace-separated term of query_text (case-insensitive)
+    """
+    terms = search_terms(query_text)
+    if not terms:
+        return []
+
+    bind = db.session.get_bind()
+    dialect = bind.dialect.name
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_TERM]
+    short = [term for term in terms if len(term) < MIN_INDEXED_TERM]
+
+    if dialect == 'sqlite' and indexed and has_fts_table(bind):
+        matches = select(text('rowid')).select_from(text(FTS_TABLE)).where(
+            text(f'{FTS_TABLE} MATCH :fts_query').bindparams(fts_query=_fts_match_expression(indexed))
+        )
+        return [Product.id.in_(matches)] + _ilike_filter(short)
+
+    if dialect == 'postgresql':
+        document = search_document()
+        return [document.ilike(f'%{term}%') for term in terms]
+
+    return _ilike_filter(terms)
+
+
+def create_search_index(connection):
+    """
+    Create the product search index for the connection's database.
+    Returns False if the database cannot have one, leaving product search
+    on ILIKE.
+    """
+    dialect = connection.dialect.name
+
+    if dialect == 'sqlite':
+        if not sqlite_has_trigram(connection):
+            logger.warning('SQLite %s lacks the FTS5 trigram tokenizer; product search will not be indexed',
+                           connection.exec_driver_sql('SELECT sqlite_version()').scalar())
+            return False
+
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "name, sku, description, content='product', content_rowid='id', tokenize='trigram')"
+        )
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS product_fts_insert AFTER INSERT ON product BEGIN
+                INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+                VALUES (new.id, new.name, new.sku, new.description);
+            END
+        """)
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS product_fts_delete AFTER DELETE ON product BEGIN
+                INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+                VALUES ('delete', old.id, old.name, old.sku, old.description);
+            END
+        """)
+        connection.exec_driver_sql(f"""
+            CREATE TRIGGER IF NOT EXISTS product_fts_update AFTER UPDATE OF name, sku, description ON product BEGIN
+                INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, sku, description)
+                VALUES ('delete', old.id, old.name, old.sku, old.description);
+                INSERT INTO {FTS_TABLE}(rowid, name, sku, description)
+                VALUES (new.id, new.name, new.sku, new.description);
+            END
+        """)
+        connection.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+        return True
+
+    if dialect == 'postgresql':
+        connection.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        connection.exec_driver_sql(
+            "CREATE INDEX IF NOT EXISTS ix_product_search_trgm ON product USING gin "
+            "((coalesce(name, '') || ' ' || coalesce(sku, '') || ' ' || coalesce(description, '')) gin_trgm_ops)"
+        )
+        return True
+
+    return False
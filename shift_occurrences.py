@@ -0,0 +1,143 @@
+"""
+Occurrences of one-off and recurring shifts.
+
+A recurring shift is stored once: its start_time and end_time give the
+first day and the hours, recurring_days the weekdays it repeats on
+('Mon,Wed,Fri'; the first day's weekday if empty) and recurrence_end_date
+the last day, if any. ShiftException rows cancel or move single
+occurrences.
+
+Occurrences are expanded lazily one calendar week (Monday to Sunday) at a
+time. Each week is a cached, plain-data list, dropped when a shift, shift
+exception or staff member is written, so a month view costs at most the
+weeks in view plus one expansions however often it is requested. An
+occurrence belongs to the week it starts in.
+"""
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+from cache import cached
+from models import Shift, ShiftException
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+
+def week_start(day):
+    """
+    Monday of the week containing day
+    """
+    return day - timedelta(days=day.weekday())
+
+
+def _weekdays(shift):
+    days = {day.strip() for day in (shift.recurring_days or '').split(',') if day.strip()}
+    if not days:
+        return {shift.start_time.weekday()}
+    return {index for index, name in enumerate(WEEKDAYS) if name in days}
+
+
+def _occurrence(shift, start, end, occurrence_date, exception=None):
+    staff = shift.staff
+    return {
+        'shift_id': shift.id,
+        'occurrence_date': occurrence_date,
+        'start': start,
+        'end': end,
+        'title': shift.title,
+        'notes': exception.notes if exception is not None and exception.notes else shift.notes,
+        'is_recurring': bool(shift.is_recurring),
+        'recurring_days': shift.recurring_days,
+        'is_exception': exception is not None,
+        'duration': round((end - start).total_seconds() / 3600, 2),
+        'staff_id': shift.staff_id,
+        'staff_name': staff.name if staff else 'Unknown',
+        'position': staff.position if staff else None,
+        'color': staff.color if staff else None,
+    }
+
+
+@cached('shift', 'shift_exception', 'staff')
+def week_occurrences(monday):
+    """
+    Every shift occurrence starting in the week from monday, in start order
+    """
+    week_begin = datetime.combine(monday, time.min)
+    week_end = week_begin + timedelta(days=7)
+
+    shifts = Shift.query.options(joinedload(Shift.staff)).filter(
+        Shift.start_time < week_end,
+        or_(
+            Shift.is_recurring.is_(True) & or_(
+                Shift.recurrence_end_date.is_(None),
+                Shift.recurrence_end_date >= monday
+            ),
+            Shift.is_recurring.isnot(True) & (Shift.start_time >= week_begin)
+        )
+    ).all()
+
+    recurring = {shift.id: shift for shift in shifts if shift.is_recurring}
+    exceptions = {}
+    if recurring:
+        for exception in ShiftException.query.filter(
+                ShiftException.shift_id.in_(recurring),
+                ShiftException.occurrence_date >= monday,
+                ShiftException.occurrence_date < monday + timedelta(days=7)):
+            exceptions[(exception.shift_id, exception.occurrence_date)] = exception
+
+    occurrences = []
+    for shift in shifts:
+        if not shift.is_recurring:
+            occurrences.append(_occurrence(shift, shift.start_time, shift.end_time, shift.start_time.date()))
+            continue
+
+        first_day = shift.start_time.date()
+        length = shift.end_time - shift.start_time
+        weekdays = _weekdays(shift)
+        for offset in range(7):
+            day = monday + timedelta(days=offset)
+            if day.weekday() not in weekdays or day < first_day:
+                continue
+            if shift.recurrence_end_date is not None and day > shift.recurrence_end_date:
+                continue
+
+            exception = exceptions.get((shift.id, day))
+            if exception is not None and exception.is_cancelled:
+                continue
+            if exception is not None and exception.start_time and exception.end_time:
+                start, end = exception.start_time, exception.end_time
+            else:
+                start = datetime.combine(day, shift.start_time.time())
+                end = start + length
+            occurrences.append(_occurrence(shift, start, end, day, exception))
+
+    occurrences.sort(key=lambda occurrence: (occurrence['start'], occurrence['shift_id']))
+    return occurrences
+
+
+def occurrences_between(start, end):
+    """
+    Shift occurrences overlapping [start, end), expanded a cached week at
+    a time. Includes the week before start, whose overnight or moved
+    occurrences may run into the window.
+    """
+    if isinstance(start, date) and not isinstance(start, datetime):
+        start = datetime.combine(start, time.min)
+    if isinstance(end, date) and not isinstance(end, datetime):
+        end = datetime.combine(end, time.min)
+
+    occurrences = []
+    monday = week_start(start.date()) - timedelta(days=7)
+    while datetime.combine(monday, time.min) < end:
+        occurrences.extend(
+            occurrence for occurrence in week_occurrences(monday)
+            if occurrence['start'] < end and occurrence['end'] > start
+        )
+        monday += timedelta(days=7)
+    return occurrences
+
+
+def occurrences_on(day):
+    """
+    Shift occurrences overlapping one calendar day
+    """
+    return occurrences_between(day, day + timedelta(days=1))
@@ -1,9 +1,12 @@
-from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify
+from flask import Blueprint, render_template, flash, redirect, url_for, request, jsonify, abort
 from flask_login import login_required, current_user
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from app import db
-from models import Staff, Shift
+from models import Staff, Shift, ShiftException
 from forms import StaffForm, ShiftForm
+from versioning import conditional_on
+from queries import shifts_with_staff, has_shifts
+from shift_occurrences import occurrences_between
 
 # Blueprint for staff routes
 staff_bp = Blueprint('staff', __name__)
@@ -103,7 +106,7 @@ def delete_staff(id):
     staff = Staff.query.get_or_404(id)
     
     # Check if staff has shifts
-    if staff.shifts:
+    if has_shifts(staff.id):
         flash('Cannot delete staff member with associated shifts. Remove the shifts first or make the staff inactive.', 'danger')
         return redirect(url_for('staff.staff_list'))
     
@@ -119,7 +122,7 @@ def shift_list():
     """
     Display list of all shifts
     """
-    shifts = Shift.query.order_by(Shift.start_time.desc()).all()
+    shifts = shifts_with_staff()
     return render_template('staff/shift_list.html', shifts=shifts, title='Shift Management')
 
 @staff_bp.route('/shifts/create', methods=['GET', 'POST'])
@@ -174,6 +177,7 @@ def create_shift():
             end_time=end_datetime,
             is_recurring=form.is_recurring.data,
             recurring_days=recurring_days_str,
+            recurrence_end_date=form.end_date.data if form.is_recurring.data else None,
             notes=form.notes.data
         )
         db.session.add(shift)
@@ -217,7 +221,8 @@ def edit_shift(id):
             form.friday.data = 'Fri' in days
             form.saturday.data = 'Sat' in days
             form.sunday.data = 'Sun' in days
-            
+        
+        form.end_date.data = shift.recurrence_end_date
         form.notes.data = shift.notes
     
     if form.validate_on_submit():
@@ -260,6 +265,7 @@ def edit_shift(id):
         shift.end_time = end_datetime
         shift.is_recurring = form.is_recurring.data
         shift.recurring_days = recurring_days_str
+        shift.recurrence_end_date = form.end_date.data if form.is_recurring.data else None
         shift.notes = form.notes.data
         shift.updated_at = datetime.utcnow()
         
@@ -292,19 +298,22 @@ def schedule():
 
 @staff_bp.route('/schedule/data', methods=['GET'])
 @login_required
+@conditional_on('shift', 'shift_exception', 'staff')
 def schedule_data():
     """
     API endpoint for calendar events
     """
     # Get date range from request or use default (1 month)
-    start_date = request.args.get('start', (datetime.utcnow() - timedelta(days=7)).strftime('%Y-%m-%d'))
-    end_date = request.args.get('end', (datetime.utcnow() + timedelta(days=31)).strftime('%Y-%m-%d'))
+    try:
+        start = datetime.fromisoformat(request.args['start'][:19]) if 'start' in request.args else None
+        end = datetime.fromisoformat(request.args['end'][:19]) if 'end' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'start and end must be ISO dates'}), 400
+    start = start or datetime.utcnow() - timedelta(days=7)
+    end = end or datetime.utcnow() + timedelta(days=31)
     
-    # Query shifts within date range
-    shifts = Shift.query.filter(
-        Shift.start_time >= start_date,
-        Shift.end_time <= end_date
-    ).all()
+    # Recurring shifts are expanded into their occurrences within the range
+    occurrences = occurrences_between(start, end)
     
     # Format for FullCalendar
     events = []
@@ -316,30 +325,58 @@ def schedule_data():
         'server': '#6f42c1'    # purple
     }
     
-    for shift in shifts:
+    for occurrence in occurrences:
         # Get staff position for color coding
-        position = shift.staff.position if shift.staff else 'barista'
+        position = occurrence['position'] or 'barista'
         # Use staff's custom color if available, otherwise use position color
-        color = shift.staff.color if shift.staff and shift.staff.color else staff_colors.get(position, '#6c757d')
+        color = occurrence['color'] or staff_colors.get(position, '#6c757d')
         
         # Use shift title if available, otherwise use staff name and position
-        display_title = shift.title if shift.title else f"{shift.staff.name} ({shift.staff.position.capitalize() if shift.staff and shift.staff.position else 'Staff'})"
+        display_title = occurrence['title'] or f"{occurrence['staff_name']} ({position.capitalize()})"
         
         events.append({
-            'id': shift.id,
+            'id': occurrence['shift_id'],
             'title': display_title,
-            'start': shift.start_time.isoformat(),
-            'end': shift.end_time.isoformat(),
+            'start': occurrence['start'].isoformat(),
+            'end': occurrence['end'].isoformat(),
             'color': color,
             'extendedProps': {
-                'staffId': shift.staff_id,
-                'staffName': shift.staff.name,
+                'shiftId': occurrence['shift_id'],
+                'staffId': occurrence['staff_id'],
+                'staffName': occurrence['staff_name'],
                 'position': position,
-                'notes': shift.notes,
-                'isRecurring': shift.is_recurring,
-                'recurringDays': shift.recurring_days,
-                'duration': shift.duration
+                'notes': occurrence['notes'],
+                'isRecurring': occurrence['is_recurring'],
+                'recurringDays': occurrence['recurring_days'],
+                'occurrenceDate': occurrence['occurrence_date'].isoformat(),
+                'duration': occurrence['duration']
             }
         })
     
-    return jsonify(events)
\ No newline at end of file
+    return jsonify(events)
+
+@staff_bp.route('/shifts/<int:id>/occurrences/<occurrence_date>/cancel', methods=['POST'])
+@login_required
+def cancel_shift_occurrence(id, occurrence_date):
+    """
+    Skip one occurrence of a recurring shift
+    """
+    shift = Shift.query.get_or_404(id)
+    try:
+        day = date.fromisoformat(occurrence_date)
+    except ValueError:
+        abort(404)
+    
+    if not shift.is_recurring:
+        flash('Only recurring shifts have occurrences to skip. Delete the shift instead.', 'warning')
+        return redirect(url_for('staff.schedule'))
+    
+    exception = ShiftException.query.filter_by(shift_id=id, occurrence_date=day).first()
+    if exception is None:
+        exception = ShiftException(shift_id=id, occurrence_date=day)
+        db.session.add(exception)
+    exception.is_cancelled = True
+    exception.start_time = exception.end_time = None
+    db.session.commit()
+    flash(f'Shift skipped on {day.strftime("%a %b %d, %Y")}.', 'success')
+    return redirect(url_for('staff.schedule'))
@@ -0,0 +1,366 @@
+"""
+Contention-safe stock mutations.
+
+Quantities are changed with single UPDATE statements evaluated by the
+database (quantity = quantity + :change), so concurrent writers cannot
+overwrite each other. Withdrawals carry the availability check in the
+WHERE clause, and stock counts that set an absolute quantity use a
+compare-and-swap on the value they read. A write that loses a race for
+the SQLite write lock is rolled back and retried as a whole. Batches of
+transactions are planned in memory and applied with one UPDATE per batch,
+guarded on the quantities they were planned against.
+"""
+import functools
+import logging
+import os
+import random
+import time
+from datetime import date, datetime
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.exc import OperationalError
+from app import db
+from ledger import record_stock_change, record_stock_changes
+from low_stock import low_stock_since_value
+from models import Product, InventoryTransaction
+
+logger = logging.getLogger(__name__)
+
+# Attempts for a stock write that keeps finding the database locked
+STOCK_WRITE_ATTEMPTS = int(os.environ.get('STOCK_WRITE_ATTEMPTS', 8))
+
+# Most lines accepted by one post_transactions call
+MAX_BATCH_LINES = int(os.environ.get('STOCK_BATCH_MAX_LINES', 1000))
+
+TRANSACTION_TYPES = ('purchase', 'usage', 'adjustment')
+
+
+class InsufficientStockError(ValueError):
+    """A withdrawal asked for more than the product has on hand"""
+
+    def __init__(self, product_id, requested):
+        self.product_id = product_id
+        self.requested = requested
+        super().__init__(f'Not enough stock of product {product_id} for {requested}')
+
+
+def is_busy_error(error):
+    """
+    True for SQLite lock contention errors that are worth retrying
+    """
+    message = str(getattr(error, 'orig', error)).lower()
+    return 'database is locked' in message or 'database table is locked' in message
+
+
+def retry_when_busy(func):
+    """
+    Run a complete stock write, rolling back and retrying it with jittered
+    backoff while the database reports lock contention
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        for attempt in range(1, STOCK_WRITE_ATTEMPTS + 1):
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if not is_busy_error(e) or attempt == STOCK_WRITE_ATTEMPTS:
+                    raise
+                logger.debug('Stock write busy, retrying (attempt %s)', attempt)
+                time.sleep(random.uniform(0, 0.01 * 2 ** attempt))
+    return wrapper
+
+
+def _stock_update(product_id, new_quantity):
+    return update(Product).where(Product.id == product_id).values(
+        quantity=new_quantity,
+        low_stock_since=low_stock_since_value(new_quantity),
+        updated_at=datetime.utcnow()
+    ).execution_options(synchronize_session=False)
+
+
+def change_stock(product_id, change):
+    """
+    Add a signed change to a product's quantity in one statement. A
+    withdrawal only applies if enough stock is on hand.
+    """
+    statement = _stock_update(product_id, Product.quantity + change)
+    if change < 0:
+        statement = statement.where(Product.quantity >= -change)
+
+    if db.session.execute(statement).rowcount == 0:
+        if change >= 0:
+            raise LookupError(f'Product {product_id} does not exist')
+        raise InsufficientStockError(product_id, -change)
+
+
+def set_stock(product_id, counted):
+    """
+    Set a product's quantity to a counted value, returning the
+    (previous quantity, signed change) that was applied
+    """
+    while True:
+        current = db.session.scalar(select(Product.quantity).where(Product.id == product_id))
+        if current is None:
+            raise LookupError(f'Product {product_id} does not exist')
+        # Only applies if nobody changed the quantity since it was read
+        statement = _stock_update(product_id, counted).where(Product.quantity == current)
+        if db.session.execute(statement).rowcount == 1:
+            return current, counted - current
+
+
+def transaction_datetime(value, now=None):
+    """
+    Moment a transaction dated value happened. A bare date of today is
+    the current time, so the entry lands after the day's earlier stock
+    movements; a bare earlier or later date is its midnight.
+    """
+    now = now or datetime.utcnow()
+    if value is None:
+        return now
+    if isinstance(value, datetime):
+        return value
+    if value == now.date():
+        return now
+    return datetime.combine(value, datetime.min.time())
+
+
+@retry_when_busy
+def post_transaction(product_id, transaction_type, quantity, transaction_date=None, notes=None,
+                     user_id=None, adjustment_label='Stock count'):
+    """
+    Record an inventory transaction and apply it to the product's stock,
+    its ledger and low-stock state in one committed transaction.
+
+    For purchases and usage, quantity is the amount moved; for adjustments
+    it is the counted quantity and the transaction records the difference.
+    Returns the InventoryTransaction; raises InsufficientStockError if a
+    usage exceeds the stock on hand.
+    """
+    if transaction_type == 'adjustment':
+        previous, change = set_stock(product_id, quantity)
+        notes = notes or f'{adjustment_label}: {previous} -> {quantity}'
+    else:
+        change = quantity if transaction_type == 'purchase' else -quantity
+        change_stock(product_id, change)
+
+    transaction = InventoryTransaction(
+        product_id=product_id,
+        transaction_type=transaction_type,
+        quantity=change if transaction_type == 'adjustment' else quantity,
+        notes=notes,
+        transaction_date=transaction_datetime(transaction_date),
+        created_by=user_id
+    )
+    db.session.add(transaction)
+    db.session.flush()
+    record_stock_change(product_id, change, transaction_type, transaction.transaction_date,
+                        transaction.id, user_id)
+    db.session.commit()
+    return transaction
+
+
+class _StaleStock(Exception):
+    """A product's quantity changed between reading and updating it"""
+
+
+def parse_transaction_line(data):
+    """
+    Validate one batch line of {product_id, transaction_type, quantity,
+    transaction_date?, notes?}. Returns the normalised line; raises
+    ValueError with a message for the caller.
+    """
+    if not isinstance(data, dict):
+        raise ValueError('Each transaction must be an object')
+
+    product_id = data.get('product_id')
+    if not isinstance(product_id, int) or isinstance(product_id, bool):
+        raise ValueError('product_id must be an integer')
+
+    transaction_type = data.get('transaction_type')
+    if transaction_type not in TRANSACTION_TYPES:
+        raise ValueError(f'transaction_type must be one of {", ".join(TRANSACTION_TYPES)}')
+
+    quantity = data.get('quantity')
+    if not isinstance(quantity, (int, float)) or isinstance(quantity, bool):
+        raise ValueError('quantity must be a number')
+    if quantity < 0 or (quantity == 0 and transaction_type != 'adjustment'):
+        raise ValueError('quantity must be positive')
+
+    transaction_date = data.get('transaction_date')
+    if transaction_date is not None:
+        try:
+            if len(transaction_date) == 10:
+                transaction_date = date.fromisoformat(transaction_date)
+            else:
+                transaction_date = datetime.fromisoformat(transaction_date)
+        except (TypeError, ValueError):
+            raise ValueError('transaction_date must be YYYY-MM-DD or YYYY-MM-DDTHH:MM')
+
+    notes = data.get('notes')
+    if notes is not None and not isinstance(notes, str):
+        raise ValueError('notes must be a string')
+
+    return {
+        'product_id': product_id,
+        'transaction_type': transaction_type,
+        'quantity': float(quantity),
+        'transaction_date': transaction_date,
+        'notes': notes,
+    }
+
+
+def _plan_batch(lines, clamp_usage=False):
+    """
+    Work out each line's change against the current quantities, in order.
+    Returns (results, planned lines, {product_id: (read quantity, final quantity)}).
+    """
+    valid_ids = {line['product_id'] for line in lines if not isinstance(line, str)}
+    on_hand = dict(db.session.execute(
+        select(Product.id, Product.quantity).where(Product.id.in_(valid_ids))
+    ).all()) if valid_ids else {}
+    running = dict(on_hand)
+
+    results, planned = [], []
+    for number, line in enumerate(lines, start=1):
+        result = {'line': number}
+        results.append(result)
+        if isinstance(line, str):
+            result.update(status='rejected', error=line)
+            continue
+
+        product_id = line['product_id']
+        result['product_id'] = product_id
+        if product_id not in running:
+            result.update(status='rejected', error=f'Product {product_id} does not exist')
+            continue
+
+        current = running[product_id]
+        quantity = line['quantity']
+        notes = line['notes']
+        if line['transaction_type'] == 'purchase':
+            change = quantity
+        elif line['transaction_type'] == 'usage':
+            if quantity > current:
+                if not clamp_usage:
+                    result.update(status='rejected', error=f'Not enough stock: {current} on hand')
+                    continue
+                # Usage that already happened: deplete what is recorded and report the rest
+                result['shortfall'] = quantity - current
+                notes = f'{notes + "; " if notes else ""}{quantity - current} more used than on hand'
+                quantity = current
+            change = -quantity
+        else:
+            change = quantity - current
+            notes = notes or f'Stock count: {current} -> {quantity}'
+
+        running[product_id] = current + change
+        result.update(status='applied', quantity_after=running[product_id])
+        planned.append((result, line, change, notes))
+
+    touched = {line['product_id'] for _, line, _, _ in planned}
+    return results, planned, {product_id: (on_hand[product_id], running[product_id]) for product_id in touched}
+
+
+def _apply_quantities(quantities, now):
+    """
+    Set every product's new quantity in one executemany UPDATE, guarded on
+    the quantity the batch was planned against
+    """
+    table = Product.__table__
+    statement = update(table).where(
+        table.c.id == bindparam('b_id'),
+        table.c.quantity == bindparam('b_expected')
+    ).values(
+        quantity=bindparam('b_quantity'),
+        low_stock_since=low_stock_since_value(bindparam('b_quantity'), now=now),
+        updated_at=now
+    )
+    params = [
+        {'b_id': product_id, 'b_expected': expected, 'b_quantity': quantity}
+        for product_id, (expected, quantity) in quantities.items()
+    ]
+
+    # Through the session, so product is recorded as written and its caches dropped on commit
+    result = db.session.execute(statement, params)
+    if result.supports_sane_multi_rowcount():
+        matched = result.rowcount
+    else:
+        # Drivers that cannot count an executemany: check row by row
+        result.close()
+        matched = sum(db.session.execute(statement, row).rowcount for row in params)
+    if matched != len(params):
+        raise _StaleStock()
+
+
+@retry_when_busy
+def post_transactions(lines, user_id=None, all_or_nothing=False, clamp_usage=False, import_batch_id=None,
+                      before_commit=None):
+    """
+    Apply a batch of inventory transactions in one committed database
+    transaction. lines are parse_transaction_line() results, or an error
+    message string for a line that failed validation.
+
+    Each product's quantity is updated once with the net effect of its
+    lines, the transactions and ledger entries are inserted in bulk, and a
+    per-line result is returned: {'line', 'status', 'product_id',
+    'transaction_id', 'quantity_after'} for applied lines, or an 'error'
+    for rejected ones. Lines are evaluated in order, so a usage may draw
+    on a purchase earlier in the batch. With all_or_nothing, any rejected
+    line leaves stock untouched and the other lines are marked 'skipped'.
+    With clamp_usage, a usage beyond the stock on hand depletes it to zero
+    and reports the 'shortfall' instead of being rejected. import_batch_id
+    tags the transactions with the sales import that caused them.
+    before_commit(results) is called with the applied results just before
+    the commit, to make related changes in the same database transaction.
+    """
+    if len(lines) > MAX_BATCH_LINES:
+        raise ValueError(f'A batch may hold at most {MAX_BATCH_LINES} transactions')
+
+    while True:
+        results, planned, quantities = _plan_batch(lines, clamp_usage)
+        if not planned or (all_or_nothing and len(planned) < len(lines)):
+            db.session.rollback()
+            for result, _, _, _ in planned:
+                result['status'] = 'skipped'
+                del result['quantity_after']
+            return results
+
+        now = datetime.utcnow()
+        try:
+            _apply_quantities(quantities, now)
+        except _StaleStock:
+            # Someone else moved the stock after it was read: plan again
+            db.session.rollback()
+            continue
+
+        rows = [{
+            'product_id': line['product_id'],
+            'transaction_type': line['transaction_type'],
+            'quantity': change if line['transaction_type'] == 'adjustment' else abs(change),
+            'notes': notes,
+            'transaction_date': transaction_datetime(line['transaction_date'], now),
+            'created_by': user_id,
+            'import_batch_id': import_batch_id,
+        } for _, line, change, notes in planned]
+        # Ids come back in line order; SQLite can only promise that one row at a time
+        table = InventoryTransaction.__table__
+        transaction_ids = db.session.scalars(
+            insert(table).returning(table.c.id, sort_by_parameter_order=True),
+            rows
+        ).all()
+
+        record_stock_changes([{
+            'product_id': row['product_id'],
+            'entry_type': row['transaction_type'],
+            'quantity_change': change,
+            'entry_date': row['transaction_date'],
+            'transaction_id': transaction_id,
+            'created_by': user_id,
+        } for row, transaction_id, (_, _, change, _) in zip(rows, transaction_ids, planned)])
+
+        for (result, _, _, _), transaction_id in zip(planned, transaction_ids):
+            result['transaction_id'] = transaction_id
+        if before_commit is not None:
+            before_commit(results)
+        db.session.commit()
+        return results
@@ -0,0 +1,40 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The app configures its database when it is imported, so point it at a
+# throwaway SQLite file first
+_database = os.path.join(tempfile.mkdtemp(prefix='coffee-tests-'), 'test.db')
+os.environ['DATABASE_URL'] = f'sqlite:///{_database}'
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app as flask_app, db  # noqa: E402
+from cache import cache  # noqa: E402
+from models import User  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config.update(TESTING=True, WTF_CSRF_ENABLED=False)
+    return flask_app
+
+
+@pytest.fixture
+def client(app):
+    """
+    Test client logged in as a fresh user
+    """
+    with app.app_context():
+        user = User.query.filter_by(username='tester').first()
+        if user is None:
+            user = User(username='tester', email='tester@example.com')
+            user.set_password('password1')
+            db.session.add(user)
+            db.session.commit()
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'tester', 'password': 'password1'})
+    cache.clear()
+    return client
@@ -0,0 +1,59 @@
+"""
+Deleting a product removes what only makes sense with it and refuses
+while sales or received orders still refer to it.
+"""
+from datetime import datetime, timedelta
+
+from app import db
+from forecasting import compute_reorder_suggestions
+from models import (Product, Vendor, InventoryTransaction, ReorderSuggestion, PurchaseOrder, PurchaseOrderLine,
+                    Sale)
+
+
+def make_product(name, **values):
+    product = Product(name=name, quantity=values.pop('quantity', 10), min_quantity=2, price=1.0, **values)
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+def test_delete_product_with_reorder_suggestion_and_draft_order(app, client):
+    with app.app_context():
+        vendor = Vendor(name='Delete Vendor')
+        db.session.add(vendor)
+        db.session.flush()
+        product = make_product('Delete Forecast', vendor_id=vendor.id)
+        db.session.add_all(
+            InventoryTransaction(product_id=product.id, transaction_type='usage', quantity=1,
+                                 transaction_date=datetime.utcnow() - timedelta(days=day + 1))
+            for day in range(30)
+        )
+        db.session.add(PurchaseOrder(vendor_id=vendor.id, status='draft',
+                                     lines=[PurchaseOrderLine(product_id=product.id, quantity=5)]))
+        db.session.commit()
+        compute_reorder_suggestions()
+        product_id = product.id
+        assert db.session.get(ReorderSuggestion, product_id) is not None
+
+    response = client.post(f'/inventory/delete/{product_id}')
+
+    assert response.status_code == 302
+    with app.app_context():
+        assert db.session.get(Product, product_id) is None
+        assert db.session.get(ReorderSuggestion, product_id) is None
+        assert PurchaseOrderLine.query.filter_by(product_id=product_id).count() == 0
+
+
+def test_delete_product_with_sales_is_refused(app, client):
+    with app.app_context():
+        product = make_product('Delete Sold')
+        db.session.add(Sale(product_id=product.id, quantity=1, unit_price=2, total=2, sale_date=datetime.utcnow()))
+        db.session.commit()
+        product_id = product.id
+
+    response = client.post(f'/inventory/delete/{product_id}', follow_redirects=True)
+
+    assert response.status_code == 200
+    assert b'Cannot delete product' in response.data
+    with app.app_context():
+        assert db.session.get(Product, product_id) is not None
@@ -0,0 +1,45 @@
+"""
+As-of stock quantities from the ledger.
+"""
+from datetime import date, datetime, timedelta
+
+from app import db
+from ledger import quantity_as_of
+from models import Category, Vendor, Product
+from stock import transaction_datetime
+
+
+def test_bare_date_of_today_is_the_current_time():
+    now = datetime(2026, 3, 4, 15, 30)
+
+    assert transaction_datetime(date(2026, 3, 4), now) == now
+    assert transaction_datetime(date(2026, 3, 1), now) == datetime(2026, 3, 1)
+    assert transaction_datetime(None, now) == now
+    assert transaction_datetime(datetime(2026, 3, 1, 9), now) == datetime(2026, 3, 1, 9)
+
+
+def test_usage_entered_for_today_follows_the_opening_stock(app, client):
+    with app.app_context():
+        category, vendor = Category(name='Ledger Category'), Vendor(name='Ledger Vendor')
+        db.session.add_all([category, vendor])
+        db.session.commit()
+        category_id, vendor_id = category.id, vendor.id
+
+    client.post('/inventory/create', data={
+        'name': 'Ledger Beans', 'unit': 'kg', 'quantity': 10, 'min_quantity': 2, 'price': 5,
+        'category_id': category_id, 'vendor_id': vendor_id,
+    })
+    with app.app_context():
+        product_id = Product.query.filter_by(name='Ledger Beans').one().id
+
+    client.post('/inventory/transaction', data={
+        'product_id': product_id, 'transaction_type': 'usage', 'quantity': 3,
+        'transaction_date': datetime.utcnow().date().isoformat(),
+    })
+
+    with app.app_context():
+        product = db.session.get(Product, product_id)
+        assert product.quantity == 7
+        # Before the product existed there was nothing on hand, nor anything used
+        assert quantity_as_of(product_id, product.created_at) == 0
+        assert quantity_as_of(product_id, datetime.utcnow() + timedelta(seconds=1)) == 7
@@ -0,0 +1,35 @@
+"""
+Applying schema migrations.
+"""
+import threading
+
+from sqlalchemy import create_engine
+
+from migrations import MIGRATIONS, applied_versions, run_migrations
+
+
+def test_processes_starting_together_apply_each_migration_once(tmp_path):
+    url = f'sqlite:///{tmp_path / "fresh.db"}'
+    engines = [create_engine(url, connect_args={'timeout': 30}) for _ in range(4)]
+    barrier = threading.Barrier(len(engines))
+    results, errors = [], []
+
+    def start(engine):
+        barrier.wait()
+        try:
+            results.append(run_migrations(engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=start, args=(engine,)) for engine in engines]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    versions = sorted(version for result in results for version in result)
+    assert versions == sorted(version for version, _ in MIGRATIONS)
+    with engines[0].connect() as connection:
+        assert applied_versions(connection) == set(versions)
+    assert run_migrations(engines[0]) == []
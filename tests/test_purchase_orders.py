@@ -0,0 +1,83 @@
+"""
+Suggested purchase order quantities.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from forecasting import FORECAST_LEAD_TIME_DAYS
+from models import Product, Vendor, InventoryTransaction, ReorderSuggestion, PurchaseOrder, PurchaseOrderLine
+from purchase_orders import PO_SAFETY_MARGIN, PO_USAGE_DAYS, generate_purchase_orders, receive_purchase_order, reorder_needs
+
+
+@pytest.fixture
+def vendor(app):
+    with app.app_context():
+        PurchaseOrderLine.query.delete()
+        PurchaseOrder.query.delete()
+        ReorderSuggestion.query.delete()
+        # Only the products made by a test are low enough to need ordering
+        for product in Product.query:
+            product.min_quantity = -1
+        vendor = Vendor(name='Order Vendor')
+        db.session.add(vendor)
+        db.session.commit()
+        yield vendor
+
+
+def make_product(vendor, name, quantity, min_quantity, unit='each'):
+    product = Product(name=name, unit=unit, quantity=quantity, min_quantity=min_quantity, price=2.0,
+                      vendor_id=vendor.id)
+    db.session.add(product)
+    db.session.commit()
+    return product
+
+
+def need_for(product):
+    return next(need for need in reorder_needs(target_days=14) if need['product_id'] == product.id)
+
+
+def test_without_demand_orders_a_margin_above_the_threshold(vendor):
+    product = make_product(vendor, 'Order Syrup', quantity=0.4, min_quantity=2.5, unit='L')
+
+    need = need_for(product)
+
+    assert need['quantity'] == 3  # ceil(2.5 * 1.25 - 0.4)
+    assert product.quantity + need['quantity'] >= product.min_quantity * (1 + PO_SAFETY_MARGIN)
+
+
+def test_forecast_orders_up_to_reorder_point_plus_cover(vendor):
+    product = make_product(vendor, 'Order Beans', quantity=3, min_quantity=5, unit='kg')
+    db.session.add(ReorderSuggestion(product_id=product.id, method='ewma', daily_demand=2.0, demand_std=0.5,
+                                     lead_time_days=3, safety_stock=1.5, reorder_point=7.5, history_days=60))
+    db.session.commit()
+
+    need = need_for(product)
+
+    assert need['quantity'] == 33  # ceil(7.5 + 2 * 14 - 3)
+    assert need['daily_demand'] == 2.0
+
+
+def test_recent_usage_orders_up_to_lead_time_demand_plus_cover(vendor):
+    product = make_product(vendor, 'Order Milk', quantity=1, min_quantity=2, unit='L')
+    db.session.add(InventoryTransaction(product_id=product.id, transaction_type='usage', quantity=PO_USAGE_DAYS * 4,
+                                        transaction_date=datetime.utcnow() - timedelta(days=1)))
+    db.session.commit()
+
+    need = need_for(product)
+
+    assert need['quantity'] == 4 * FORECAST_LEAD_TIME_DAYS + 4 * 14 - 1
+
+
+def test_received_order_clears_low_stock(vendor):
+    product = make_product(vendor, 'Order Cups', quantity=1, min_quantity=5)
+
+    orders, unassigned = generate_purchase_orders(target_days=14)
+    assert unassigned == 0
+    [order] = orders
+    receive_purchase_order(order)
+
+    db.session.refresh(product)
+    assert product.quantity > product.min_quantity
+    assert product.low_stock_since is None
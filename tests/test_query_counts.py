@@ -0,0 +1,81 @@
+"""
+Upper bounds on the SQL statements each list view issues. The bounds hold
+however many rows the view shows, so an N+1 lazy load shows up as a
+failure here rather than as a slow page.
+"""
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event
+
+from app import db
+from cache import cache
+from models import Category, Vendor, Product, InventoryTransaction, Staff, Shift
+
+ROWS = 25
+
+# A four-week calendar window from this week's Monday
+_today = datetime.utcnow().date()
+WINDOW_START = _today - timedelta(days=_today.weekday())
+WINDOW_END = WINDOW_START + timedelta(weeks=4)
+
+
+@pytest.fixture(scope='module', autouse=True)
+def seeded(app):
+    with app.app_context():
+        now = datetime.utcnow()
+        categories = [Category(name=f'Category {i}') for i in range(ROWS)]
+        vendors = [Vendor(name=f'Vendor {i}') for i in range(ROWS)]
+        db.session.add_all(categories + vendors)
+        db.session.flush()
+
+        products = [Product(name=f'Product {i}', sku=f'SKU-{i}', quantity=i % 3, min_quantity=2, price=1.5,
+                            category_id=categories[i].id, vendor_id=vendors[i].id)
+                    for i in range(ROWS)]
+        db.session.add_all(products)
+        db.session.flush()
+        db.session.add_all(InventoryTransaction(product_id=product.id, transaction_type='purchase', quantity=1)
+                           for product in products)
+
+        staff = [Staff(first_name='Staff', last_name=str(i), position='barista') for i in range(ROWS)]
+        db.session.add_all(staff)
+        db.session.flush()
+        db.session.add_all(Shift(staff_id=member.id, title='Opening', is_recurring=i % 2 == 0,
+                                 start_time=now + timedelta(hours=i), end_time=now + timedelta(hours=i + 4))
+                           for i, member in enumerate(staff))
+        db.session.commit()
+
+
+@contextmanager
+def count_statements(app):
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+@pytest.mark.parametrize('url, limit', [
+    ('/categories', 3),
+    ('/vendors', 3),
+    ('/shifts', 3),
+    # The user, the ETag versions and two per cached week: the four in view and the one before
+    (f'/schedule/data?start={WINDOW_START.isoformat()}&end={WINDOW_END.isoformat()}', 12),
+    ('/dashboard', 12),
+    ('/alerts', 3),
+])
+def test_view_query_count_is_bounded(app, client, url, limit):
+    cache.clear()
+    with count_statements(app) as statements:
+        response = client.get(url)
+
+    assert response.status_code == 200
+    assert len(statements) <= limit, '\n'.join(statements)
@@ -0,0 +1,55 @@
+"""
+Report jobs are reused for identical requests, but not once their worker
+is gone.
+"""
+from datetime import datetime, timedelta
+
+import pytest
+
+import report_jobs
+from app import db
+from models import ReportJob
+from report_jobs import REPORT_STALE_MINUTES, enqueue_report, report_request_key
+
+
+@pytest.fixture
+def submitted(monkeypatch):
+    """
+    Job ids handed to the background executor, which is not started
+    """
+    ids = []
+    monkeypatch.setattr(report_jobs, 'submit_job', lambda func, job_id: ids.append(job_id))
+    return ids
+
+
+def add_job(status, age_minutes):
+    created = datetime.utcnow() - timedelta(minutes=age_minutes)
+    job = ReportJob(report_type='low_stock', export_format='csv', filename='low_stock_report.csv',
+                    request_key=report_request_key('low_stock', None, None, 'csv'), status=status,
+                    created_at=created, started_at=created if status == 'running' else None)
+    db.session.add(job)
+    db.session.commit()
+    return job
+
+
+def test_live_job_is_reused(app, submitted):
+    with app.app_context():
+        ReportJob.query.delete()
+        running = add_job('running', age_minutes=1)
+
+        assert enqueue_report('low_stock', None, None).id == running.id
+        assert submitted == []
+
+
+@pytest.mark.parametrize('status', ['queued', 'running'])
+def test_stale_job_is_failed_and_not_reused(app, submitted, status):
+    with app.app_context():
+        ReportJob.query.delete()
+        stale = add_job(status, age_minutes=REPORT_STALE_MINUTES + 1)
+
+        job = enqueue_report('low_stock', None, None)
+
+        assert job.id != stale.id
+        assert submitted == [job.id]
+        db.session.refresh(stale)
+        assert stale.status == 'failed'
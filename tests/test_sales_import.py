@@ -0,0 +1,97 @@
+"""
+Background sales imports, their deduplication and reverting them.
+"""
+import pytest
+
+from app import db
+from models import Product, RecipeItem, Sale, SalesDailyRollup, ImportBatch, ImportJob
+from sales_import import revert_batch, run_import_job
+
+
+@pytest.fixture
+def latte(app):
+    """
+    A sold product whose recipe uses a quarter litre of milk per unit
+    """
+    with app.app_context():
+        milk = Product(name='Import Milk', unit='L', quantity=100.0, min_quantity=1.0)
+        latte = Product(name='Import Latte', quantity=0.0, min_quantity=-1.0, price=1.5)
+        db.session.add_all([milk, latte])
+        db.session.flush()
+        db.session.add(RecipeItem(product_id=latte.id, ingredient_id=milk.id, quantity=0.25))
+        db.session.commit()
+        yield latte, milk
+
+
+def run_import(tmp_path, name, rows):
+    """
+    Import CSV rows of (product_id, quantity, unit_price, total, date) as
+    the background job would, returning the finished job
+    """
+    path = tmp_path / name
+    lines = ['product_id,quantity,unit_price,total,date'] + [','.join(map(str, row)) for row in rows]
+    path.write_text('\n'.join(lines) + '\n')
+
+    job = ImportJob(filename=name, stored_path=str(path), status='queued')
+    db.session.add(job)
+    db.session.commit()
+    run_import_job(job.id)
+    db.session.expire_all()
+    return db.session.get(ImportJob, job.id)
+
+
+def rollup_of(product):
+    return {
+        (rollup.day.isoformat(), rollup.quantity, rollup.sale_count)
+        for rollup in SalesDailyRollup.query.filter_by(product_id=product.id)
+    }
+
+
+def test_overlapping_upload_only_adds_new_rows(latte, tmp_path):
+    latte, milk = latte
+    first = [(latte.id, 2, 1.5, 3.0, '2031-05-01'), (latte.id, 2, 1.5, 3.0, '2031-05-01')]
+
+    job = run_import(tmp_path, 'first.csv', first)
+    assert (job.status, job.rows_added, job.rows_duplicate) == ('completed', 2, 0)
+
+    # The next export repeats both identical lattes and adds a third one
+    job = run_import(tmp_path, 'second.csv', first + [(latte.id, 2, 1.5, 3.0, '2031-05-01')])
+    assert (job.status, job.rows_added, job.rows_duplicate) == ('completed', 1, 2)
+
+    assert Sale.query.filter_by(product_id=latte.id).count() == 3
+    assert rollup_of(latte) == {('2031-05-01', 6.0, 3)}
+    assert db.session.get(Product, milk.id).quantity == 98.5
+
+
+def test_reuploading_an_imported_file_reuses_its_batch(latte, tmp_path):
+    latte, milk = latte
+    rows = [(latte.id, 4, 1.5, 6.0, '2031-06-01')]
+
+    first = run_import(tmp_path, 'sales.csv', rows)
+    again = run_import(tmp_path, 'sales.csv', rows)
+
+    assert again.status == 'completed'
+    assert again.batch_id == first.batch_id
+    assert (again.rows_added, again.rows_duplicate) == (0, 1)
+    fingerprint = db.session.get(ImportBatch, first.batch_id).fingerprint
+    assert ImportBatch.query.filter_by(fingerprint=fingerprint).count() == 1
+    assert Sale.query.filter_by(product_id=latte.id).count() == 1
+    assert db.session.get(Product, milk.id).quantity == 99
+
+
+def test_revert_restores_rollup_and_ingredient_stock(latte, tmp_path):
+    latte, milk = latte
+    kept = run_import(tmp_path, 'kept.csv', [(latte.id, 4, 1.5, 6.0, '2031-07-01')])
+    reverted = run_import(tmp_path, 'reverted.csv', [
+        (latte.id, 2, 1.5, 3.0, '2031-07-01'),
+        (latte.id, 8, 1.5, 12.0, '2031-07-02'),
+    ])
+    assert kept.status == reverted.status == 'completed'
+    assert db.session.get(Product, milk.id).quantity == 96.5
+
+    removed = revert_batch(db.session.get(ImportBatch, reverted.batch_id))
+
+    assert removed == 2
+    assert db.session.get(ImportBatch, reverted.batch_id).status == 'reverted'
+    assert rollup_of(latte) == {('2031-07-01', 4.0, 1)}
+    assert db.session.get(Product, milk.id).quantity == 99
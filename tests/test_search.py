@@ -0,0 +1,42 @@
+"""
+Product search with and without the SQLite trigram index.
+"""
+from sqlalchemy import create_engine, inspect
+
+import search
+from app import db
+from models import Product
+
+
+def test_search_index_needs_the_trigram_tokenizer(tmp_path, monkeypatch):
+    engine = create_engine(f'sqlite:///{tmp_path / "search.db"}')
+    Product.__table__.create(engine)
+
+    with engine.begin() as connection:
+        assert search.create_search_index(connection) is True
+    assert inspect(engine).has_table(search.FTS_TABLE)
+
+    monkeypatch.setattr(search, 'MIN_TRIGRAM_SQLITE', (99, 0, 0))
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    Product.__table__.create(engine)
+
+    with engine.begin() as connection:
+        assert search.create_search_index(connection) is False
+    assert not inspect(engine).has_table(search.FTS_TABLE)
+
+
+def test_search_falls_back_to_ilike_without_the_index(app, monkeypatch):
+    with app.app_context():
+        db.session.add(Product(name='Search Ethiopia Yirgacheffe', sku='SRCH-ETH-1'))
+        db.session.commit()
+
+        def found(query_text):
+            return [p.name for p in Product.query.filter(*search.product_search_filter(query_text))]
+
+        assert found('yirgach eth') == ['Search Ethiopia Yirgacheffe']
+
+        monkeypatch.setattr(search, '_fts_available', {})
+        monkeypatch.setattr(search, 'MIN_TRIGRAM_SQLITE', (99, 0, 0))
+        assert not search.has_fts_table(db.session.get_bind())
+        assert found('yirgach eth') == ['Search Ethiopia Yirgacheffe']
+        assert found('srch-eth') == ['Search Ethiopia Yirgacheffe']
@@ -0,0 +1,161 @@
+"""
+Contention-safe stock writes.
+"""
+import pytest
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+
+import stock
+from app import db
+from models import Product, InventoryTransaction
+
+
+@pytest.fixture
+def product(app):
+    """
+    A product holding 10 units, as seen from inside an app context
+    """
+    with app.app_context():
+        product = Product(name='Stock Beans', unit='kg', quantity=10.0, min_quantity=2.0)
+        db.session.add(product)
+        db.session.commit()
+        yield product
+
+
+def quantity_of(product):
+    db.session.expire_all()
+    return db.session.get(Product, product.id).quantity
+
+
+def test_busy_stock_write_is_retried(app, monkeypatch):
+    monkeypatch.setattr(stock.time, 'sleep', lambda seconds: None)
+    attempts = []
+
+    @stock.retry_when_busy
+    def write():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OperationalError('UPDATE product', {}, Exception('database is locked'))
+        return 'done'
+
+    with app.app_context():
+        assert write() == 'done'
+    assert len(attempts) == 3
+
+
+def test_withdrawal_only_applies_when_stock_covers_it(product):
+    stock.change_stock(product.id, -4)
+    db.session.commit()
+    assert quantity_of(product) == 6
+
+    with pytest.raises(stock.InsufficientStockError):
+        stock.change_stock(product.id, -7)
+    db.session.rollback()
+    assert quantity_of(product) == 6
+
+
+def test_changes_are_applied_relative_to_the_stored_quantity(product):
+    # Another writer moves the stock after this session loaded the product
+    db.session.execute(update(Product).where(Product.id == product.id).values(quantity=Product.quantity + 5))
+
+    stock.change_stock(product.id, 3)
+    db.session.commit()
+
+    assert quantity_of(product) == 18
+
+
+def test_stock_count_retries_when_the_quantity_moves_under_it(product, monkeypatch):
+    stock_update = stock._stock_update
+    calls = []
+
+    def racing_stock_update(product_id, new_quantity):
+        calls.append(new_quantity)
+        if len(calls) == 1:
+            # A concurrent delivery lands between reading the quantity and swapping it
+            db.session.execute(update(Product).where(Product.id == product_id).values(quantity=Product.quantity + 5))
+        return stock_update(product_id, new_quantity)
+
+    monkeypatch.setattr(stock, '_stock_update', racing_stock_update)
+
+    previous, change = stock.set_stock(product.id, 12)
+    db.session.commit()
+
+    assert len(calls) == 2
+    assert (previous, change) == (15, -3)
+    assert quantity_of(product) == 12
+
+
+def test_stock_count_of_a_missing_product(product):
+    with pytest.raises(LookupError):
+        stock.set_stock(product.id + 1000, 5)
+    with pytest.raises(LookupError):
+        stock.change_stock(product.id + 1000, 5)
+
+
+def line(product, transaction_type, quantity, notes=None):
+    return stock.parse_transaction_line({
+        'product_id': product.id, 'transaction_type': transaction_type, 'quantity': quantity, 'notes': notes,
+    })
+
+
+def test_batch_reports_each_line_in_order(product):
+    results = stock.post_transactions([
+        line(product, 'usage', 4),
+        'quantity must be a number',
+        line(product, 'purchase', 6),
+        line(product, 'usage', 20),
+        line(product, 'adjustment', 9),
+    ])
+
+    assert [result['status'] for result in results] == ['applied', 'rejected', 'applied', 'rejected', 'applied']
+    assert [result.get('quantity_after') for result in results] == [6, None, 12, None, 9]
+    assert results[1]['error'] == 'quantity must be a number'
+    assert results[3]['error'] == 'Not enough stock: 12.0 on hand'
+    assert all(result['transaction_id'] for result in results if result['status'] == 'applied')
+    assert quantity_of(product) == 9
+    assert InventoryTransaction.query.filter_by(product_id=product.id).count() == 3
+
+
+def test_all_or_nothing_batch_skips_every_line_after_a_rejection(product):
+    results = stock.post_transactions([
+        line(product, 'purchase', 5),
+        line(product, 'usage', 30),
+    ], all_or_nothing=True)
+
+    assert [result['status'] for result in results] == ['skipped', 'rejected']
+    assert 'quantity_after' not in results[0]
+    assert quantity_of(product) == 10
+    assert InventoryTransaction.query.filter_by(product_id=product.id).count() == 0
+
+
+def test_clamped_usage_depletes_stock_and_reports_the_shortfall(product):
+    results = stock.post_transactions([line(product, 'usage', 14, notes='Busy morning')], clamp_usage=True)
+
+    assert results[0]['status'] == 'applied'
+    assert results[0]['shortfall'] == 4
+    assert results[0]['quantity_after'] == 0
+    assert quantity_of(product) == 0
+    transaction = db.session.get(InventoryTransaction, results[0]['transaction_id'])
+    assert transaction.quantity == 10
+    assert transaction.notes == 'Busy morning; 4.0 more used than on hand'
+
+
+def test_batch_is_planned_again_when_stock_moves_before_it_is_applied(product, monkeypatch):
+    plan_batch = stock._plan_batch
+    plans = []
+
+    def racing_plan_batch(lines, clamp_usage=False):
+        planned = plan_batch(lines, clamp_usage)
+        plans.append(planned)
+        if len(plans) == 1:
+            db.session.execute(update(Product).where(Product.id == product.id).values(quantity=Product.quantity - 8))
+            db.session.commit()
+        return planned
+
+    monkeypatch.setattr(stock, '_plan_batch', racing_plan_batch)
+
+    results = stock.post_transactions([line(product, 'usage', 3)])
+
+    assert len(plans) == 2
+    assert results[0]['status'] == 'rejected'
+    assert quantity_of(product) == 2
@@ -1,13 +1,54 @@
 from datetime import datetime, timedelta
-from models import Product, Category, InventoryTransaction
+from models import Product, Category, Vendor, InventoryTransaction, ReorderSuggestion
 from app import db
+from cache import cached
 from sqlalchemy import func
+from valuation import inventory_valuation, category_values
 
+def dialect_insert(bind, table):
+    """
+    Dialect-specific INSERT construct supporting ON CONFLICT clauses
+    """
+    dialect = bind.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f'Upserts are not supported on {dialect}')
+    return insert(table)
+
+@cached('product', 'vendor', 'reorder_suggestion')
 def get_low_stock_products():
     """
-    Returns products that are below their minimum stock level
+    Returns products that are below their minimum stock level, as rows with
+    the product columns plus low_stock_since, suggested_min_quantity,
+    vendor_name and vendor_phone
     """
-    return Product.query.filter(Product.quantity <= Product.min_quantity).all()
+    return db.session.query(
+        Product.id,
+        Product.name,
+        Product.sku,
+        Product.quantity,
+        Product.min_quantity,
+        Product.unit,
+        Product.price,
+        Product.low_stock_since,
+        ReorderSuggestion.reorder_point.label('suggested_min_quantity'),
+        Vendor.name.label('vendor_name'),
+        Vendor.phone.label('vendor_phone')
+    ).outerjoin(Vendor, Product.vendor_id == Vendor.id).outerjoin(
+        ReorderSuggestion, ReorderSuggestion.product_id == Product.id
+    ).filter(
+        Product.is_low_stock
+    ).order_by(Product.name).all()
+
+@cached('product')
+def get_low_stock_count():
+    """
+    Returns the number of products at or below their minimum stock level
+    """
+    return db.session.query(func.count(Product.id)).filter(Product.is_low_stock).scalar()
 
 def get_products_by_category():
     """
@@ -25,8 +66,7 @@ def get_inventory_value():
     """
     Calculate the total value of inventory
     """
-    total_value = db.session.query(func.sum(Product.price * Product.quantity)).scalar() or 0
-    return total_value
+    return inventory_valuation()['total_value']
 
 def get_transaction_history(days=7):
     """
@@ -45,22 +85,21 @@ def format_currency(value):
     """
     return f"${value:.2f}"
 
+def get_category_product_counts():
+    """
+    Get the number of products in each category that has any
+    """
+    return [
+        {'name': group['name'], 'count': group['count']}
+        for group in inventory_valuation()['by_category']
+        if group['id'] is not None
+    ]
+
 def get_category_value_distribution():
     """
     Get total inventory value by category
     """
-    categories = Category.query.all()
-    distribution = []
-    
-    for category in categories:
-        total = sum(p.quantity * p.price for p in category.products)
-        if total > 0:
-            distribution.append({
-                'name': category.name,
-                'value': total
-            })
-    
-    return distribution
+    return [{'name': name, 'value': value} for name, value in category_values().items()]
 
 def get_transaction_summary(days=30):
     """
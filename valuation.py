@@ -0,0 +1,71 @@
+"""
+Inventory valuation.
+
+Stock value (quantity x price) and product counts are aggregated in a
+single query grouped by (category, vendor). The handful of resulting cells
+is rolled up into the overall, per-category and per-vendor totals that the
+dashboard, the inventory value report and the template helpers read.
+"""
+from sqlalchemy import func
+from app import db
+from cache import cached
+from models import Product, Category, Vendor
+
+
+def product_value():
+    """
+    SQL expression for the stock value of one product
+    """
+    return Product.quantity * Product.price
+
+
+def _roll_up(cells, key):
+    groups = {}
+    for cell in cells:
+        group_id, name = key(cell)
+        group = groups.setdefault(group_id, {'id': group_id, 'name': name, 'count': 0, 'value': 0.0})
+        group['count'] += cell.product_count
+        group['value'] += cell.value
+    # Named groups in name order, the unassigned group (id None) last
+    return sorted(groups.values(), key=lambda group: (group['id'] is None, group['name'] or ''))
+
+
+@cached('product', 'category', 'vendor')
+def inventory_valuation():
+    """
+    Inventory value and product counts overall, by category and by vendor.
+
+    Returns a dict with total_value, product_count, and by_category /
+    by_vendor lists of {'id', 'name', 'count', 'value'}; products without
+    a category or vendor are grouped under id None.
+    """
+    cells = db.session.query(
+        Product.category_id,
+        Category.name.label('category_name'),
+        Product.vendor_id,
+        Vendor.name.label('vendor_name'),
+        func.count(Product.id).label('product_count'),
+        func.coalesce(func.sum(product_value()), 0.0).label('value')
+    ).outerjoin(Category, Product.category_id == Category.id).outerjoin(
+        Vendor, Product.vendor_id == Vendor.id
+    ).group_by(
+        Product.category_id, Category.name, Product.vendor_id, Vendor.name
+    ).all()
+
+    return {
+        'total_value': sum(cell.value for cell in cells),
+        'product_count': sum(cell.product_count for cell in cells),
+        'by_category': _roll_up(cells, lambda cell: (cell.category_id, cell.category_name)),
+        'by_vendor': _roll_up(cells, lambda cell: (cell.vendor_id, cell.vendor_name)),
+    }
+
+
+def category_values():
+    """
+    {category name: stock value} for categories holding any stock value
+    """
+    return {
+        group['name']: group['value']
+        for group in inventory_valuation()['by_category']
+        if group['id'] is not None and group['value'] > 0
+    }
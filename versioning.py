@@ -0,0 +1,82 @@
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import Session
+from app import db
+from cache import touched_tables
+from models import DataVersion
+from utils import dialect_insert
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_data_versions(session):
+    """
+    Advance the version of every table written in this transaction, inside
+    the same transaction, so all worker processes see the change together
+    """
+    if session.new or session.dirty or session.deleted:
+        session.flush()
+
+    tables = touched_tables(session) - {DataVersion.__tablename__}
+    if not tables:
+        return
+
+    connection = session.connection()
+    for table_name in sorted(tables):
+        result = connection.execute(
+            update(DataVersion.__table__)
+            .where(DataVersion.__table__.c.table_name == table_name)
+            .values(version=DataVersion.__table__.c.version + 1)
+        )
+        if result.rowcount == 0:
+            stmt = dialect_insert(connection, DataVersion.__table__)
+            stmt = stmt.values(table_name=table_name, version=1).on_conflict_do_update(
+                index_elements=[DataVersion.__table__.c.table_name],
+                set_={'version': DataVersion.__table__.c.version + 1}
+            )
+            connection.execute(stmt)
+
+
+def data_versions(*table_names):
+    """
+    Current version of each named table (0 if it was never written)
+    """
+    rows = db.session.execute(
+        select(DataVersion.table_name, DataVersion.version)
+        .where(DataVersion.table_name.in_(table_names))
+    )
+    versions = dict.fromkeys(table_names, 0)
+    versions.update(rows.all())
+    return versions
+
+
+def data_etag(*table_names):
+    """
+    Strong ETag for a response derived from the given tables and the
+    current request's path and query string
+    """
+    versions = data_versions(*table_names)
+    source = '|'.join([request.full_path] + [f'{name}={versions[name]}' for name in table_names])
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+def conditional_on(*table_names):
+    """
+    Answer GET requests with 304 Not Modified when the client's
+    If-None-Match matches the current versions of the given tables,
+    before the view runs any aggregation
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = data_etag(*table_names)
+            if etag in request.if_none_match:
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        return wrapper
+    return decorator